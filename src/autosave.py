@@ -0,0 +1,335 @@
+"""Autosave of the scene in to a snapshot and a journal of the changes
+made after it.
+
+The snapshot is a save file written with save_file. The changes made after
+it are appended to the journal as pickled records that hold the current
+state of the changed parts of the scene. The files are written by a
+background thread so autosaving only has to gather the changed state on
+the GUI thread. When enough records have been written the next autosave
+writes a new snapshot and starts a new journal.
+
+The snapshot refers to the status arrays of the layers instead of copying
+them, so a mapped save isn't read in to memory on the GUI thread. The
+arrays may change while the snapshot is written, but every cell changed
+after the snapshot was taken is also in the journal that follows it, so
+the recovered scene is the same.
+
+A scene that was just loaded isn't written again at all. The loaded file is
+linked in to the session as its snapshot, which is safe because saving
+replaces a file instead of writing over it.
+
+Each snapshot starts a new generation and its journal is named after it.
+The files of the older generation are only removed once the new snapshot
+is complete, so after a crash the newest snapshot and its journal always
+describe the latest autosaved state.
+
+Every running UI autosaves in to its own session directory that it keeps
+locked. A session directory that isn't locked was left behind by a UI
+that didn't close normally.
+"""
+import os
+import glob
+import shutil
+import tempfile
+import threading
+import time
+import Queue
+
+import cPickle as pickle
+
+import save_file
+from surface import SaveSurface
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class RecoveryError(Exception):
+    """Raised when an autosave can't be recovered."""
+    pass
+
+
+class Autosave(object):
+    """Autosaves scenes in to a session directory under the given
+    directory in the background.
+    """
+
+    # Interval of the autosaves in milliseconds
+    INTERVAL = 5000
+    # Number of records written before the journal is compacted
+    SNAPSHOT_RECORDS = 1000
+    # Age in seconds after which an unlocked session without a snapshot is
+    # removed. Younger ones may belong to a UI that is just starting.
+    STALE_AGE = 60
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.session = None
+        self.lock = None
+        self.recovery = None
+        self.recovery_lock = None
+        self.recovered = None
+        # Set by the writer once the first snapshot of the session is written
+        self.snapshot_written = False
+        self.scene = None
+        self.generation = 0
+        self.records = 0
+        self.error = None
+        self.queue = Queue.Queue()
+        self.thread = None
+
+    def path(self, name, generation, session=None):
+        """Return the path of the snapshot or journal of a generation."""
+        if session is None:
+            session = self.session
+        return os.path.join(session, "%s.%d" % (name, generation))
+
+    def generations(self, session):
+        """Return the generations of the complete snapshots of a session."""
+        paths = glob.glob(os.path.join(session, "snapshot.*"))
+        return sorted(int(ext[1:]) for ext in (os.path.splitext(path)[1] for path in paths)
+                      if ext[1:].isdigit())
+
+    def hasRecovery(self):
+        """Check if a UI that didn't close normally left an autosave
+        behind. The newest such session is locked to be recovered.
+        """
+        if self.recovery is not None:
+            return True
+        sessions = []
+        for session in glob.glob(os.path.join(self.directory, "session.*")):
+            lock = lockSession(session)
+            if lock is None:
+                # The session belongs to a running UI
+                continue
+            generations = self.generations(session)
+            if generations:
+                path = self.path("snapshot", generations[-1], session)
+                sessions.append((os.path.getmtime(path), session, lock))
+                continue
+            lock.close()
+            try:
+                if time.time() - os.path.getmtime(session) > self.STALE_AGE:
+                    shutil.rmtree(session)
+            except OSError:
+                pass
+        if not sessions:
+            return False
+        sessions.sort()
+        for mtime, session, lock in sessions[:-1]:
+            # The older sessions are offered on the next starts
+            lock.close()
+        self.recovery_lock, self.recovery = sessions[-1][2], sessions[-1][1]
+        return True
+
+    def recover(self):
+        """Return the SaveScene autosaved by the session found with
+        hasRecovery. The session is removed once the recovered scene has
+        been autosaved.
+        """
+        generation = self.generations(self.recovery)[-1]
+        try:
+            with open(self.path("snapshot", generation, self.recovery), "rb") as f:
+                save_scene = save_file.read(f)
+            try:
+                with open(self.path("journal", generation, self.recovery), "rb") as f:
+                    records = readRecords(f)
+            except IOError:
+                records = []
+            applyRecords(save_scene, records)
+        except (save_file.SaveFileError, pickle.UnpicklingError, EOFError, ValueError,
+                TypeError, IndexError, KeyError, AttributeError, ImportError) as e:
+            raise RecoveryError("The autosave is corrupted: %s" % e)
+        self.recovered = self.recovery
+        return save_scene
+
+    def loaded(self, scene, path):
+        """Start autosaving the scene loaded from the save file at path.
+        The file is linked in to the session as the snapshot of the scene
+        instead of writing the scene again.
+        """
+        self.scene = scene
+        self.generation += 1
+        self.records = 0
+        scene.changes.clear()
+        self.queue.put(("link", self.generation, os.path.abspath(path)))
+
+    def discardRecovery(self):
+        """Remove the autosave found with hasRecovery."""
+        if self.recovery is not None:
+            removeSession(self.recovery, self.recovery_lock)
+            self.recovery = self.recovery_lock = self.recovered = None
+
+    def start(self):
+        """Create the session directory and start the writer."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.session = tempfile.mkdtemp(prefix="session.", dir=self.directory)
+        self.lock = lockSession(self.session)
+        self.generation = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the writer and remove the session since the scene was
+        closed normally.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            removeSession(self.session, self.lock)
+            self.session = self.lock = None
+
+    def autosave(self, scene):
+        """Queue the changes of the scene made after the last autosave."""
+        if self.recovered is not None and self.snapshot_written:
+            # The recovered scene is now autosaved in this session
+            self.discardRecovery()
+        changes = scene.changes
+        if scene is not self.scene or changes.snapshot or self.records >= self.SNAPSHOT_RECORDS:
+            self.scene = scene
+            self.generation += 1
+            self.records = 0
+            changes.clear()
+            self.queue.put(("snapshot", self.generation, scene.getSaveState(copy=False)))
+        elif not changes.isEmpty():
+            records = changes.takeRecords(scene)
+            self.records += len(records)
+            self.queue.put(("records", self.generation, records))
+
+    def run(self):
+        """Write the queued snapshots and records until stopped. The last
+        error is kept in error.
+        """
+        journal = None
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            kind, generation, data = task
+            try:
+                if kind in ("snapshot", "link"):
+                    if journal is not None:
+                        journal.close()
+                    if kind == "snapshot":
+                        save_file.save(self.path("snapshot", generation), data)
+                    else:
+                        linkFile(data, self.path("snapshot", generation))
+                    journal = open(self.path("journal", generation), "wb")
+                    self.removeOld(generation)
+                    self.snapshot_written = True
+                elif journal is not None:
+                    for record in data:
+                        pickle.dump(record, journal, pickle.HIGHEST_PROTOCOL)
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                self.error = None
+            except (IOError, OSError) as e:
+                self.error = e
+        if journal is not None:
+            journal.close()
+
+    def removeOld(self, generation):
+        """Remove the files of the generations older than generation."""
+        for name in ("snapshot", "journal"):
+            for path in glob.glob(os.path.join(self.session, name + ".*")):
+                ext = os.path.splitext(path)[1][1:]
+                if ext.isdigit() and int(ext) < generation:
+                    os.remove(path)
+
+
+def lockSession(session):
+    """Lock the session directory for this process. Return the open lock
+    file or None if another process holds the lock. The lock is released
+    when the file is closed or the process ends.
+    """
+    try:
+        lock = open(os.path.join(session, "lock"), "a+")
+    except IOError:
+        return None
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, 1)
+    except IOError:
+        lock.close()
+        return None
+    return lock
+
+
+def linkFile(path, target):
+    """Make target a hard link of the file at path, or a copy of it where
+    links aren't supported. The copy is renamed to target once complete.
+    """
+    try:
+        os.link(path, target)
+    except (AttributeError, OSError):
+        shutil.copyfile(path, target + ".tmp")
+        os.rename(target + ".tmp", target)
+
+
+def removeSession(session, lock):
+    """Remove the session directory locked with lock."""
+    for path in glob.glob(os.path.join(session, "*")):
+        if os.path.basename(path) != "lock":
+            os.remove(path)
+    # Windows can't remove the open lock file
+    lock.close()
+    shutil.rmtree(session, ignore_errors=True)
+
+
+def readRecords(f):
+    """Return the records of the journal file f. A record cut short by a
+    crash ends the journal.
+    """
+    unpickler = pickle.Unpickler(f)
+    unpickler.find_global = save_file.findClass
+    records = []
+    while True:
+        try:
+            records.append(unpickler.load())
+        except (EOFError, pickle.UnpicklingError):
+            return records
+
+
+def applyRecords(save_scene, records):
+    """Apply the journal records to the save state of a scene. Layers
+    that weren't saved are created when a record writes to them.
+    """
+    grids = {}
+    def getLayer(layer_n):
+        layers = save_scene.layers
+        if layer_n >= len(layers):
+            layers.extend([None] * (layer_n - len(layers) + 1))
+        if layers[layer_n] is None:
+            layers[layer_n] = SaveSurface.matching(layers[0], save_scene.substrate_atom_types)
+        return layers[layer_n]
+    def getGrid(layer_n):
+        if layer_n not in grids:
+            grids[layer_n] = getLayer(layer_n).getGrid()
+        return grids[layer_n]
+    for record in records:
+        kind = record[0]
+        if kind == "bounds":
+            x, y, width, height = record[1:]
+            for layer_n, layer in enumerate(save_scene.layers):
+                if layer is not None:
+                    layer.x, layer.y, layer.width, layer.height = x, y, width, height
+                    getGrid(layer_n).crop(*layer.gridRect())
+        elif kind == "block":
+            layer_n, left, top, left_status, right_status = record[1:]
+            getGrid(layer_n).setRect(left, top, left_status, right_status)
+        elif kind == "cells":
+            getGrid(record[1]).setCells(*record[2:])
+        elif kind == "items":
+            layer_n, items = record[1:]
+            getLayer(layer_n).child_items = items
+    for layer_n, grid in grids.iteritems():
+        save_scene.layers[layer_n].setGrid(grid)
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+from PyQt4 import QtGui, QtCore
+
+
+class BackgroundGrid(object):
+    """Paints the background of the scene with a grid of faint lines
+    SPACING apart and thick lines along the axes.
+
+    The faint grid is painted by filling the exposed area with a texture
+    of a single grid square. The texture is rendered once for every zoom
+    level and the most recently used ones are cached.
+    """
+
+    SPACING = 100
+    MAX_PATTERNS = 8
+    BACKGROUND = QtGui.QColor(255, 255, 255)
+    FAINT_PEN = QtGui.QPen(QtGui.QColor(150, 150, 150), 1, QtCore.Qt.SolidLine)
+    SOLID_PEN = QtGui.QPen(QtGui.QColor(0, 0, 0), 4, QtCore.Qt.SolidLine)
+
+    def __init__(self):
+        self.patterns = OrderedDict()
+
+    def pattern(self, scale):
+        """Return the brush painting the faint grid at the given scale."""
+        key = round(scale, 4)
+        brush = self.patterns.pop(key, None)
+        if brush is None:
+            brush = self.createPattern(scale)
+        self.patterns[key] = brush
+        while len(self.patterns) > self.MAX_PATTERNS:
+            self.patterns.popitem(last=False)
+        return brush
+
+    def createPattern(self, scale):
+        """Render the texture of a single grid square at the given scale."""
+        size = max(int(round(self.SPACING * scale)), 1)
+        tile = QtGui.QPixmap(size, size)
+        tile.fill(self.BACKGROUND)
+        painter = QtGui.QPainter(tile)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
+        painter.scale(float(size) / self.SPACING, float(size) / self.SPACING)
+        painter.setPen(self.FAINT_PEN)
+        # Each line is split between the squares on both of its sides
+        painter.drawLines([QtCore.QLineF(0, 0, self.SPACING, 0),
+                           QtCore.QLineF(0, self.SPACING, self.SPACING, self.SPACING),
+                           QtCore.QLineF(0, 0, 0, self.SPACING),
+                           QtCore.QLineF(self.SPACING, 0, self.SPACING, self.SPACING)])
+        painter.end()
+        brush = QtGui.QBrush(tile)
+        # Map the texture back to exactly one grid square in the scene
+        brush.setTransform(QtGui.QTransform.fromScale(float(self.SPACING) / size,
+                                                      float(self.SPACING) / size))
+        return brush
+
+    def paint(self, painter, rect):
+        """Paint the background inside rect in scene coordinates."""
+        scale = QtGui.QStyleOptionGraphicsItem.levelOfDetailFromTransform(
+            painter.worldTransform())
+        painter.fillRect(rect, self.pattern(scale))
+        painter.setPen(self.SOLID_PEN)
+        painter.drawLines([QtCore.QLineF(0, rect.top(), 0, rect.bottom()),
+                           QtCore.QLineF(rect.left(), 0, rect.right(), 0)])
@@ -0,0 +1,100 @@
+"""Create .xyz outputs from saved setups without opening the UI.
+
+Example:
+    python batch_export.py --layers 4 --jobs 8 ../saves/*
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import traceback
+
+import sip
+API_NAMES = ["QDate", "QDateTime", "QString", "QTextStream", "QTime", "QUrl", "QVariant"]
+API_VERSION = 2
+for api_name in API_NAMES:
+    sip.setapi(api_name, API_VERSION)
+
+import output
+import save_file
+
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+def exportSave(job):
+    """Write the output of a single save file. Return the name of the
+    save file and the error message if the export failed.
+    """
+    save_path, output_file, overrides, processes = job
+    try:
+        with open(save_path, "rb") as f:
+            scene = save_file.read(f, mapped=True)
+        options = scene.getOptions()
+        for key, value in overrides.items():
+            if value is not None:
+                options[key] = value
+        output.writeFile(output_file,
+                         lambda out: scene.writeOutput(out, options, processes),
+                         OUTPUT_BUFFER_SIZE)
+    except Exception:
+        return save_path, traceback.format_exc()
+    return save_path, None
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(
+        description="Create .xyz outputs from saved setups without opening the UI.")
+    parser.add_argument("saves", nargs="+", help="save files to export")
+    parser.add_argument("-o", "--output-dir", default=None,
+                        help="directory for the outputs (default: ../output)")
+    parser.add_argument("-l", "--layers", type=int, default=None,
+                        help="number of layers to output in addition to the surface "
+                             "(default: the number of saved layers)")
+    parser.add_argument("--surface-atoms", nargs=5, default=None, metavar="TYPE",
+                        help="surface atom types (default: the saved types)")
+    parser.add_argument("--substrate-atoms", nargs=5, default=None, metavar="TYPE",
+                        help="substrate atom types (default: the saved types)")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="number of worker processes (default: number of cores). "
+                             "A single save is split over the processes by layer")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Export all the save files given on the command line."""
+    args = parseArguments(sys.argv[1:] if argv is None else argv)
+    src_dir = os.path.dirname(os.path.realpath(__file__))
+    if args.output_dir is None:
+        output_dir = os.path.join(src_dir, "..", "output")
+    else:
+        output_dir = os.path.abspath(args.output_dir)
+    overrides = {"layers_to_draw": args.layers,
+                 "surface_atom_types": args.surface_atoms,
+                 "substrate_atom_types": args.substrate_atoms}
+    jobs = []
+    for save_path in args.saves:
+        name = os.path.splitext(os.path.basename(save_path))[0] + ".xyz"
+        jobs.append((os.path.abspath(save_path), os.path.join(output_dir, name), overrides,
+                     args.jobs if len(args.saves) == 1 else 1))
+    # Molecule structures are looked up relative to the src folder
+    os.chdir(src_dir)
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        results = pool.imap_unordered(exportSave, jobs)
+    else:
+        pool = None
+        results = (exportSave(job) for job in jobs)
+    failed = 0
+    for save_path, error in results:
+        if error is None:
+            print "Exported %s" % save_path
+        else:
+            failed += 1
+            print "Failed to export %s:\n%s" % (save_path, error)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Measure how long repainting the view takes at different zoom levels.
+
+The background and the whole scene are timed separately so that the
+cost of the background grid can be told apart from the items.
+
+Example:
+    python benchmark_repaint.py --zoom 0.1 0.5 1 ../saves/large_setup
+"""
+import argparse
+import os
+import sys
+import time
+
+import sip
+API_NAMES = ["QDate", "QDateTime", "QString", "QTextStream", "QTime", "QUrl", "QVariant"]
+API_VERSION = 2
+for api_name in API_NAMES:
+    sip.setapi(api_name, API_VERSION)
+from PyQt4 import QtGui, QtCore
+
+from molecular_scene import MolecularScene
+from molecular_view import MolecularView
+import save_file
+
+
+def timeRepaint(paint, image, repeats):
+    """Return the average time in milliseconds paint(painter) takes."""
+    start = time.time()
+    for i in range(repeats):
+        painter = QtGui.QPainter(image)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
+        paint(painter)
+        painter.end()
+    return (time.time() - start) / repeats * 1000
+
+
+def benchmark(scene, zoom, width, height, repeats):
+    """Return the average background and total repaint times of a view
+    with the given size and zoom centered on the surface.
+    """
+    image = QtGui.QImage(width, height, QtGui.QImage.Format_ARGB32_Premultiplied)
+    source = QtCore.QRectF(0, 0, width / zoom, height / zoom)
+    source.moveCenter(scene.surface.sceneBoundingRect().center())
+    target = QtCore.QRectF(image.rect())
+    def paintBackground(painter):
+        painter.scale(zoom, zoom)
+        painter.translate(-source.topLeft())
+        scene.drawBackground(painter, source)
+    def paintScene(painter):
+        scene.render(painter, target, source)
+    # Fill the caches before timing
+    timeRepaint(paintScene, image, 1)
+    return (timeRepaint(paintBackground, image, repeats),
+            timeRepaint(paintScene, image, repeats))
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(
+        description="Measure how long repainting the view takes.")
+    parser.add_argument("save", nargs="?", default=None,
+                        help="save file to load (default: an empty setup)")
+    parser.add_argument("-z", "--zoom", type=float, nargs="+", default=[0.1, 0.3, 1.0, 2.0],
+                        help="zoom levels to measure")
+    parser.add_argument("-s", "--size", type=int, nargs=2, default=[1280, 800],
+                        metavar=("WIDTH", "HEIGHT"), help="size of the view in pixels")
+    parser.add_argument("-r", "--repeats", type=int, default=20,
+                        help="number of repaints to average over")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Print the repaint times of the given setup."""
+    args = parseArguments(sys.argv[1:] if argv is None else argv)
+    save_path = None if args.save is None else os.path.abspath(args.save)
+    # Settings and molecules are looked up relative to the src folder
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    app = QtGui.QApplication(sys.argv)
+    view = MolecularView(None)
+    if save_path is None:
+        scene = MolecularScene(view)
+    else:
+        with open(save_path, "rb") as f:
+            scene = save_file.read(f, mapped=True).load(view)
+    view.setScene(scene)
+    scene.setLayer(0)
+    width, height = args.size
+    print "%8s %16s %16s %12s" % ("zoom", "background (ms)", "total (ms)", "background")
+    for zoom in args.zoom:
+        background, total = benchmark(scene, zoom, width, height, args.repeats)
+        print "%8.2f %16.2f %16.2f %11.0f%%" % (zoom, background, total,
+                                                 100 * background / total)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""Library of the surface blocks saved in a directory.
+
+Reading every block file to list the blocks gets slow with a large
+library, so the name, size and a small thumbnail of every block are kept
+in a single index file outside of the directory. Opening the library only
+reads the index, and the files are read again only when they have changed since
+they were indexed. The selection saved in a block is read from its file
+when the block is inserted in to a scene.
+"""
+import os
+
+import cPickle as pickle
+import numpy as np
+from PyQt4 import QtGui
+
+from layer_raster import LayerRaster
+from selection_box import SaveSelection
+
+INDEX_VERSION = 1
+
+
+class BlockError(Exception):
+    """Raised when a block file can't be read."""
+
+
+class BlockEntry(object):
+    """Index entry of a saved block."""
+
+    # Maximum width and height of the thumbnail in pixels
+    THUMBNAIL_SIZE = 32
+
+    def __init__(self, path, stat, block):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.mtime = stat.st_mtime
+        self.file_size = stat.st_size
+        left_status, right_status = block.getStatus()
+        self.rows, self.columns = left_status.shape
+        self.thumbnail = thumbnail(left_status, right_status, self.THUMBNAIL_SIZE)
+
+    def isCurrent(self, stat):
+        """Check if the entry was indexed from the file with the given stat."""
+        return self.mtime == stat.st_mtime and self.file_size == stat.st_size
+
+    def load(self):
+        """Read and return the SaveSelection of the block."""
+        return readBlock(self.path)
+
+    def insert(self, surface):
+        """Read the block and insert it on to the surface."""
+        return self.load().insert(surface)
+
+    def icon(self):
+        """Return an icon showing the thumbnail of the block."""
+        height, width = self.thumbnail.shape
+        side = max(width, height)
+        if side == 0:
+            return QtGui.QIcon()
+        # Center the thumbnail on a transparent square with the lines
+        # aligned to 4 bytes
+        pixels = np.zeros((side, side + -side % 4), dtype=np.uint8)
+        top = (side - height) // 2
+        left = (side - width) // 2
+        pixels[top:top + height, left:left + width] = \
+            LayerRaster.colorIndex(self.thumbnail) + 1
+        image = QtGui.QImage(pixels.data, side, side, pixels.shape[1],
+                             QtGui.QImage.Format_Indexed8).copy()
+        image.setColorTable([QtGui.qRgba(0, 0, 0, 0)] + LayerRaster.COLORS)
+        return QtGui.QIcon(QtGui.QPixmap.fromImage(image))
+
+    def toolTip(self):
+        return "%s\n%d x %d cells" % (self.name, self.columns, self.rows)
+
+
+class BlockLibrary(object):
+    """Index of the blocks saved in the given directory. The index is
+    cached in the file index_path.
+    """
+
+    def __init__(self, directory, index_path):
+        self.directory = directory
+        self.index_path = index_path
+        self.entries = {}
+        # Files that aren't blocks by name with the (mtime, size) they had
+        self.skipped = {}
+        self.directory_mtime = None
+
+    def open(self):
+        """Read the index and bring it up to date with the directory."""
+        self.readIndex()
+        self.refresh()
+
+    def refresh(self, rescan=False):
+        """Index the files added to or changed in the directory and forget
+        the removed ones. Unless rescan is True the files are only checked
+        if files have been added or removed since the last refresh. Return
+        the names of the blocks that were added, changed or removed.
+        """
+        try:
+            directory_mtime = os.stat(self.directory).st_mtime
+            names = set(name for name in os.listdir(self.directory)
+                        if not name.startswith(".") and not self.isIndexFile(name))
+        except OSError:
+            directory_mtime = None
+            names = set()
+        if directory_mtime == self.directory_mtime and not rescan:
+            return set()
+        changed = set()
+        for name in (set(self.entries) | set(self.skipped)) - names:
+            if self.removeFile(name):
+                changed.add(name)
+        for name in sorted(names):
+            if self.updateFile(name):
+                changed.add(name)
+        if changed or directory_mtime != self.directory_mtime:
+            self.directory_mtime = directory_mtime
+            self.writeIndex()
+            if self.isIndexFile(os.path.basename(self.index_path)):
+                # Writing an index kept in the directory changes the
+                # directory, which mustn't count as a change of the blocks
+                try:
+                    self.directory_mtime = os.stat(self.directory).st_mtime
+                except OSError:
+                    pass
+        return changed
+
+    def isIndexFile(self, name):
+        """Check if the file name in the directory is the index or its
+        temporary file.
+        """
+        index_path = os.path.abspath(self.index_path)
+        path = os.path.abspath(os.path.join(self.directory, name))
+        return path in (index_path, index_path + ".tmp")
+
+    def updateFile(self, name):
+        """Index the file name if it has changed since it was indexed.
+        Return True if the block was added, changed or removed.
+        """
+        path = os.path.join(self.directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return self.removeFile(name)
+        entry = self.entries.get(name)
+        if entry is not None and entry.isCurrent(stat):
+            return False
+        if self.skipped.get(name) == (stat.st_mtime, stat.st_size):
+            return False
+        try:
+            block = readBlock(path)
+        except BlockError:
+            self.entries.pop(name, None)
+            self.skipped[name] = (stat.st_mtime, stat.st_size)
+            return entry is not None
+        self.entries[name] = BlockEntry(path, stat, block)
+        self.skipped.pop(name, None)
+        return True
+
+    def removeFile(self, name):
+        """Forget the file name. Return True if it was a block."""
+        self.skipped.pop(name, None)
+        return self.entries.pop(name, None) is not None
+
+    def readIndex(self):
+        """Read the index file. A missing or outdated index is ignored and
+        the directory is indexed again.
+        """
+        try:
+            with open(self.index_path, "rb") as f:
+                version, directory_mtime, entries, skipped = pickle.load(f)
+        except Exception:
+            return
+        if version != INDEX_VERSION:
+            return
+        for name, entry in entries.iteritems():
+            # The directory may be reached by a different path than when
+            # the index was written
+            entry.path = os.path.join(self.directory, name)
+        self.entries = entries
+        self.skipped = skipped
+        self.directory_mtime = directory_mtime
+
+    def writeIndex(self):
+        """Write the index file. The index is only a cache so failing to
+        write it is ignored.
+        """
+        path = self.index_path
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump((INDEX_VERSION, self.directory_mtime, self.entries,
+                             self.skipped), f, pickle.HIGHEST_PROTOCOL)
+            # Renaming over an existing file fails on Windows
+            if os.name == "nt" and os.path.exists(path):
+                os.remove(path)
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError):
+            pass
+
+
+def readBlock(path):
+    """Read and return the SaveSelection saved in the block file at path."""
+    try:
+        with open(path, "rb") as f:
+            block = pickle.load(f)
+    except Exception as e:
+        raise BlockError("%s: %s" % (path, e))
+    if not isinstance(block, SaveSelection):
+        raise BlockError("%s: not a surface block" % path)
+    return block
+
+
+def thumbnail(left_status, right_status, size):
+    """Return the statuses of the hydrogen, one pixel per hydrogen, sampled
+    down to at most size x size pixels.
+    """
+    rows, columns = left_status.shape
+    statuses = np.empty((rows, 2 * columns), dtype=left_status.dtype)
+    statuses[:, 0::2] = left_status
+    statuses[:, 1::2] = right_status
+    step = max(-(-max(statuses.shape) // size), 1)
+    return statuses[::step, ::step].copy()
@@ -0,0 +1,107 @@
+import numpy as np
+
+from undo_journal import CellEdit, SurfaceResize
+
+
+class ChangeLog(object):
+    """Keeps track of the parts of a scene changed since the last autosave."""
+
+    def __init__(self):
+        self.clear()
+        # A new scene has to be saved as a whole first
+        self.snapshot = True
+
+    def clear(self):
+        """Forget the changes."""
+        self.cells = {}
+        # (layer, columns, rows) arrays of cells changed in bulk
+        self.cell_arrays = []
+        self.blocks = []
+        self.items = set()
+        # Intersection of the scene rectangles the layers had since the
+        # last autosave, or None if their size hasn't changed
+        self.bounds = None
+        self.snapshot = False
+
+    def cellChanged(self, layer, column, row):
+        """Mark the cell of the layer at (column, row) changed."""
+        self.cells.setdefault(layer, set()).add((column, row))
+
+    def cellsChanged(self, layer, columns, rows):
+        """Mark the cells of the layer at the given columns and rows
+        changed.
+        """
+        self.cell_arrays.append((layer, np.asarray(columns), np.asarray(rows)))
+
+    def blockChanged(self, layer, left, top, right, bottom):
+        """Mark the cells of the layer inside the grid rectangle changed."""
+        self.blocks.append((layer, left, top, right, bottom))
+
+    def boundsChanged(self, rect):
+        """Mark the layers resized to the scene rectangle rect. Cells
+        cropped by any of the sizes stay cropped even if the layers grow
+        back before the next autosave.
+        """
+        if self.bounds is None:
+            self.bounds = rect
+        else:
+            self.bounds = self.bounds.intersected(rect)
+
+    def snapshotNeeded(self):
+        """Mark the scene changed in a way the records can't describe."""
+        self.snapshot = True
+
+    def edited(self, edit):
+        """Mark the items of the layer changed by an edit of the undo
+        journal changed. The hydrogen and the size of the layers are
+        tracked by the layers themselves.
+        """
+        if isinstance(edit, SurfaceResize):
+            return
+        if isinstance(edit, CellEdit):
+            owners = edit.cells
+        elif getattr(edit, "layer", None) is not None:
+            self.items.add(edit.layer)
+            return
+        else:
+            owners = [getattr(edit, "selection", None) or edit.item]
+        for owner in owners:
+            if owner.parentItem() is not None:
+                # The owner is an item on the layer. Items that aren't on
+                # a layer aren't saved.
+                self.items.add(owner.parentItem())
+
+    def isEmpty(self):
+        """Check if nothing has changed since the last autosave."""
+        return not (self.cells or self.cell_arrays or self.blocks or self.items or
+                    self.bounds is not None or self.snapshot)
+
+    def takeRecords(self, scene):
+        """Return the records describing the changes of the scene and
+        forget the changes.
+        """
+        layers = scene.layers
+        records = []
+        if self.bounds is not None:
+            rect = scene.current_layer.rect()
+            if self.bounds != rect:
+                # Crop the cells dropped by a smaller size first
+                records.append(("bounds", self.bounds.x(), self.bounds.y(),
+                                self.bounds.width(), self.bounds.height()))
+            records.append(("bounds", rect.x(), rect.y(), rect.width(), rect.height()))
+        for layer, left, top, right, bottom in self.blocks:
+            left_status, right_status = layer.grid.getRect(left, top, right, bottom)
+            records.append(("block", layers.index(layer), left, top,
+                            left_status, right_status))
+        cell_arrays = list(self.cell_arrays)
+        for layer, cells in self.cells.iteritems():
+            cells = np.array(list(cells), dtype=int)
+            cell_arrays.append((layer, cells[:, 0], cells[:, 1]))
+        for layer, columns, rows in cell_arrays:
+            records.append(("cells", layers.index(layer), columns, rows) +
+                           layer.grid.getCells(columns, rows))
+        for layer in self.items:
+            records.append(("items", layers.index(layer),
+                            [item.getSaveState() for item in layer.childItems()]))
+        self.clear()
+        return records
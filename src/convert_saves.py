@@ -0,0 +1,61 @@
+"""Convert pickled saves in to the binary save format.
+
+The converted saves replace the originals unless an output directory is
+given. Saves that are already in the binary format are skipped.
+
+Example:
+    python convert_saves.py ../saves/*
+"""
+import argparse
+import os
+import sys
+import traceback
+
+import sip
+API_NAMES = ["QDate", "QDateTime", "QString", "QTextStream", "QTime", "QUrl", "QVariant"]
+API_VERSION = 2
+for api_name in API_NAMES:
+    sip.setapi(api_name, API_VERSION)
+
+import save_file
+
+
+def convertSave(save_path, output_path):
+    """Convert a single save. Return a message describing the result."""
+    with open(save_path, "rb") as f:
+        if save_file.isSaveFile(f):
+            return "Skipped %s: already converted" % save_path
+        scene = save_file.read(f)
+    # The original is only replaced once the conversion succeeded
+    save_file.save(output_path, scene)
+    return "Converted %s" % save_path
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(
+        description="Convert pickled saves in to the binary save format.")
+    parser.add_argument("saves", nargs="+", help="save files to convert")
+    parser.add_argument("-o", "--output-dir", default=None,
+                        help="directory for the converted saves "
+                             "(default: replace the originals)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Convert all the save files given on the command line."""
+    args = parseArguments(sys.argv[1:] if argv is None else argv)
+    failed = 0
+    for save_path in args.saves:
+        if args.output_dir is None:
+            output_path = save_path
+        else:
+            output_path = os.path.join(args.output_dir, os.path.basename(save_path))
+        try:
+            print convertSave(save_path, output_path)
+        except Exception:
+            failed += 1
+            print "Failed to convert %s:\n%s" % (save_path, traceback.format_exc())
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
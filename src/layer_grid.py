@@ -0,0 +1,440 @@
+import numpy as np
+
+
+class LayerGrid(object):
+    """Stores the status of every hydrogen pair of a layer.
+
+    The grid covers the rectangle starting from the cell at (column, row).
+    It can grow in every direction. Cells that were never set have status 0.
+
+    Most layers are left in their default state apart from a few edits.
+    While that is the case only the edited cells are stored, in
+    cells[row][column] = (left, right). When the edits become dense enough
+    the grid switches to two status arrays indexed by [row, column], and
+    it switches back when the cells are cleared again. Only one of cells
+    and left_status / right_status is used at a time. The other is None.
+    count is the number of edited cells, or None if they haven't been
+    counted in which case the grid stays dense.
+    """
+
+    DTYPE = np.int8
+    # Switch to the arrays when more than 1 / DENSE_RATIO of the cells are
+    # edited and back to the cells when less than 1 / SPARSE_RATIO are.
+    DENSE_RATIO = 32
+    SPARSE_RATIO = 128
+
+    def __init__(self):
+        self.column = 0
+        self.row = 0
+        self.shape = (0, 0)
+        self.count = 0
+        self.cells = {}
+        self.left_status = None
+        self.right_status = None
+
+    @classmethod
+    def fromArrays(cls, column, row, left_status, right_status):
+        """Return a dense grid that uses the given status arrays without
+        copying or reading them. Memory mapped arrays are only paged in
+        as the cells are accessed.
+        """
+        grid = cls()
+        grid.column = column
+        grid.row = row
+        grid.shape = left_status.shape
+        grid.count = None
+        grid.cells = None
+        grid.left_status = left_status
+        grid.right_status = right_status
+        return grid
+
+    def columns(self):
+        """Return the number of columns covered by the grid."""
+        return self.shape[1]
+
+    def rows(self):
+        """Return the number of rows covered by the grid."""
+        return self.shape[0]
+
+    def bounds(self):
+        """Return the (left, top, right, bottom) grid rectangle
+        covered by the grid.
+        """
+        return (self.column, self.row,
+                self.column + self.columns(), self.row + self.rows())
+
+    def isEmpty(self):
+        """Check if the grid doesn't cover any cells."""
+        return self.columns() == 0 or self.rows() == 0
+
+    def isSparse(self):
+        """Check if only the edited cells are stored."""
+        return self.cells is not None
+
+    def contains(self, column, row):
+        """Check if the cell at (column, row) is covered by the grid."""
+        return (self.column <= column < self.column + self.columns() and
+                self.row <= row < self.row + self.rows())
+
+    def extend(self, left, top, right, bottom):
+        """Grow the grid to cover the given grid rectangle. The new cells
+        are initialised with status 0.
+        """
+        if right <= left or bottom <= top:
+            return
+        if self.isEmpty():
+            new_bounds = (left, top, right, bottom)
+        else:
+            old_left, old_top, old_right, old_bottom = self.bounds()
+            new_bounds = (min(left, old_left), min(top, old_top),
+                          max(right, old_right), max(bottom, old_bottom))
+            if new_bounds == self.bounds():
+                return
+        new_left, new_top, new_right, new_bottom = new_bounds
+        shape = (new_bottom - new_top, new_right - new_left)
+        if not self.isSparse():
+            x = self.column - new_left
+            y = self.row - new_top
+            left_status = np.zeros(shape, dtype=self.DTYPE)
+            right_status = np.zeros(shape, dtype=self.DTYPE)
+            left_status[y:y + self.rows(), x:x + self.columns()] = self.left_status
+            right_status[y:y + self.rows(), x:x + self.columns()] = self.right_status
+            self.left_status = left_status
+            self.right_status = right_status
+        self.column = new_left
+        self.row = new_top
+        self.shape = shape
+        self.updateStorage()
+
+    def crop(self, left, top, right, bottom):
+        """Shrink the grid to the part inside the given grid rectangle and
+        drop the cells outside of it. Return True if the grid shrank.
+        """
+        old_left, old_top, old_right, old_bottom = self.bounds()
+        x0 = max(left, old_left)
+        y0 = max(top, old_top)
+        x1 = min(right, old_right)
+        y1 = min(bottom, old_bottom)
+        if (x0, y0, x1, y1) == self.bounds() or self.isEmpty():
+            return False
+        if x0 >= x1 or y0 >= y1:
+            self.reset()
+            self.column = left
+            self.row = top
+            self.shape = (0, 0)
+            return True
+        if self.isSparse():
+            for row in self.cells.keys():
+                cells = self.cells[row]
+                if not y0 <= row < y1:
+                    self.count -= len(cells)
+                    del self.cells[row]
+                    continue
+                for column in cells.keys():
+                    if not x0 <= column < x1:
+                        self.count -= 1
+                        del cells[column]
+                if not cells:
+                    del self.cells[row]
+        else:
+            src = np.s_[y0 - old_top:y1 - old_top, x0 - old_left:x1 - old_left]
+            if self.count is None:
+                # Mapped arrays aren't copied in to memory
+                self.left_status = self.left_status[src]
+                self.right_status = self.right_status[src]
+            else:
+                self.left_status = self.left_status[src].copy()
+                self.right_status = self.right_status[src].copy()
+                self.count = int(np.count_nonzero(self.left_status | self.right_status))
+        self.column = x0
+        self.row = y0
+        self.shape = (y1 - y0, x1 - x0)
+        self.updateStorage()
+        return True
+
+    def updateStorage(self):
+        """Switch between storing the edited cells and the status arrays
+        based on the fraction of the cells that are edited.
+        """
+        if self.count is None:
+            return
+        area = self.rows() * self.columns()
+        if self.isSparse() and self.count > area // self.DENSE_RATIO:
+            self.makeDense()
+        elif not self.isSparse() and self.count <= area // self.SPARSE_RATIO:
+            self.makeSparse()
+
+    def makeDense(self):
+        """Move the edited cells in to the status arrays."""
+        self.left_status = np.zeros(self.shape, dtype=self.DTYPE)
+        self.right_status = np.zeros(self.shape, dtype=self.DTYPE)
+        for row, cells in self.cells.iteritems():
+            for column, (left, right) in cells.iteritems():
+                self.left_status[row - self.row, column - self.column] = left
+                self.right_status[row - self.row, column - self.column] = right
+        self.cells = None
+
+    def makeSparse(self):
+        """Move the edited cells out of the status arrays."""
+        self.cells = {}
+        for i, j in zip(*np.nonzero(self.left_status | self.right_status)):
+            self.cells.setdefault(self.row + int(i), {})[self.column + int(j)] = \
+                (int(self.left_status[i, j]), int(self.right_status[i, j]))
+        self.left_status = None
+        self.right_status = None
+
+    def getStatus(self, column, row):
+        """Return the (left, right) status of the cell at (column, row)."""
+        if not self.contains(column, row):
+            return 0, 0
+        if self.isSparse():
+            return self.cells.get(row, {}).get(column, (0, 0))
+        i = row - self.row
+        j = column - self.column
+        return int(self.left_status[i, j]), int(self.right_status[i, j])
+
+    def getCells(self, columns, rows):
+        """Return the left and right statuses of the cells at the given
+        columns and rows as arrays.
+        """
+        columns = np.asarray(columns, dtype=int)
+        rows = np.asarray(rows, dtype=int)
+        if self.isSparse():
+            status = np.array([self.cells.get(row, {}).get(column, (0, 0))
+                               for column, row in zip(columns.tolist(), rows.tolist())],
+                              dtype=self.DTYPE).reshape(-1, 2)
+            return status[:, 0], status[:, 1]
+        left_status = np.zeros(len(columns), dtype=self.DTYPE)
+        right_status = np.zeros(len(columns), dtype=self.DTYPE)
+        inside = ((columns >= self.column) & (columns < self.column + self.columns()) &
+                  (rows >= self.row) & (rows < self.row + self.rows()))
+        i = rows[inside] - self.row
+        j = columns[inside] - self.column
+        left_status[inside] = self.left_status[i, j]
+        right_status[inside] = self.right_status[i, j]
+        return left_status, right_status
+
+    def setStatus(self, column, row, left=None, right=None):
+        """Set the status of the cell at (column, row). None leaves the
+        corresponding status untouched.
+        """
+        old = self.getStatus(column, row)
+        new = (old[0] if left is None else int(left),
+               old[1] if right is None else int(right))
+        if new == old:
+            return
+        self.extend(column, row, column + 1, row + 1)
+        if self.count is not None:
+            self.count += (new != (0, 0)) - (old != (0, 0))
+        if self.isSparse():
+            cells = self.cells.setdefault(row, {})
+            if new == (0, 0):
+                del cells[column]
+                if not cells:
+                    del self.cells[row]
+            else:
+                cells[column] = new
+        else:
+            i = row - self.row
+            j = column - self.column
+            self.left_status[i, j], self.right_status[i, j] = new
+        self.updateStorage()
+
+    def getRect(self, left, top, right, bottom):
+        """Return copies of the left and right status arrays of the
+        given grid rectangle. Cells outside of the grid have status 0.
+        """
+        shape = (max(bottom - top, 0), max(right - left, 0))
+        left_status = np.zeros(shape, dtype=self.DTYPE)
+        right_status = np.zeros(shape, dtype=self.DTYPE)
+        old_left, old_top, old_right, old_bottom = self.bounds()
+        x0 = max(left, old_left)
+        y0 = max(top, old_top)
+        x1 = min(right, old_right)
+        y1 = min(bottom, old_bottom)
+        if x0 >= x1 or y0 >= y1:
+            return left_status, right_status
+        if self.isSparse():
+            for row in xrange(y0, y1):
+                for column, (l, r) in self.cells.get(row, {}).iteritems():
+                    if x0 <= column < x1:
+                        left_status[row - top, column - left] = l
+                        right_status[row - top, column - left] = r
+        else:
+            src = np.s_[y0 - old_top:y1 - old_top, x0 - old_left:x1 - old_left]
+            dst = np.s_[y0 - top:y1 - top, x0 - left:x1 - left]
+            left_status[dst] = self.left_status[src]
+            right_status[dst] = self.right_status[src]
+        return left_status, right_status
+
+    def setRect(self, left, top, left_status, right_status):
+        """Copy the given status arrays in to the grid with their first
+        element at (left, top).
+        """
+        rows, columns = left_status.shape
+        if rows == 0 or columns == 0:
+            return
+        if self.count is not None:
+            old_left, old_right = self.getRect(left, top, left + columns, top + rows)
+            self.count += (np.count_nonzero(left_status | right_status) -
+                           np.count_nonzero(old_left | old_right))
+        self.extend(left, top, left + columns, top + rows)
+        if self.isSparse() and self.count > self.rows() * self.columns() // self.DENSE_RATIO:
+            self.makeDense()
+        if self.isSparse():
+            for row in xrange(top, top + rows):
+                cells = self.cells.pop(row, {})
+                for column in cells.keys():
+                    if left <= column < left + columns:
+                        del cells[column]
+                i = row - top
+                for j in np.flatnonzero(left_status[i] | right_status[i]):
+                    cells[left + int(j)] = (int(left_status[i, j]), int(right_status[i, j]))
+                if cells:
+                    self.cells[row] = cells
+        else:
+            dst = np.s_[top - self.row:top - self.row + rows,
+                        left - self.column:left - self.column + columns]
+            self.left_status[dst] = left_status
+            self.right_status[dst] = right_status
+        self.updateStorage()
+
+    def nonDefaultCells(self):
+        """Return the columns, rows, left statuses and right statuses of
+        the cells that don't have status 0 as arrays.
+        """
+        if self.isSparse():
+            cells = [(column, row, left, right)
+                     for row, row_cells in self.cells.iteritems()
+                     for column, (left, right) in row_cells.iteritems()]
+            cells = np.array(cells, dtype=int).reshape(-1, 4)
+            return (cells[:, 0], cells[:, 1],
+                    cells[:, 2].astype(self.DTYPE), cells[:, 3].astype(self.DTYPE))
+        rows, columns = np.nonzero(self.left_status | self.right_status)
+        return (columns + self.column, rows + self.row,
+                self.left_status[rows, columns], self.right_status[rows, columns])
+
+    def cellsOutside(self, left, top, right, bottom):
+        """Return the columns, rows, left statuses and right statuses of
+        the cells outside of the given grid rectangle that don't have
+        status 0. Only the strips of the grid outside of the rectangle are
+        read.
+        """
+        right = max(right, left)
+        bottom = max(bottom, top)
+        old_left, old_top, old_right, old_bottom = self.bounds()
+        middle_top = min(max(top, old_top), old_bottom)
+        middle_bottom = max(min(bottom, old_bottom), middle_top)
+        strips = [(old_left, old_top, old_right, middle_top),
+                  (old_left, middle_bottom, old_right, old_bottom),
+                  (old_left, middle_top, min(left, old_right), middle_bottom),
+                  (max(right, old_left), middle_top, old_right, middle_bottom)]
+        cells = [(np.zeros(0, dtype=int), np.zeros(0, dtype=int),
+                  np.zeros(0, dtype=self.DTYPE), np.zeros(0, dtype=self.DTYPE))]
+        for x0, y0, x1, y1 in strips:
+            if x0 >= x1 or y0 >= y1:
+                continue
+            left_status, right_status = self.getRect(x0, y0, x1, y1)
+            rows, columns = np.nonzero(left_status | right_status)
+            cells.append((columns + x0, rows + y0,
+                          left_status[rows, columns], right_status[rows, columns]))
+        return tuple(np.concatenate(arrays) for arrays in zip(*cells))
+
+    def setCells(self, columns, rows, left_status, right_status):
+        """Set the statuses of the cells at the given columns and rows. A
+        cell given more than once gets the last of its statuses.
+        """
+        columns = np.asarray(columns, dtype=int)
+        rows = np.asarray(rows, dtype=int)
+        left_status = np.asarray(left_status, dtype=self.DTYPE)
+        right_status = np.asarray(right_status, dtype=self.DTYPE)
+        if len(columns) == 0:
+            return
+        self.extend(int(np.min(columns)), int(np.min(rows)),
+                    int(np.max(columns)) + 1, int(np.max(rows)) + 1)
+        if (self.isSparse() and
+                self.count + len(columns) > self.rows() * self.columns() // self.DENSE_RATIO):
+            self.makeDense()
+        if self.isSparse():
+            updates = {}
+            for cell in zip(rows.tolist(), columns.tolist(),
+                            left_status.tolist(), right_status.tolist()):
+                updates.setdefault(cell[0], {})[cell[1]] = cell[2:]
+            for row, row_updates in updates.iteritems():
+                cells = self.cells.pop(row, {})
+                cells.update(row_updates)
+                for column, status in row_updates.iteritems():
+                    if status == (0, 0):
+                        del cells[column]
+                if cells:
+                    self.cells[row] = cells
+            self.count = sum(len(cells) for cells in self.cells.itervalues())
+        else:
+            i = rows - self.row
+            j = columns - self.column
+            if self.count is not None:
+                # Count every changed cell once
+                cells = np.divmod(np.unique(i * self.columns() + j), self.columns())
+                self.count -= np.count_nonzero(self.left_status[cells] | self.right_status[cells])
+            self.left_status[i, j] = left_status
+            self.right_status[i, j] = right_status
+            if self.count is not None:
+                self.count += np.count_nonzero(self.left_status[cells] | self.right_status[cells])
+        self.updateStorage()
+
+    def reset(self):
+        """Set the status of every cell to 0."""
+        self.count = 0
+        self.cells = {}
+        self.left_status = None
+        self.right_status = None
+
+    def copy(self):
+        """Return a copy of the grid."""
+        grid = LayerGrid()
+        grid.column = self.column
+        grid.row = self.row
+        grid.shape = self.shape
+        grid.count = self.count
+        if self.isSparse():
+            grid.cells = dict((row, dict(cells)) for row, cells in self.cells.iteritems())
+        else:
+            grid.cells = None
+            grid.left_status = self.left_status.copy()
+            grid.right_status = self.right_status.copy()
+        return grid
+
+
+class GridCell(object):
+    """Handle to a single hydrogen pair stored in the grid of a layer or
+    in the status arrays of a selection. The owner provides getStatus,
+    setStatus and updateCell for cells given in grid coordinates.
+    """
+
+    def __init__(self, owner, column, row):
+        self.owner = owner
+        self.column = column
+        self.row = row
+
+    @property
+    def left_status(self):
+        return self.owner.getStatus(self.column, self.row)[0]
+
+    @left_status.setter
+    def left_status(self, value):
+        self.owner.setStatus(self.column, self.row, left=value)
+
+    @property
+    def right_status(self):
+        return self.owner.getStatus(self.column, self.row)[1]
+
+    @right_status.setter
+    def right_status(self, value):
+        self.owner.setStatus(self.column, self.row, right=value)
+
+    def reset(self):
+        self.owner.setStatus(self.column, self.row, 0, 0)
+
+    def update(self):
+        """Schedule a redraw of the cell."""
+        self.owner.updateCell(self.column, self.row)
@@ -0,0 +1,76 @@
+from PyQt4 import QtGui, QtCore
+import numpy as np
+
+from atom_pair import AtomPair
+
+
+class LayerRaster(object):
+    """Raster image of a layer grid used to paint zoomed out views.
+
+    The image has one pixel per hydrogen, so two pixels per cell, colored
+    with the brush of its status. The image is built from the grid at once
+    and single cells are updated in place after that.
+    """
+
+    # Most cells updated one by one before the raster is rebuilt instead
+    MAX_CELL_UPDATES = 4096
+
+    COLORS = ([AtomPair.VACANT_BRUSH.color().rgb()] +
+              [brush.color().rgb() for brush in AtomPair.BRUSHES])
+
+    def __init__(self, grid, bounds):
+        self.bounds = bounds
+        left, top, right, bottom = bounds
+        left_status, right_status = grid.getRect(left, top, right, bottom)
+        width = 2 * (right - left)
+        # The lines of the image have to be aligned to 4 bytes
+        pixels = np.zeros((bottom - top, max(width + -width % 4, 4)), dtype=np.uint8)
+        pixels[:, 0:width:2] = self.colorIndex(left_status)
+        pixels[:, 1:width:2] = self.colorIndex(right_status)
+        image = QtGui.QImage(pixels.data, width, bottom - top, pixels.shape[1],
+                             QtGui.QImage.Format_Indexed8)
+        # Copy the pixels so that the image doesn't refer to the array
+        self.image = image.copy()
+        self.image.setColorTable(self.COLORS)
+
+    @staticmethod
+    def colorIndex(status):
+        """Return the color table indices of the given statuses."""
+        return (np.asarray(status) - AtomPair.VACANT).astype(np.uint8)
+
+    def covers(self, bounds):
+        """Check if the raster covers the grid rectangle bounds."""
+        left, top, right, bottom = self.bounds
+        return (left <= bounds[0] and top <= bounds[1] and
+                right >= bounds[2] and bottom >= bounds[3])
+
+    def setCell(self, column, row, left_status, right_status):
+        """Update the pixels of the cell at (column, row)."""
+        left, top, right, bottom = self.bounds
+        if left <= column < right and top <= row < bottom:
+            self.image.setPixel(2*(column - left), row - top,
+                                int(self.colorIndex(left_status)))
+            self.image.setPixel(2*(column - left) + 1, row - top,
+                                int(self.colorIndex(right_status)))
+
+    def setCells(self, columns, rows, left_status, right_status):
+        """Update the pixels of the cells at the given columns and rows.
+        Return False without updating them if there are more than
+        MAX_CELL_UPDATES cells, in which case rebuilding the raster is
+        cheaper.
+        """
+        if len(columns) > self.MAX_CELL_UPDATES:
+            return False
+        for cell in zip(columns, rows, left_status, right_status):
+            self.setCell(*cell)
+        return True
+
+    def paint(self, painter, left, top, right, bottom):
+        """Paint the cells inside the given grid rectangle."""
+        x0 = self.bounds[0]
+        y0 = self.bounds[1]
+        target = QtCore.QRectF(left * AtomPair.XSIZE, top * AtomPair.YSIZE,
+                               (right - left) * AtomPair.XSIZE,
+                               (bottom - top) * AtomPair.YSIZE)
+        source = QtCore.QRectF(2 * (left - x0), top - y0, 2 * (right - left), bottom - top)
+        painter.drawImage(target, self.image, source)
@@ -1,5 +1,7 @@
 import sys
 import os
+import bisect
+import multiprocessing
 
 import cPickle as pickle
 import sip
@@ -12,15 +14,34 @@ from PyQt4 import QtGui, QtCore
 from molecular_view import MolecularView
 from molecular_scene import MolecularScene
 from output_dialog import OutputDialog
+from autosave import Autosave, RecoveryError
+from block_library import BlockLibrary
+import output
+import save_file
 import settings
 
+OUTPUT_BUFFER_SIZE = 1 << 20
+AUTOSAVE_DIRECTORY = "../autosave"
+BLOCK_DIRECTORY = "../blocks"
+BLOCK_INDEX = "../cache/block_index"
+# Delay in milliseconds before the blocks are updated after the blocks
+# directory changed, so that copying many blocks updates them only once
+BLOCK_REFRESH_DELAY = 200
+# Interval in milliseconds of checking the blocks directory for changes
+# when it can't be watched
+BLOCK_POLL_INTERVAL = 5000
+
 
 class MainWindow(QtGui.QMainWindow):
     """The main window of the UI."""
 
-    def __init__(self):
-        """Initialise the main window."""
+    def __init__(self, output_pool=None, output_processes=1):
+        """Initialise the main window. The output is written in parallel
+        by output_pool which has output_processes workers.
+        """
         super(MainWindow, self).__init__()
+        self.output_pool = output_pool
+        self.output_processes = output_processes
         self.setGeometry(100, 100, 800, 500)
         self.setWindowTitle('MolecularUI')
 
@@ -47,33 +68,98 @@ class MainWindow(QtGui.QMainWindow):
         file_menu.addAction(quit_action)
         self.menuBar().addMenu(file_menu)
 
+        edit_menu = QtGui.QMenu("Edit", self)
+
+        undo_action = QtGui.QAction("Undo", self)
+        undo_action.setShortcut(QtGui.QKeySequence("Ctrl+Z"))
+        QtCore.QObject.connect(undo_action, QtCore.SIGNAL("triggered()"),
+                               self.undo)
+
+        redo_action = QtGui.QAction("Redo", self)
+        redo_action.setShortcuts([QtGui.QKeySequence("Ctrl+Y"),
+                                  QtGui.QKeySequence("Ctrl+Shift+Z")])
+        QtCore.QObject.connect(redo_action, QtCore.SIGNAL("triggered()"),
+                               self.redo)
+
+        edit_menu.addAction(undo_action)
+        edit_menu.addAction(redo_action)
+        self.menuBar().addMenu(edit_menu)
+
         self.setCentralWidget(MainWidget(self))
         self.centralWidget().graphics_view.paint_widget.updateLabels()
 
         self.show()
         self.statusBar().showMessage("Ready!", 2000)
 
+        self.autosave = Autosave(AUTOSAVE_DIRECTORY)
+        if self.autosave.hasRecovery():
+            self.recover()
+        self.autosave.start()
+        self.autosave_timer = QtCore.QTimer(self)
+        QtCore.QObject.connect(self.autosave_timer, QtCore.SIGNAL("timeout()"),
+                               self.autosaveScene)
+        self.autosave_timer.start(Autosave.INTERVAL)
+
+    def recover(self):
+        """Offer to recover the setup autosaved by a session that didn't
+        close normally.
+        """
+        value = QtGui.QMessageBox.question(
+            self, "Recover", "The previous session didn't close normally. "
+            "Do you want to recover the autosaved setup?",
+            QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.Yes)
+        if value == QtGui.QMessageBox.Yes:
+            try:
+                SaveState(self.autosave.recover()).load(self)
+                self.statusBar().showMessage("Recovered the autosaved setup.", 2000)
+                return
+            except (IOError, RecoveryError):
+                self.statusBar().showMessage("The autosaved setup couldn't be read.", 3000)
+        self.autosave.discardRecovery()
+
+    def autosaveScene(self):
+        """Autosave the changes of the current setup in the background."""
+        if self.autosave.error is not None:
+            self.statusBar().showMessage("Autosave failed: %s" % self.autosave.error, 3000)
+        self.autosave.autosave(self.centralWidget().graphics_scene)
+
+    def closeEvent(self, event):
+        """Stop autosaving when the window is closed."""
+        self.autosave_timer.stop()
+        self.autosave.stop()
+        super(MainWindow, self).closeEvent(event)
+
     def save(self):
         """Get the save state of the program and save it to the location
         returned from the file dialog."""
         self.statusBar().showMessage("Creating save state...", 10000)
         save_state = SaveState.create(self)
-        save_file = QtGui.QFileDialog().getSaveFileName(self, "Save Setup", "../saves")
-        if save_file:
-            with open(save_file, "w") as f:
-                pickle.dump(save_state, f)
-                self.statusBar().showMessage("Creating save state... Done!", 2000)
+        save_file_name = QtGui.QFileDialog().getSaveFileName(self, "Save Setup", "../saves")
+        if save_file_name:
+            save_file.save(save_file_name, save_state.scene)
+            self.statusBar().showMessage("Creating save state... Done!", 2000)
         else:
             self.statusBar().showMessage("Creating save state... Failed!", 2000)
 
+    def undo(self):
+        """Undo the latest edit of the current setup."""
+        if not self.centralWidget().graphics_scene.undo():
+            self.statusBar().showMessage("Nothing to undo.", 2000)
+
+    def redo(self):
+        """Redo the latest undone edit of the current setup."""
+        if not self.centralWidget().graphics_scene.redo():
+            self.statusBar().showMessage("Nothing to redo.", 2000)
+
     def saveBlock(self, block):
         """Save the setup currently selected."""
         self.statusBar().showMessage("Creating save state...", 10000)
         save_state = block.getSaveState()
-        save_file = QtGui.QFileDialog().getSaveFileName(self, "Save Block", "../blocks")
-        if save_file:
-            with open(save_file, "w") as f:
-                pickle.dump(save_state, f)
+        path = QtGui.QFileDialog().getSaveFileName(self, "Save Block", BLOCK_DIRECTORY)
+        if path:
+            # The binary protocol stores the status arrays as raw bytes
+            with open(path, "wb") as f:
+                pickle.dump(save_state, f, pickle.HIGHEST_PROTOCOL)
                 self.statusBar().showMessage("Creating save state... Done!", 2000)
                 f.close()
         else:
@@ -84,10 +170,11 @@ class MainWindow(QtGui.QMainWindow):
         self.statusBar().showMessage("Loading save state...", 10000)
         load_file = QtGui.QFileDialog().getOpenFileName(self, "Load Setup", "../saves")
         if load_file:
-            with open(load_file, "r") as f:
-                save_state = pickle.load(f)
+            with open(load_file, "rb") as f:
+                save_state = SaveState(save_file.read(f, mapped=True))
                 save_state.load(self)
-                self.statusBar().showMessage("Loading save state... Done!", 2000)
+            self.autosave.loaded(self.centralWidget().graphics_scene, load_file)
+            self.statusBar().showMessage("Loading save state... Done!", 2000)
         else:
             self.statusBar().showMessage("Loading save state... Failed!", 2000)
 
@@ -96,8 +183,8 @@ class MainWindow(QtGui.QMainWindow):
         self.statusBar().showMessage("Inserting save state...", 10000)
         load_file = QtGui.QFileDialog().getOpenFileName(self, "Insert Setup", "../saves")
         if load_file:
-            with open(load_file, "r") as f:
-                save_state = pickle.load(f)
+            with open(load_file, "rb") as f:
+                save_state = SaveState(save_file.read(f, mapped=True))
                 save_state.insert(self)
                 self.statusBar().showMessage("Inserting save state... Done!", 2000)
         else:
@@ -149,7 +236,11 @@ class MainWidget(QtGui.QWidget):
 
         # Load the molecules into the tree_widget
         self.top_items = None
+        self.block_library = BlockLibrary(BLOCK_DIRECTORY, BLOCK_INDEX)
+        self.block_library.open()
+        self.block_items = {}
         self.loadItems(self.tree_widget)
+        self.watchBlocks()
 
         # Set up the graphics view for the machine and set the scene
         self.graphics_view = MolecularView(self)
@@ -194,26 +285,73 @@ class MainWidget(QtGui.QWidget):
             sub_item.setData(0, QtCore.Qt.UserRole+1, item)
 
     def loadSurfaceBlocks(self):
-        """Load surface blocks under the corresponding top item."""
-        files = os.listdir("../blocks/")
-        files.sort()
-        for file_name in files:
-            try:
-                load_file = "../blocks/" + file_name
-                with open(load_file, "r") as f:
-                    block = pickle.load(f)
-                    sub_item = QtGui.QTreeWidgetItem(self.top_items["Surface Blocks"])
-                    sub_item.setText(0, file_name)
-                    sub_item.setData(0, QtCore.Qt.UserRole, "BLOCK")
-                    sub_item.setData(0, QtCore.Qt.UserRole+1, block)
-            # The file didn't have proper type
-            except pickle.UnpicklingError:
-                pass
+        """Load surface blocks under the corresponding top item. Only the
+        index entries of the blocks are loaded, the blocks themselves are
+        read when they are dropped on to the scene.
+        """
+        self.updateBlockItems(self.block_library.entries)
+
+    def watchBlocks(self):
+        """Update the surface blocks when files are added to, changed in
+        or removed from the blocks directory. The directory is polled if
+        it can't be watched.
+        """
+        self.block_refresh_timer = QtCore.QTimer(self)
+        self.block_refresh_timer.setSingleShot(True)
+        QtCore.QObject.connect(self.block_refresh_timer, QtCore.SIGNAL("timeout()"),
+                               self.updateBlocks)
+        self.block_watcher = QtCore.QFileSystemWatcher(self)
+        self.block_watcher.addPath(BLOCK_DIRECTORY)
+        QtCore.QObject.connect(self.block_watcher,
+                               QtCore.SIGNAL("directoryChanged(QString)"),
+                               self.blockDirectoryChanged)
+        if not self.block_watcher.directories():
+            self.block_poll_timer = QtCore.QTimer(self)
+            QtCore.QObject.connect(self.block_poll_timer, QtCore.SIGNAL("timeout()"),
+                                   self.pollBlocks)
+            self.block_poll_timer.start(BLOCK_POLL_INTERVAL)
+
+    def blockDirectoryChanged(self, path):
+        """Update the surface blocks once the directory stops changing."""
+        self.block_refresh_timer.start(BLOCK_REFRESH_DELAY)
+
+    def pollBlocks(self):
+        """Update the surface blocks if files have been added to or
+        removed from the blocks directory.
+        """
+        self.updateBlockItems(self.block_library.refresh())
 
     def updateBlocks(self):
-        """Update the list of available surface blocks."""
-        self.top_items["Surface Blocks"].takeChildren()
-        self.loadSurfaceBlocks()
+        """Update the surface blocks that have changed in the blocks
+        directory.
+        """
+        self.updateBlockItems(self.block_library.refresh(rescan=True))
+
+    def updateBlockItems(self, names):
+        """Update the tree items of the named surface blocks to match their
+        entries in the block library.
+        """
+        top_item = self.top_items["Surface Blocks"]
+        for name in names:
+            item = self.block_items.pop(name, None)
+            if item is not None:
+                top_item.removeChild(item)
+        # Keep the items sorted by name
+        block_names = sorted(self.block_items)
+        for name in sorted(names):
+            entry = self.block_library.entries.get(name)
+            if entry is None:
+                continue
+            sub_item = QtGui.QTreeWidgetItem()
+            sub_item.setText(0, entry.name)
+            sub_item.setIcon(0, entry.icon())
+            sub_item.setToolTip(0, entry.toolTip())
+            sub_item.setData(0, QtCore.Qt.UserRole, "BLOCK")
+            sub_item.setData(0, QtCore.Qt.UserRole+1, entry)
+            index = bisect.bisect(block_names, name)
+            block_names.insert(index, name)
+            top_item.insertChild(index, sub_item)
+            self.block_items[name] = sub_item
 
     def createOutput(self):
         """Create a output file from the current state of the scene."""
@@ -224,24 +362,22 @@ class MainWidget(QtGui.QWidget):
             status_bar.showMessage("Creating output... Cancelled!", 2000)
             return
         options = output_dialog.getOptions()
-        save_file = QtGui.QFileDialog.getSaveFileName(self, "Save output", "../output", "*.xyz")
-        if not save_file:
+        path = QtGui.QFileDialog.getSaveFileName(self, "Save output", "../output", "*.xyz")
+        if not path:
             status_bar.showMessage("Creating output... Cancelled!", 2000)
             return
+        if not path.endswith(".xyz"):
+            path = path + ".xyz"
+        # Stream the atoms straight to the savefile
+        def write(out):
+            window = self.window()
+            self.graphics_scene.writeOutput(out, options, window.output_processes,
+                                            window.output_pool)
         try:
-            result = self.graphics_scene.getOutput(options)
-        except IOError:
+            output.writeFile(path, write, OUTPUT_BUFFER_SIZE)
+        except (IOError, ValueError):
             status_bar.showMessage("Creating output... Failed!", 2000)
             return
-        if not save_file.endswith(".xyz"):
-            save_file = save_file + ".xyz"
-        # Write all the lines to the savefile
-        with open(save_file, 'w') as out:
-            out.write(str(len(result)))
-            out.write("\n\n")
-            for line in result:
-                out.write(line)
-                out.write("\n")
         status_bar.showMessage("Creating output... Done!", 2000)
         self.graphics_view.paint_widget.updateLabels()
 
@@ -249,8 +385,8 @@ class MainWidget(QtGui.QWidget):
 class SaveState(object):
     """Stores the global save state."""
 
-    def __init__(self):
-        self.scene = None
+    def __init__(self, scene=None):
+        self.scene = scene
 
     @classmethod
     def create(cls, main_window):
@@ -274,9 +410,16 @@ def main():
     # Set the working directory to the src folder.
     src_dir = os.path.dirname(os.path.realpath(__file__))
     os.chdir(src_dir)
+    # Start the output workers before Qt so that they aren't forked from a
+    # process with a running event loop
+    processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
     app = QtGui.QApplication(sys.argv)
-    w = MainWindow()
-    sys.exit(app.exec_())
+    w = MainWindow(pool, processes)
+    status = app.exec_()
+    pool.terminate()
+    pool.join()
+    sys.exit(status)
 
 if __name__ == "__main__":
     main()
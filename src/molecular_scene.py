@@ -1,10 +1,12 @@
 from PyQt4 import QtGui, QtCore
-import numpy as np
 
-from surface import Surface
-from atom_pair import AtomPair
+from background_grid import BackgroundGrid
+from surface import Surface, getDefaultOutputLayer
 from molecule import Molecule
 from selection_box import SelectionBox
+from undo_journal import UndoJournal, SurfaceResize
+from change_log import ChangeLog
+import output
 import settings
 
 TOPB = 1
@@ -28,6 +30,7 @@ class MolecularScene(QtGui.QGraphicsScene):
         self.surface = Surface.create(self)
         self.surface.atom_types = settings.surface_atom_types[:]
         self.substrate_atom_types = settings.substrate_atom_types[:]
+        # Layers that haven't been shown are None until they are needed
         self.layers = [self.surface]
         self.addLayers(settings.number_of_layers)
         self.current_layer_i = 0
@@ -35,7 +38,11 @@ class MolecularScene(QtGui.QGraphicsScene):
         self.peek_layer = None
         self.selection_box = None
         self.drag_border = None
+        self.resize_rect = None
+        self.changes = ChangeLog()
+        self.journal = UndoJournal(self.changes.edited)
         self.draw_mode = DRAW_ALL
+        self.background_grid = BackgroundGrid()
         self.updateSceneRect()
         self.update()
 
@@ -71,40 +78,69 @@ class MolecularScene(QtGui.QGraphicsScene):
             return
         if layer_n >= len(self.layers):
             self.addLayers(layer_n)
+        layer = self.getLayer(layer_n)
         self.current_layer.hide()
-        self.layers[layer_n].matchSize(self.current_layer)
+        # Only the current layer paints its hydrogen
+        self.current_layer.tiles.clear()
+        layer.matchSize(self.current_layer)
         self.current_layer_i = layer_n
-        self.current_layer = self.layers[layer_n]
+        self.current_layer = layer
         self.current_layer.show()
         self.views()[0].paint_widget.updateLabels()
 
     def addLayers(self, final_n):
-        """Add layers until the number of layers equals final_n."""
+        """Add layers until the number of layers equals final_n. The new
+        layers are created only once they are needed.
+        """
         if final_n > settings.max_number_of_layers:
             return
         if final_n >= len(self.layers):
-            for i in range(final_n - len(self.layers) + 1):
-                layer = Surface.create(self)
-                layer.atom_types = self.substrate_atom_types
-                layer.hide()
-                self.layers.append(layer)
-
-    def getOutput(self, options):
-        """Get the output information from the scene."""
-        result = []
-        if options["layers_to_draw"] > len(self.layers):
+            self.layers.extend([None] * (final_n - len(self.layers) + 1))
+
+    def getLayer(self, layer_n):
+        """Return the layer layer_n creating it if it doesn't exist yet.
+        The new layer holds no hydrogen and is only saved once it has been
+        written to, so showing a layer doesn't change the scene.
+        """
+        if self.layers[layer_n] is None:
+            layer = Surface(self)
+            layer.matchSize(self.current_layer)
+            layer.atom_types = self.substrate_atom_types
+            layer.hide()
+            self.layers[layer_n] = layer
+        return self.layers[layer_n]
+
+    def prepareOutput(self, options):
+        """Apply the output options and make sure every layer that is
+        written to the output exists and matches the current layer.
+        """
+        if options["layers_to_draw"] >= len(self.layers):
             self.addLayers(options["layers_to_draw"])
         self.surface.atom_types = options["surface_atom_types"]
         for i, atom in enumerate(options["substrate_atom_types"]):
             self.substrate_atom_types[i] = atom
-        for i in range(options["layers_to_draw"] + 1):
-            layer = self.layers[i]
-            layer.matchSize(self.current_layer)
-            layer.getOutput(result, options)
-        return result
-
-    def getSaveState(self):
-        return SaveScene(self)
+        for layer in self.layers[:options["layers_to_draw"] + 1]:
+            if layer is not None:
+                layer.matchSize(self.current_layer)
+
+    def writeOutput(self, f, options, processes=1, pool=None):
+        """Stream the output of the scene in to the file f. With more than
+        one process the layers are computed in parallel, by pool if it is
+        given. Layers that were never created are written in their default
+        state.
+        """
+        self.prepareOutput(options)
+        bounds = self.current_layer.gridRect()
+        layers = []
+        for i, layer in enumerate(self.layers[:options["layers_to_draw"] + 1]):
+            if layer is None:
+                layers.append(getDefaultOutputLayer(options, i, bounds))
+            else:
+                layers.append(layer.getOutputLayer(options))
+        output.writeLayers(f, layers, processes, pool)
+
+    def getSaveState(self, copy=True):
+        return SaveScene(self, copy)
 
     def addContextActions(self, menu):
         """Add widget specific context actions to the
@@ -134,36 +170,24 @@ class MolecularScene(QtGui.QGraphicsScene):
             status_bar = self.parent().window().statusBar()
             for item in self.items():
                 item.reset()
+            # The edits refer to the items that were just removed
+            self.journal.clear()
             status_bar.showMessage("Reset", 3000)
             self.update()
 
     def clearAll(self):
         """Remove everything from the scene."""
         for layer in self.layers:
-            self.removeItem(layer)
+            if layer is not None:
+                self.removeItem(layer)
 
     def drawBackground(self, qp, rect):
-        """Draw the background white and call a grid draw"""
-        qp.setPen(QtGui.QColor(255, 255, 255))
-        qp.setBrush(QtGui.QColor(255, 255, 255))
-        qp.drawRect(rect)
+        """Draw the white background and the grid."""
         self.drawGrid(qp, rect)
 
     def drawGrid(self, qp, rect):
-        """Draw a grid with a spacing of 100 to the background."""
-        tl = rect.topLeft()
-        br = rect.bottomRight()
-        solid_pen = QtGui.QPen(QtGui.QColor(0, 0, 0), 4, QtCore.Qt.SolidLine)
-        faint_pen = QtGui.QPen(QtGui.QColor(150, 150, 150), 1, QtCore.Qt.SolidLine)
-        qp.setPen(faint_pen)
-        for x in range(int(tl.x() - tl.x() % 100), int(br.x()), 100):
-            for y in range(int(tl.y() - tl.y() % 100), int(br.y()), 100):
-                qp.drawLine(int(tl.x()), int(y), int(br.x()), int(y))
-                qp.drawLine(int(x), int(tl.y()), int(x), int(br.y()))
-        # Draw thicklines to the middle of the scene
-        qp.setPen(solid_pen)
-        qp.drawLine(0, int(tl.y()), 0, int(br.y()))
-        qp.drawLine(int(tl.x()), 0, int(br.x()), 0)
+        """Draw a grid with a spacing of 100 on a white background."""
+        self.background_grid.paint(qp, rect)
 
     def dragEnterEvent(self, event):
         """Accept event for drag & drop to work."""
@@ -211,6 +235,7 @@ class MolecularScene(QtGui.QGraphicsScene):
               not event.modifiers() & QtCore.Qt.ControlModifier and
               not isinstance(self.itemAt(event.scenePos()), Molecule)):
             self.drag_border = self.checkBorder(event.scenePos())
+            self.resize_rect = self.current_layer.rect()
         elif (event.button() == QtCore.Qt.LeftButton and
               event.modifiers() == QtCore.Qt.ShiftModifier and
               not isinstance(self.itemAt(event.scenePos()), Molecule) and
@@ -242,6 +267,37 @@ class MolecularScene(QtGui.QGraphicsScene):
             border = self.checkBorder(event.scenePos())
             self.setCursor(border)
 
+    def endResize(self):
+        """Finish resizing the layers. Return the hydrogen dropped from
+        each layer as (layer, cells) pairs.
+        """
+        self.changes.boundsChanged(self.current_layer.rect())
+        # The layers share their size
+        return [(layer, layer.endResize()) for layer in self.layers if layer is not None]
+
+    def setLayerRect(self, rect):
+        """Resize all the layers to the scene rectangle rect."""
+        for layer in self.layers:
+            if layer is not None:
+                layer.prepareGeometryChange()
+        self.current_layer.corner.setX(rect.x())
+        self.current_layer.corner.setY(rect.y())
+        self.current_layer.size.setWidth(rect.width())
+        self.current_layer.size.setHeight(rect.height())
+        for layer in self.layers:
+            if layer is not None:
+                layer.matchSize(self.current_layer)
+        self.endResize()
+        self.updateSceneRect()
+
+    def undo(self):
+        """Undo the latest edit."""
+        return self.journal.undo()
+
+    def redo(self):
+        """Redo the latest undone edit."""
+        return self.journal.redo()
+
     def mapFromGlobal(self, global_pos):
         """Map a position from global coordinates to scene coordinates."""
         view = self.views()[0]
@@ -294,6 +350,10 @@ class MolecularScene(QtGui.QGraphicsScene):
         """Reset all the flags possibly set by mouse press events."""
         super(MolecularScene, self).mouseReleaseEvent(event)
         self.views()[0].endScroll()
+        if self.drag_border is not None:
+            edit = SurfaceResize(self, self.resize_rect, self.endResize())
+            if not edit.isEmpty():
+                self.journal.record(edit)
         self.drag_border = None
         self.updateSceneRect()
         if self.selection_box is not None:
@@ -348,20 +408,48 @@ class MolecularScene(QtGui.QGraphicsScene):
 
 class SaveScene(object):
 
-    def __init__(self, scene):
+    def __init__(self, scene, copy=True):
         self.layers = []
         self.substrate_atom_types = scene.substrate_atom_types
-        for layer in scene.layers:
-            self.layers.append(layer.getSaveState())
+        for i, layer in enumerate(scene.layers):
+            if layer is None or (i > 0 and layer.isUntouched()):
+                # Substrate layers in their default state aren't saved
+                self.layers.append(None)
+            else:
+                self.layers.append(layer.getSaveState(copy))
+
+    def getOptions(self):
+        """Return the default output options of the saved scene."""
+        return {"layers_to_draw": len(self.layers) - 1,
+                "surface_atom_types": list(self.layers[0].atom_types),
+                "substrate_atom_types": list(self.substrate_atom_types)}
+
+    def writeOutput(self, f, options, processes=1):
+        """Stream the output of the saved scene in to the file f without
+        loading it in to a scene. Layers that weren't saved are written
+        in their default state. With more than one process the layers are
+        computed in parallel.
+        """
+        bounds = self.layers[0].gridRect()
+        layers = []
+        for i in range(options["layers_to_draw"] + 1):
+            if i < len(self.layers) and self.layers[i] is not None:
+                layers.append(self.layers[i].getOutputLayer(options, i, bounds))
+            else:
+                layers.append(getDefaultOutputLayer(options, i, bounds))
+        output.writeLayers(f, layers, processes)
 
     def load(self, view):
         scene = MolecularScene(view)
         scene.substrate_atom_types = self.substrate_atom_types
+        scene.clearAll()
         loaded_layers = []
         for layer in self.layers:
-            loaded_layers.append(layer.load(scene))
-        for layer in loaded_layers:
-            layer.hide()
+            if layer is None:
+                loaded_layers.append(None)
+            else:
+                loaded_layers.append(layer.load(scene))
+                loaded_layers[-1].hide()
         scene.surface = loaded_layers[0]
         scene.current_layer = scene.surface
         scene.layers = loaded_layers
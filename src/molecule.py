@@ -7,6 +7,8 @@ from atom_pair import AtomPair
 import output
 import molecular_scene
 import settings
+import structure_cache
+from undo_journal import ItemPresence, ItemMove
 
 class Molecule(QtGui.QGraphicsItem):
 
@@ -22,45 +24,27 @@ class Molecule(QtGui.QGraphicsItem):
         else:
             self.shape = None
         self.dragged = False
+        self.drag_start = None
         self.setZValue(3)
         self.translate(*self.variables.scene_translation)
         self.setTransformOriginPoint(*self.variables.rotation_axis)
 
-    def getOutput(self, result, options):
-        """Add the output data of the contact in to the results if it is
+    def writeOutput(self, writer, options):
+        """Write the atoms of the contact with the output writer if it is
         on the surface.
         """
         if self.onSurface():
             pos = self.pos() - self.parentItem().corner
-            out_pos = np.array((1.0*pos.x()/AtomPair.XSIZE * output.X_SCALE,
-                                1.0*pos.y()/AtomPair.YSIZE * output.Y_SCALE, 0))
-            scene_translation = self.variables.scene_translation
-            translation = (np.array(self.variables.output_translation)
-                + np.array((1.0*scene_translation[0]/AtomPair.XSIZE*output.X_SCALE,
-                            1.0*scene_translation[1]/AtomPair.YSIZE*output.Y_SCALE, 0)))
-            rotation_axis = (-np.array(self.variables.output_translation) +
-                np.array((1.0*self.variables.rotation_axis[0]/AtomPair.XSIZE*output.X_SCALE,
-                1.0*self.variables.rotation_axis[1]/AtomPair.YSIZE*output.Y_SCALE, 0)))
-            rotation_m = output.getCounterClockwiseRotationM(self.rotation())
-            try:
-                with open("../molecules/" + self.variables.output_file, "r") as f:
-                    count = 0
-                    f.seek(0)
-                    for line in f:
-                        count += 1
-                        if count > 2:
-                            split = line.split()
-                            atom_pos = np.array([float(x) for x in split[1:4]])
-                            atom_pos -= rotation_axis
-                            atom_pos = np.dot(rotation_m, atom_pos)
-                            atom_pos += rotation_axis
-                            atom_pos += out_pos + translation
-                            result.append("%-4s %-10f %-10f %-10f %d" %
-                                ((split[0],) + tuple(atom_pos) + ((len(result) + 1),)))
-            except IOError as e:
-                print "IOError: Structure file '%s' not found for molecule '%s'." % \
-                        (self.variables.output_file, self.variables.name)
-                raise e
+            elements, atom_pos = getMoleculeAtoms(self.variables, pos.x(), pos.y(),
+                                                  self.rotation())
+            writer.writeAtoms(elements, atom_pos)
+
+    def getOutputCount(self, options):
+        """Return the number of atoms the contact writes to the output."""
+        if self.onSurface():
+            return len(loadStructure(self.variables)[0])
+        else:
+            return 0
 
     def getSaveState(self):
         """Return the state of the item without Qt bindings."""
@@ -68,10 +52,22 @@ class Molecule(QtGui.QGraphicsItem):
 
     def onSurface(self):
         """Check if the item is on the surface."""
-        if self.collidesWithItem(self.parentItem(), QtCore.Qt.ContainsItemShape):
-            return True
-        else:
-            return False
+        return self.parentItem().containsRect(*self.surfaceRect())
+
+    def surfaceRect(self):
+        """Return the (left, top, right, bottom) scene rectangle that has
+        to be on the surface.
+        """
+        if self.rotation() % 90 != 0:
+            # The bounding rectangle isn't tight for other rotations
+            # The shape attribute hides the shape method
+            path = self.shape
+            if path is None:
+                path = QtGui.QPainterPath()
+                path.addRect(self.boundingRect())
+            rect = self.mapToScene(path).boundingRect()
+            return rect.left(), rect.top(), rect.right(), rect.bottom()
+        return getMoleculeRect(self.variables, self.x(), self.y(), self.rotation())
 
     def collidesWithMolecules(self):
         """Check if the contact collides with other contacts."""
@@ -103,9 +99,20 @@ class Molecule(QtGui.QGraphicsItem):
         """Reset the item state to scene defaults."""
         self.scene().removeItem(self)
 
+    def restore(self, layer):
+        """Add the item back to the layer after a reset."""
+        self.setParentItem(layer)
+
     def contextRotate(self):
         """Rotate the contact by 90 degrees."""
+        old_pos = self.pos()
         self.setRotation(self.rotation() + 90)
+        self.scene().journal.record(ItemMove(self, old_pos, self.rotation() - 90))
+
+    def contextRemove(self):
+        """Remove the contact from the scene."""
+        self.scene().journal.record(ItemPresence(self, self.parentItem(), False))
+        self.reset()
 
     def addContextActions(self, menu):
         """Add item specific context actions to the menu."""
@@ -115,7 +122,7 @@ class Molecule(QtGui.QGraphicsItem):
             menu.addAction(rotate)
 
         remove = QtGui.QAction("Remove " + self.variables.name, menu)
-        QtCore.QObject.connect(remove, QtCore.SIGNAL("triggered()"), self.reset)
+        QtCore.QObject.connect(remove, QtCore.SIGNAL("triggered()"), self.contextRemove)
         menu.addAction(remove)
 
     def boundingRect(self):
@@ -149,6 +156,7 @@ class Molecule(QtGui.QGraphicsItem):
            event.modifiers() == QtCore.Qt.ShiftModifier and
            self.scene().draw_mode != molecular_scene.DRAW_SURFACE_ONLY):
             self.dragged = True
+            self.drag_start = self.pos()
         elif (event.button() == QtCore.Qt.LeftButton and
               self.scene().draw_mode != molecular_scene.DRAW_SURFACE_ONLY):
             pass
@@ -159,16 +167,24 @@ class Molecule(QtGui.QGraphicsItem):
         """Rotate the item on double click."""
         if (event.button() == QtCore.Qt.LeftButton and self.variables.rotating and
            not self.scene().draw_mode != molecular_scene.DRAW_SURFACE_ONLY):
+            old_pos = self.pos()
             self.setRotation(self.rotation() + 90)
             if not self.resolveCollisions():
                 status_bar = self.scene().views()[0].window().statusBar()
                 status_bar.showMessage("Item couldn't be rotated.", 3000)
                 self.setRotation(self.rotation() - 90)
+            else:
+                self.scene().journal.record(ItemMove(self, old_pos, self.rotation() - 90))
 
     def mouseReleaseEvent(self, event):
         """End drag when mouse is released."""
         if event.button() == QtCore.Qt.LeftButton:
             self.dragged = False
+            if self.drag_start is not None:
+                edit = ItemMove(self, self.drag_start, self.rotation())
+                if not edit.isEmpty():
+                    self.scene().journal.record(edit)
+                self.drag_start = None
             self.scene().painting_status = None
             self.scene().views()[0].endScroll()
             self.ensureVisible()
@@ -195,6 +211,59 @@ class Molecule(QtGui.QGraphicsItem):
             self.scene().update()
 
 
+def loadStructure(variables):
+    """Return the element symbols and coordinates of the structure
+    file of the molecule.
+    """
+    try:
+        return structure_cache.load("../molecules/" + variables.output_file)
+    except IOError as e:
+        print "IOError: Structure file '%s' not found for molecule '%s'." % \
+                (variables.output_file, variables.name)
+        raise e
+
+
+def getMoleculeAtoms(variables, x, y, rotation):
+    """Return the element symbols and output positions of the atoms of a
+    molecule at (x, y) relative to the layer corner rotated by rotation.
+    """
+    out_pos = np.array((1.0*x/AtomPair.XSIZE * output.X_SCALE,
+                        1.0*y/AtomPair.YSIZE * output.Y_SCALE, 0))
+    scene_translation = variables.scene_translation
+    translation = (np.array(variables.output_translation)
+        + np.array((1.0*scene_translation[0]/AtomPair.XSIZE*output.X_SCALE,
+                    1.0*scene_translation[1]/AtomPair.YSIZE*output.Y_SCALE, 0)))
+    rotation_axis = (-np.array(variables.output_translation) +
+        np.array((1.0*variables.rotation_axis[0]/AtomPair.XSIZE*output.X_SCALE,
+        1.0*variables.rotation_axis[1]/AtomPair.YSIZE*output.Y_SCALE, 0)))
+    rotation_m = output.getCounterClockwiseRotationM(rotation)
+    elements, atom_pos = loadStructure(variables)
+    atom_pos = np.dot(atom_pos - rotation_axis, rotation_m.T)
+    atom_pos += rotation_axis
+    atom_pos += out_pos + translation
+    return elements, atom_pos
+
+
+def getMoleculeRect(variables, x, y, rotation):
+    """Return the (left, top, right, bottom) scene rectangle covered by a
+    molecule at (x, y) rotated by rotation.
+    """
+    corners = np.array([(0, 0), (variables.size[0], 0),
+                        (0, variables.size[1]), variables.size], dtype=float)
+    corners -= variables.rotation_axis
+    angle = np.radians(rotation)
+    # Positive rotations are clockwise on the scene
+    rotation_m = np.array([[np.cos(angle), np.sin(angle)],
+                           [-np.sin(angle), np.cos(angle)]])
+    corners = np.dot(corners, rotation_m)
+    corners += variables.rotation_axis
+    corners += variables.scene_translation
+    corners += (x, y)
+    left, top = corners.min(axis=0)
+    right, bottom = corners.max(axis=0)
+    return left, top, right, bottom
+
+
 class SaveMolecule(object):
 
     def __init__(self, molecule):
@@ -206,3 +275,32 @@ class SaveMolecule(object):
     def load(self, surface):
         molecule = Molecule(self.x, self.y, self.variables, surface)
         molecule.setRotation(self.rotation)
+
+    def onSurface(self, bounds):
+        """Check if the saved molecule is on a surface with the given
+        grid bounds.
+        """
+        left, top, right, bottom = getMoleculeRect(self.variables, self.x, self.y,
+                                                   self.rotation)
+        # The shape of the surface extends 2 units past its borders
+        return (left >= bounds[0]*AtomPair.XSIZE - 2 and
+                top >= bounds[1]*AtomPair.YSIZE - 2 and
+                right <= bounds[2]*AtomPair.XSIZE + 2 and
+                bottom <= bounds[3]*AtomPair.YSIZE + 2)
+
+    def writeOutput(self, writer, options, layer_n, bounds):
+        """Write the atoms of the saved molecule on a layer with the given
+        grid bounds with the output writer.
+        """
+        if self.onSurface(bounds):
+            elements, atom_pos = getMoleculeAtoms(
+                self.variables, self.x - bounds[0]*AtomPair.XSIZE,
+                self.y - bounds[1]*AtomPair.YSIZE, self.rotation)
+            writer.writeAtoms(elements, atom_pos)
+
+    def getOutputCount(self, options, layer_n, bounds):
+        """Return the number of atoms writeOutput writes."""
+        if self.onSurface(bounds):
+            return len(loadStructure(self.variables)[0])
+        else:
+            return 0
@@ -1,5 +1,8 @@
+import multiprocessing
+import os
+
 import numpy as np
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
 LEFT_H_POS = np.array([0.276, 0.5, 0])
 RIGHT_H_POS = np.array([0.724, 0.5, 0])
@@ -31,6 +34,265 @@ LEFT_BOTTOM_H = [np.array([-1.16, 0, -0.82]),
 RIGHT_BOTTOM_H = [np.array([1.16, 0, -0.82]),
                   np.array([0, 1.16, -0.82])]
 
+ATOM_FORMAT = "%-4s %-10f %-10f %-10f %d"
+VACANT = -1
+# Maximum number of atoms formatted or generated at once
+BLOCK_SIZE = 65536
+# Maximum number of cells formatted by a single worker process job
+BAND_SIZE = 16384
+# Smaller outputs are written by a single process since starting the
+# workers would take longer than formatting the cells
+MIN_PARALLEL_CELLS = 1 << 20
+
+
+def layerOffsets(layer_n):
+    """Return the z, left and right offsets of the atoms on the given layer."""
+    if layer_n == 0:
+        z_offset = np.array([0, 0, 0])
+        left_offset = LEFT_H_POS * TOTAL_SCALE
+        right_offset = RIGHT_H_POS * TOTAL_SCALE
+    elif layer_n == 1:
+        z_offset = SURFACE_Z
+        left_offset = SURFACE_LEFT
+        right_offset = SURFACE_RIGHT
+    elif layer_n == 2:
+        z_offset = INITIAL_Z
+        left_offset = LAYER_LEFT[(layer_n+2) % 4]
+        right_offset = LAYER_RIGHT[(layer_n+2) % 4]
+    else:
+        z_offset = (max((layer_n+2)/4 - 1, 0) * Z_OFFSET + INITIAL_Z
+                    + LAYER_Z[(layer_n+2) % 4])
+        left_offset = LAYER_LEFT[(layer_n+2) % 4]
+        right_offset = LAYER_RIGHT[(layer_n+2) % 4]
+    return z_offset, left_offset, right_offset
+
+
+def layerAtoms(left_status, right_status, x_pos, y_pos, layer_n, options, skip=None):
+    """Return the element symbols and the positions of all the atoms
+    on a block of a layer.
+
+    left_status and right_status are the status arrays of the block indexed
+    by [row, column]. x_pos and y_pos give the output coordinates of the
+    columns and rows. Cells set in the boolean array skip are left out.
+    The atoms are ordered row by row and inside a cell from left to right
+    with the bottom hydrogen following the atom they are bonded to.
+    """
+    if layer_n == 0:
+        atom_types = options["surface_atom_types"]
+    else:
+        atom_types = options["substrate_atom_types"]
+    z_offset, left_offset, right_offset = layerOffsets(layer_n)
+    rows, columns = left_status.shape
+    out_pos = np.zeros((rows, columns, 3))
+    out_pos[:, :, 0] = x_pos[np.newaxis, :]
+    out_pos[:, :, 1] = y_pos[:, np.newaxis]
+    left_pos = out_pos + z_offset + left_offset
+    right_pos = out_pos + z_offset + right_offset
+    left_valid = left_status != VACANT
+    right_valid = right_status != VACANT
+    if skip is not None:
+        left_valid &= ~skip
+        right_valid &= ~skip
+    if layer_n != 0 and layer_n == options["layers_to_draw"]:
+        bottom_h = (LEFT_BOTTOM_H[layer_n%2], RIGHT_BOTTOM_H[layer_n%2])
+        positions = np.stack((left_pos, left_pos + bottom_h[0], left_pos + bottom_h[1],
+                              right_pos, right_pos + bottom_h[0], right_pos + bottom_h[1]),
+                             axis=2)
+        valid = np.stack((left_valid,)*3 + (right_valid,)*3, axis=2)
+        hydrogen = ["H", "H"]
+    else:
+        positions = np.stack((left_pos, right_pos), axis=2)
+        valid = np.stack((left_valid, right_valid), axis=2)
+        hydrogen = []
+    types = np.array(list(atom_types) + ["H"], dtype=object)
+    h_index = len(atom_types)
+    statuses = np.stack((left_status,)*(1 + len(hydrogen)) +
+                        (right_status,)*(1 + len(hydrogen)), axis=2).astype(np.intp)
+    if hydrogen:
+        statuses[:, :, [1, 2, 4, 5]] = h_index
+    return types[statuses[valid]], positions[valid]
+
+
+def layerAtomCount(left_status, right_status, layer_n, options, skip=None):
+    """Return the number of atoms layerAtoms would return for the block."""
+    left_valid = left_status != VACANT
+    right_valid = right_status != VACANT
+    if skip is not None:
+        left_valid &= ~skip
+        right_valid &= ~skip
+    count = int(np.count_nonzero(left_valid) + np.count_nonzero(right_valid))
+    if layer_n != 0 and layer_n == options["layers_to_draw"]:
+        count *= 3
+    return count
+
+
+def layerBlocks(grid, bounds, selected=None, block_size=BLOCK_SIZE):
+    """Yield the status arrays of the layer grid inside the (left, top,
+    right, bottom) grid rectangle bounds in blocks of rows with at most
+    block_size cells, or a single row if it is longer. Each block comes
+    with the output coordinates of its columns and rows relative to the
+    corner of the bounds and a mask of the cells hidden under selections.
+    selected is an array of the (left, top, right, bottom) grid rectangles
+    of the selections.
+    """
+    left, top, right, bottom = bounds
+    if selected is None:
+        selected = np.zeros((0, 4), dtype=int)
+    x_pos = np.arange(right - left) * X_SCALE
+    block_rows = max(block_size // max(right - left, 1), 1)
+    for block_top in range(top, bottom, block_rows):
+        block_bottom = min(block_top + block_rows, bottom)
+        left_status, right_status = grid.getRect(left, block_top, right, block_bottom)
+        skip = np.zeros(left_status.shape, dtype=bool)
+        overlapping = ((selected[:, 0] < right) & (selected[:, 2] > left) &
+                       (selected[:, 1] < block_bottom) & (selected[:, 3] > block_top))
+        for x0, y0, x1, y1 in selected[overlapping]:
+            skip[max(y0, block_top) - block_top:min(y1, block_bottom) - block_top,
+                 max(x0, left) - left:min(x1, right) - left] = True
+        y_pos = np.arange(block_top - top, block_bottom - top) * Y_SCALE
+        yield left_status, right_status, x_pos, y_pos, skip
+
+
+def writeLayer(writer, grid, bounds, layer_n, options, selected=None):
+    """Write the atoms of the layer grid inside bounds with the writer."""
+    for left_status, right_status, x_pos, y_pos, skip in layerBlocks(grid, bounds, selected):
+        elements, positions = layerAtoms(left_status, right_status,
+                                         x_pos, y_pos, layer_n, options, skip)
+        writer.writeAtoms(elements, positions)
+
+
+def layerCount(grid, bounds, layer_n, options, selected=None):
+    """Return the number of atoms writeLayer writes for the layer grid."""
+    count = 0
+    for left_status, right_status, x_pos, y_pos, skip in layerBlocks(grid, bounds, selected):
+        count += layerAtomCount(left_status, right_status, layer_n, options, skip)
+    return count
+
+
+def formatBand(job):
+    """Return the output text and the number of atoms of a band of rows of
+    a layer. job is a (left_status, right_status, x_pos, y_pos, skip,
+    layer_n, options, first_index) tuple. Used by the worker processes of
+    writeLayers.
+    """
+    left_status, right_status, x_pos, y_pos, skip, layer_n, options, first_index = job
+    elements, positions = layerAtoms(left_status, right_status,
+                                     x_pos, y_pos, layer_n, options, skip)
+    lines = formatAtoms(elements, positions, first_index)
+    if not lines:
+        return "", 0
+    return "\n".join(lines) + "\n", len(lines)
+
+
+def bandJobs(layers, counts):
+    """Yield the formatBand jobs of the layers in bands of at most
+    BAND_SIZE cells. The write_items function of each layer is yielded
+    after the jobs of the layer.
+    """
+    first_index = 0
+    for (job, items_count, write_items), count in zip(layers, counts):
+        grid, bounds, layer_n, options, selected = job
+        for left_status, right_status, x_pos, y_pos, skip in layerBlocks(
+                grid, bounds, selected, BAND_SIZE):
+            yield (left_status, right_status, x_pos, y_pos, skip,
+                   layer_n, options, first_index)
+            first_index += layerAtomCount(left_status, right_status, layer_n, options, skip)
+        yield write_items
+        first_index += items_count
+
+
+def writeLayers(f, layers, processes=1, pool=None):
+    """Write the output of the layers in to the file f.
+
+    layers is a list of (job, items_count, write_items) tuples where job is
+    the (grid, bounds, layer_n, options, selected) tuple of the layer grid,
+    items_count the number of atoms of the child items of the layer and
+    write_items a function writing them with the writer given as parameter.
+    With more than one process and at least MIN_PARALLEL_CELLS cells the
+    layer grids are formatted in parallel in bands of rows and merged in
+    order. At most two bands per process are in progress at once so the
+    memory use doesn't depend on the size of the layers. The bands are
+    formatted by pool if given, which has to have processes workers, and
+    otherwise by a pool started for the output.
+    """
+    counts = [layerCount(*job) for job, items_count, write_items in layers]
+    atom_count = sum(counts) + sum(items_count for job, items_count, write_items in layers)
+    writer = XYZWriter(f, atom_count)
+    cells = sum(max(job[1][2] - job[1][0], 0) * max(job[1][3] - job[1][1], 0)
+                for job, items_count, write_items in layers)
+    if processes > 1 and cells >= MIN_PARALLEL_CELLS:
+        own_pool = pool is None
+        if own_pool:
+            pool = multiprocessing.Pool(processes)
+        try:
+            pending = deque()
+            for job in bandJobs(layers, counts):
+                if callable(job):
+                    pending.append(job)
+                else:
+                    pending.append(pool.apply_async(formatBand, (job,)))
+                while len(pending) > 2 * processes:
+                    writePending(writer, pending.popleft())
+            while pending:
+                writePending(writer, pending.popleft())
+        finally:
+            if own_pool:
+                pool.terminate()
+                pool.join()
+    else:
+        for job, items_count, write_items in layers:
+            writeLayer(writer, *job)
+            write_items(writer)
+    writer.close()
+
+
+def writePending(writer, pending):
+    """Write the result of a formatBand job or call a write_items function
+    of writeLayers with the writer.
+    """
+    if callable(pending):
+        pending(writer)
+    else:
+        writer.writeText(*pending.get())
+
+
+def writeFile(path, write, buffering=-1):
+    """Call write with a file opened for writing the output at path. The
+    output is written in to a temporary file that replaces the file at
+    path only once write has succeeded, so a failed output leaves an
+    existing file untouched.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", buffering) as f:
+            write(f)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Renaming over an existing file fails on Windows
+            os.remove(path)
+            os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def formatAtoms(elements, positions, first_index):
+    """Return the output lines of the atoms. The atoms are numbered
+    starting from first_index + 1.
+    """
+    n = len(elements)
+    if n == 0:
+        return []
+    values = np.empty((n, 5), dtype=object)
+    values[:, 0] = elements
+    values[:, 1:4] = positions
+    values[:, 4] = np.arange(first_index + 1, first_index + n + 1)
+    line_format = "\n".join([ATOM_FORMAT] * n)
+    return (line_format % tuple(values.ravel())).split("\n")
+
+
 def getClockwiseRotationM(angle):
     """Return the rotation matrix for rotating by given angle in clockwise
     direction."""
@@ -48,3 +310,45 @@ def getCounterClockwiseRotationM(angle):
                           [-np.sin(angle), np.cos(angle), 0],
                            [0, 0, 1]])
     return rotation_m
+
+
+class XYZWriter(object):
+    """Writes the atoms of the output straight in to a file.
+
+    The number of atoms has to be known when the writer is created so
+    that the header can be written first. The atoms are formatted in
+    blocks of at most BLOCK_SIZE atoms so the memory use doesn't depend
+    on the size of the output.
+    """
+
+    def __init__(self, f, atom_count):
+        self.f = f
+        self.atom_count = atom_count
+        self.count = 0
+        self.f.write(str(atom_count))
+        self.f.write("\n\n")
+
+    def writeAtoms(self, elements, positions):
+        """Write the atoms with the given element symbols and positions."""
+        for start in range(0, len(elements), BLOCK_SIZE):
+            lines = formatAtoms(elements[start:start + BLOCK_SIZE],
+                                positions[start:start + BLOCK_SIZE], self.count)
+            self.count += len(lines)
+            self.f.write("\n".join(lines))
+            self.f.write("\n")
+
+    def writeText(self, text, count):
+        """Write count atoms formatted in advance. The atoms have to be
+        numbered starting from the number of atoms written so far.
+        """
+        self.count += count
+        self.f.write(text)
+
+    def close(self):
+        """Check that the promised number of atoms was written and flush
+        the file.
+        """
+        if self.count != self.atom_count:
+            raise ValueError("Wrote %d atoms but the header promised %d." %
+                             (self.count, self.atom_count))
+        self.f.flush()
@@ -0,0 +1,354 @@
+"""Reading and writing of the save files.
+
+A save file starts with MAGIC followed by the format version and the
+length of the header as little endian 32 bit integers. The header is a
+JSON document describing the scene. The status grids of the layers and
+the tables of molecules and selections follow it as raw arrays listed in
+header["arrays"]. Layers refer to the arrays by their index in that list.
+Since version 2 every array starts at the given offset from the start of
+the data, which is aligned to ALIGNMENT bytes, so that the arrays can be
+memory mapped. Version 1 stores the arrays back to back after the header.
+Since version 3 every selection refers to its own status arrays. Older
+versions store the cells of all selections in one table of hydrogen pairs.
+
+Files that don't start with MAGIC are loaded as pickled SaveState
+objects used by the older versions.
+"""
+import json
+import os
+import struct
+import sys
+
+import cPickle as pickle
+import numpy as np
+
+# molecular_scene has to be imported before the items it contains
+from molecular_scene import SaveScene
+from atom_pair import AtomPair
+from layer_grid import LayerGrid
+from molecule import SaveMolecule
+from molecule_info import MoleculeInfo
+from selection_box import SaveSelection
+from surface import SaveSurface
+
+MAGIC = "MUISAVE\n"
+VERSION = 3
+HEADER = struct.Struct("<II")
+ALIGNMENT = 8
+WRITE_CHUNK = 1 << 20
+
+# Dtypes of the stored arrays. The byte order is fixed so that the
+# files can be moved between machines.
+INDEX_DTYPE = np.dtype("<i4")
+STATUS_DTYPE = np.dtype("i1")
+FLOAT_DTYPE = np.dtype("<f8")
+
+
+class SaveFileError(Exception):
+    """Raised when a save file can't be read."""
+    pass
+
+
+def findClass(module, name):
+    """Find the classes of a pickled save state. Saves created by running
+    main_window.py directly refer to it as __main__.
+    """
+    if module == "__main__":
+        module = "main_window"
+    __import__(module)
+    return getattr(sys.modules[module], name)
+
+
+def isSaveFile(f):
+    """Check if the open file f is in the binary save format. The file
+    position is left unchanged.
+    """
+    pos = f.tell()
+    magic = f.read(len(MAGIC))
+    f.seek(pos)
+    return magic == MAGIC
+
+
+def read(f, mapped=False):
+    """Return the SaveScene stored in the open file f. Both the binary
+    format and the older pickled save states are supported. If mapped is
+    True the arrays of a binary save are memory mapped copy on write
+    instead of read in to memory.
+    """
+    if isSaveFile(f):
+        return readScene(f, mapped)
+    unpickler = pickle.Unpickler(f)
+    unpickler.find_global = findClass
+    return unpickler.load().scene
+
+
+def write(f, save_scene):
+    """Write the SaveScene save_scene in to the open file f in the
+    binary format.
+    """
+    writer = ArrayWriter()
+    molecule_types = []
+    layers = []
+    for layer in save_scene.layers:
+        if layer is None:
+            layers.append(None)
+        else:
+            layers.append(writeLayer(writer, molecule_types, layer))
+    header = {"substrate_atom_types": list(save_scene.substrate_atom_types),
+              "molecule_types": [json.loads(key) for key in molecule_types],
+              "layers": layers,
+              "arrays": writer.specs}
+    header = json.dumps(header, sort_keys=True)
+    f.write(MAGIC)
+    f.write(HEADER.pack(VERSION, len(header)))
+    f.write(header)
+    f.write(padding(len(MAGIC) + HEADER.size + len(header)))
+    for array in writer.arrays:
+        # Write large arrays in chunks so that mapped arrays aren't read
+        # in to memory at once
+        data = array.reshape(-1).view(np.uint8)
+        for start in range(0, len(data), WRITE_CHUNK):
+            f.write(data[start:start + WRITE_CHUNK].tobytes())
+        f.write(padding(array.nbytes))
+
+
+def save(path, save_scene):
+    """Write the SaveScene save_scene in to the file at path. The old
+    file is only replaced once the new one is complete. Scenes mapped
+    from the old file keep using its data.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f, save_scene)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Renaming over an existing file fails on Windows
+        os.remove(path)
+        os.rename(tmp_path, path)
+
+
+def padding(size):
+    """Return the bytes needed to align data of the given size."""
+    return "\0" * (-size % ALIGNMENT)
+
+
+def writeLayer(writer, molecule_types, layer):
+    """Add the arrays of the SaveSurface layer to writer. Return the
+    header entry of the layer.
+    """
+    if hasattr(layer, "left_status") and layer.getItems() == layer.child_items:
+        # Write the saved arrays as they are instead of copying them in to
+        # a grid
+        grid = LayerGrid.fromArrays(layer.column, layer.row,
+                                    layer.left_status, layer.right_status)
+    else:
+        grid = layer.getGrid()
+    header = {"x": layer.x, "y": layer.y,
+              "width": layer.width, "height": layer.height,
+              "atom_types": list(layer.atom_types)}
+    if grid.isSparse():
+        columns, rows, left_status, right_status = grid.nonDefaultCells()
+        header["grid"] = {
+            "cells": writer.add(np.column_stack((columns, rows)), INDEX_DTYPE),
+            "status": writer.add(np.column_stack((left_status, right_status)),
+                                 STATUS_DTYPE)}
+    else:
+        header["grid"] = {
+            "column": grid.column, "row": grid.row,
+            "left_status": writer.add(grid.left_status, STATUS_DTYPE),
+            "right_status": writer.add(grid.right_status, STATUS_DTYPE)}
+    items = layer.getItems()
+    # The position of every item among the children so that the order of
+    # the children and with it the output can be restored
+    order = dict((id(item), i) for i, item in enumerate(items))
+    molecules = [item for item in items if isinstance(item, SaveMolecule)]
+    types = []
+    for molecule in molecules:
+        key = json.dumps(molecule.variables.__dict__, sort_keys=True)
+        if key not in molecule_types:
+            molecule_types.append(key)
+        types.append(molecule_types.index(key))
+    header["molecules"] = {
+        "positions": writer.add([(m.x, m.y, m.rotation) for m in molecules], FLOAT_DTYPE,
+                                (-1, 3)),
+        "types": writer.add(types, INDEX_DTYPE),
+        "order": writer.add([order[id(m)] for m in molecules], INDEX_DTYPE)}
+    header["selections"] = []
+    for selection in items:
+        if isinstance(selection, SaveSelection):
+            left_status, right_status = selection.getStatus()
+            header["selections"].append({
+                "x": selection.x, "y": selection.y,
+                "width": selection.width, "height": selection.height,
+                "order": order[id(selection)],
+                "left_status": writer.add(left_status, STATUS_DTYPE),
+                "right_status": writer.add(right_status, STATUS_DTYPE)})
+    return header
+
+
+class ArrayWriter(object):
+    """Collects the arrays written after the header."""
+
+    def __init__(self):
+        self.arrays = []
+        self.specs = []
+        self.offset = 0
+
+    def add(self, array, dtype, shape=None):
+        """Add the array converted to dtype. Return its index."""
+        array = np.ascontiguousarray(array, dtype=dtype)
+        if shape is not None:
+            array = array.reshape(shape)
+        self.arrays.append(array)
+        self.specs.append({"dtype": dtype.str, "shape": list(array.shape),
+                           "offset": self.offset})
+        self.offset += array.nbytes + len(padding(array.nbytes))
+        return len(self.arrays) - 1
+
+
+def readScene(f, mapped=False):
+    """Read a SaveScene from the open file f in the binary format. If
+    mapped is True the arrays are memory mapped copy on write.
+    """
+    start = f.tell()
+    if f.read(len(MAGIC)) != MAGIC:
+        raise SaveFileError("Not a save file")
+    version, header_length = HEADER.unpack(f.read(HEADER.size))
+    if version > VERSION:
+        raise SaveFileError("Unsupported save file version %d" % version)
+    header = toStr(json.loads(f.read(header_length)))
+    data_start = len(MAGIC) + HEADER.size + header_length
+    if version >= 2:
+        data_start += len(padding(data_start))
+    specs = header["arrays"]
+    offset = 0
+    for spec in specs:
+        spec["dtype"] = np.dtype(spec["dtype"])
+        spec["shape"] = tuple(spec["shape"])
+        spec["size"] = spec["dtype"].itemsize * int(np.prod(spec["shape"]))
+        if version < 2:
+            spec["offset"] = offset
+            offset += spec["size"]
+    data_size = max([spec["offset"] + spec["size"] for spec in specs] + [0])
+    f.seek(0, os.SEEK_END)
+    if f.tell() - start - data_start < data_size:
+        raise SaveFileError("Truncated save file")
+    if data_size == 0:
+        data = np.zeros(0, dtype=np.uint8)
+    elif mapped:
+        data = np.memmap(f, dtype=np.uint8, mode="c", offset=start + data_start,
+                         shape=(data_size,))
+    else:
+        f.seek(start + data_start)
+        data = np.frombuffer(f.read(data_size), dtype=np.uint8)
+    arrays = []
+    for spec in specs:
+        array = data[spec["offset"]:spec["offset"] + spec["size"]]
+        arrays.append(array.view(spec["dtype"]).reshape(spec["shape"]))
+    molecule_types = [MoleculeInfo(**toTuples(info)) for info in header["molecule_types"]]
+    save_scene = SaveScene.__new__(SaveScene)
+    save_scene.substrate_atom_types = header["substrate_atom_types"]
+    save_scene.layers = []
+    for layer in header["layers"]:
+        if layer is None:
+            save_scene.layers.append(None)
+        else:
+            save_scene.layers.append(readLayer(arrays, molecule_types, layer))
+    return save_scene
+
+
+def readLayer(arrays, molecule_types, header):
+    """Return the SaveSurface described by the layer header."""
+    layer = SaveSurface.__new__(SaveSurface)
+    layer.x = header["x"]
+    layer.y = header["y"]
+    layer.width = header["width"]
+    layer.height = header["height"]
+    layer.atom_types = header["atom_types"]
+    grid = header["grid"]
+    if "cells" in grid:
+        cells = arrays[grid["cells"]]
+        status = arrays[grid["status"]]
+        layer.cells = (cells[:, 0], cells[:, 1], status[:, 0], status[:, 1])
+    else:
+        layer.column = grid["column"]
+        layer.row = grid["row"]
+        layer.left_status = arrays[grid["left_status"]]
+        layer.right_status = arrays[grid["right_status"]]
+    layer.child_items = []
+    molecules = header["molecules"]
+    for (x, y, rotation), i in zip(arrays[molecules["positions"]],
+                                   arrays[molecules["types"]]):
+        molecule = SaveMolecule.__new__(SaveMolecule)
+        molecule.x = float(x)
+        molecule.y = float(y)
+        molecule.rotation = float(rotation)
+        molecule.variables = molecule_types[i]
+        layer.child_items.append(molecule)
+    selections = header["selections"]
+    if isinstance(selections, dict):
+        layer.child_items.extend(readAtomSelections(arrays, selections))
+        if "order" in molecules and "order" in selections:
+            order = np.concatenate((arrays[molecules["order"]], arrays[selections["order"]]))
+            layer.child_items = [layer.child_items[i]
+                                 for i in np.argsort(order, kind="mergesort")]
+        return layer
+    for entry in selections:
+        selection = SaveSelection.__new__(SaveSelection)
+        selection.x = entry["x"]
+        selection.y = entry["y"]
+        selection.width = entry["width"]
+        selection.height = entry["height"]
+        selection.left_status = arrays[entry["left_status"]]
+        selection.right_status = arrays[entry["right_status"]]
+        layer.child_items.append(selection)
+    order = np.concatenate((arrays[molecules["order"]],
+                            np.array([entry["order"] for entry in selections], dtype=int)))
+    layer.child_items = [layer.child_items[i] for i in np.argsort(order, kind="mergesort")]
+    return layer
+
+
+def readAtomSelections(arrays, selections):
+    """Return the SaveSelections of a layer stored as one table of hydrogen
+    pairs by the versions before 3.
+    """
+    selection_items = []
+    atom_selections = arrays[selections["atom_selections"]]
+    atom_columns = np.round(arrays[selections["atom_positions"]][:, 0]
+                            / AtomPair.XSIZE).astype(int)
+    atom_rows = np.round(arrays[selections["atom_positions"]][:, 1]
+                         / AtomPair.YSIZE).astype(int)
+    atom_status = arrays[selections["atom_status"]]
+    for i, (x, y, width, height) in enumerate(arrays[selections["rects"]]):
+        selection = SaveSelection.__new__(SaveSelection)
+        selection.x = float(x)
+        selection.y = float(y)
+        selection.width = float(width)
+        selection.height = float(height)
+        shape = (int(round(selection.height / AtomPair.YSIZE)),
+                 int(round(selection.width / AtomPair.XSIZE)))
+        selection.left_status = np.zeros(shape, dtype=LayerGrid.DTYPE)
+        selection.right_status = np.zeros(shape, dtype=LayerGrid.DTYPE)
+        atoms = atom_selections == i
+        cells = (atom_rows[atoms], atom_columns[atoms])
+        selection.left_status[cells] = atom_status[atoms, 0]
+        selection.right_status[cells] = atom_status[atoms, 1]
+        selection_items.append(selection)
+    return selection_items
+
+
+def toStr(value):
+    """Convert the unicode strings of a decoded JSON value to str."""
+    if isinstance(value, unicode):
+        return str(value)
+    elif isinstance(value, list):
+        return [toStr(x) for x in value]
+    elif isinstance(value, dict):
+        return dict((toStr(k), toStr(v)) for k, v in value.items())
+    return value
+
+
+def toTuples(info):
+    """Convert the lists of a decoded MoleculeInfo back to tuples."""
+    return dict((k, tuple(v) if isinstance(v, list) else v) for k, v in info.items())
@@ -1,18 +1,36 @@
 from PyQt4 import QtGui, QtCore
+import numpy as np
 
 from atom_pair import AtomPair
+from layer_grid import LayerGrid, GridCell
+from layer_raster import LayerRaster
+from undo_journal import SelectionFill, SelectionLift, ItemMove
+import output
+import selection_tools
 
 
 class SelectionBox(QtGui.QGraphicsItem):
-    """Rubberband selection box."""
+    """Rubberband selection box. The selected hydrogen are lifted from the
+    layer grid in to status arrays covering the cells of the box, so
+    moving the box only changes its position and filling, vacating and
+    deselecting work on whole arrays.
+    """
 
     def __init__(self, origin, parent=None, scene=None):
         self.size = QtCore.QSizeF(origin.x() % AtomPair.XSIZE,
                                   origin.y() % AtomPair.YSIZE)
         super(SelectionBox, self).__init__(parent, scene)
+        self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOption)
         self.setX(origin.x() - origin.x() % AtomPair.XSIZE)
         self.setY(origin.y() - origin.y() % AtomPair.YSIZE)
+        self.left_status = np.zeros((0, 0), dtype=LayerGrid.DTYPE)
+        self.right_status = np.zeros((0, 0), dtype=LayerGrid.DTYPE)
+        # Raster painted when zoomed out and the status arrays it was built from
+        self.raster = None
+        self.raster_status = None
         self.indexed_rect = None
+        self.dragged = False
+        self.drag_start = None
         self.setZValue(2)
 
     def setCorner(self, corner):
@@ -52,28 +70,68 @@ class SelectionBox(QtGui.QGraphicsItem):
             return
         self.populate()
         self.updateIndexing()
+        self.scene().journal.record(SelectionLift(self, self.parentItem()))
 
     def populate(self):
-        """Fill the selection area with hydrogen and
-        copy their state from the surface.
+        """Lift the hydrogen under the selection area from the surface
+        in to the selection.
         """
-        y = 0
-        while y < self.height() - 2:
-            x = 0
-            while x < self.width() - 2:
-                atom = AtomPair(x-x%AtomPair.XSIZE, y-y%AtomPair.YSIZE,
-                                self.parentItem(), self)
-                atom.copyFromSurface()
-                x += AtomPair.XSIZE
-            y += AtomPair.YSIZE
+        left, top, right, bottom = self.cellRect()
+        layer = self.parentItem()
+        self.left_status, self.right_status = layer.grid.getRect(left, top, right, bottom)
+        layer.setRect(left, top, np.zeros_like(self.left_status),
+                      np.zeros_like(self.right_status))
+
+    def cellRect(self):
+        """Return the (left, top, right, bottom) grid rectangle of the
+        selected cells.
+        """
+        left = int(round(self.left() / AtomPair.XSIZE))
+        top = int(round(self.top() / AtomPair.YSIZE))
+        return (left, top, left + int(round(self.width() / AtomPair.XSIZE)),
+                top + int(round(self.height() / AtomPair.YSIZE)))
+
+    def hasCells(self):
+        """Check if the selection holds any hydrogen."""
+        return self.left_status.size > 0
+
+    def getStatus(self, column, row):
+        """Return the left and right status of the selected cell at
+        (column, row) given in grid coordinates.
+        """
+        left, top, right, bottom = self.cellRect()
+        return (int(self.left_status[row - top, column - left]),
+                int(self.right_status[row - top, column - left]))
+
+    def setStatus(self, column, row, left=None, right=None):
+        """Set the status of the selected cell at (column, row). None
+        leaves the corresponding status untouched.
+        """
+        x, y = self.cellRect()[:2]
+        if left is not None:
+            self.left_status[row - y, column - x] = left
+        if right is not None:
+            self.right_status[row - y, column - x] = right
+        if self.raster is not None:
+            self.raster.setCell(column - x, row - y, self.left_status[row - y, column - x],
+                                self.right_status[row - y, column - x])
+
+    def statusChanged(self):
+        """Schedule a redraw after the status arrays were changed in place."""
+        self.raster = None
+        self.update()
+
+    def updateCell(self, column, row):
+        """Schedule a redraw of the selected cell at (column, row)."""
+        self.update(column * AtomPair.XSIZE - self.left(),
+                    row * AtomPair.YSIZE - self.top(),
+                    AtomPair.XSIZE, AtomPair.YSIZE)
 
     def updateIndexing(self):
         """Update the atom index of the surface."""
         if not self.collidesWithSelections():
             new_rect = self.mapRectToScene(self.boundingRect())
             if new_rect != self.indexed_rect:
-                if self.indexed_rect is not None:
-                    self.parentItem().removeFromIndex(self.indexed_rect)
                 self.parentItem().addToIndex(self)
                 self.indexed_rect = new_rect
 
@@ -97,49 +155,152 @@ class SelectionBox(QtGui.QGraphicsItem):
         QtCore.QObject.connect(remove_hydrogen, QtCore.SIGNAL("triggered()"), self.vacateAtoms)
         menu.addAction(remove_hydrogen)
 
+        edit_menu = menu.addMenu("Edit selected atoms")
+
+        invert = QtGui.QAction("Invert vacancies", edit_menu)
+        QtCore.QObject.connect(invert, QtCore.SIGNAL("triggered()"), self.invertVacancies)
+        edit_menu.addAction(invert)
+
+        for name, pattern in [("Fill checkerboard", "checkerboard"),
+                              ("Fill every other row", "rows"),
+                              ("Fill every other column", "columns")]:
+            fill_pattern = QtGui.QAction(name, edit_menu)
+            QtCore.QObject.connect(fill_pattern, QtCore.SIGNAL("triggered()"),
+                                   lambda pattern=pattern: self.fillPattern(pattern))
+            edit_menu.addAction(fill_pattern)
+
+        replace = QtGui.QAction("Replace atoms...", edit_menu)
+        QtCore.QObject.connect(replace, QtCore.SIGNAL("triggered()"), self.replaceAtoms)
+        edit_menu.addAction(replace)
+
+        random_fill = QtGui.QAction("Random fill...", edit_menu)
+        QtCore.QObject.connect(random_fill, QtCore.SIGNAL("triggered()"), self.randomFill)
+        edit_menu.addAction(random_fill)
+
         remove = QtGui.QAction("Deselect", menu)
         QtCore.QObject.connect(remove, QtCore.SIGNAL("triggered()"), self.deselect)
         menu.addAction(remove)
 
     def deselect(self):
-        """Remove the item from the scene and copy the atoms
+        """Remove the item from the scene and copy the hydrogen
         back to the surface.
         """
-        for item in self.childItems():
-            item.copyToSurface()
+        self.scene().journal.record(SelectionLift(self, self.parentItem(), False))
+        self.drop()
         self.reset()
 
+    def drop(self):
+        """Copy the hydrogen of the selection back to the surface."""
+        if self.hasCells():
+            left, top = self.cellRect()[:2]
+            self.parentItem().setRect(left, top, self.left_status, self.right_status)
+
     def save(self):
         """Save the item."""
         self.scene().views()[0].window().saveBlock(self)
         self.scene().views()[0].parent().updateBlocks()
 
     def vacateAtoms(self):
-        for item in self.childItems():
-            item.left_status = item.VACANT
-            item.right_status = item.VACANT
-        self.update()
+        self.setAtoms(AtomPair.VACANT)
 
     def fillAtoms(self):
-        for item in self.childItems():
-            item.left_status = self.parentItem().current_atom
-            item.right_status = self.parentItem().current_atom
-        self.update()
+        self.setAtoms(self.parentItem().current_atom)
+
+    def setAtoms(self, status):
+        """Set all the selected hydrogen to status."""
+        self.setStatusArrays(status, status)
+
+    def setStatusArrays(self, left_status, right_status):
+        """Set the selected hydrogen to the statuses in the arrays
+        covering the selection.
+        """
+        edit = SelectionFill(self, left_status, right_status)
+        edit.redo()
+        self.scene().journal.record(edit)
+
+    def invertVacancies(self):
+        """Fill the vacancies with the current atom and vacate the rest."""
+        self.setStatusArrays(*selection_tools.invertVacancies(
+            self.left_status, self.right_status, self.parentItem().current_atom))
+
+    def fillPattern(self, pattern):
+        """Fill every other hydrogen in the given pattern with the current
+        atom and vacate the rest.
+        """
+        self.setStatusArrays(*selection_tools.patternFill(
+            self.left_status.shape, self.cellRect()[:2], pattern,
+            self.parentItem().current_atom))
+
+    def replaceAtoms(self):
+        """Ask for two statuses and replace the first with the second."""
+        names = self.statusNames()
+        window = self.scene().views()[0].window()
+        old, ok = QtGui.QInputDialog.getItem(window, "Replace atoms", "Replace:",
+                                             names, 0, False)
+        if not ok:
+            return
+        new, ok = QtGui.QInputDialog.getItem(window, "Replace atoms", "With:",
+                                             names, 0, False)
+        if not ok:
+            return
+        # The names are listed in the order of the statuses from vacant up
+        self.setStatusArrays(*selection_tools.replaceStatus(
+            self.left_status, self.right_status,
+            names.index(old) + AtomPair.VACANT, names.index(new) + AtomPair.VACANT))
+
+    def randomFill(self):
+        """Ask for a density and a seed and fill the hydrogen randomly with
+        the current atom at that density.
+        """
+        window = self.scene().views()[0].window()
+        density, ok = QtGui.QInputDialog.getDouble(window, "Random fill", "Density:",
+                                                   0.5, 0, 1, 2)
+        if not ok:
+            return
+        seed, ok = QtGui.QInputDialog.getInt(window, "Random fill", "Seed:", 0, 0)
+        if not ok:
+            return
+        self.setStatusArrays(*selection_tools.randomFill(
+            self.left_status.shape, self.parentItem().current_atom, density, seed))
+
+    def statusNames(self):
+        """Return the names of the statuses shown when asking for one."""
+        atom_types = self.parentItem().atom_types
+        return ["Vacant"] + ["%d: %s" % (i + 1, atom_type)
+                             for i, atom_type in enumerate(atom_types)]
 
     def reset(self):
-        self.parentItem().removeFromIndex(self.sceneBoundingRect())
+        self.parentItem().removeFromIndex(self)
         self.scene().removeItem(self)
 
-    def getOutput(self, result, options):
-        for item in self.childItems():
-            item.getOutput(result, options)
+    def restore(self, layer):
+        """Add the selection back to the layer after a reset."""
+        self.setParentItem(layer)
+        self.indexed_rect = None
+        self.updateIndexing()
+
+    def writeOutput(self, writer, options):
+        layer = self.parentItem()
+        writeCells(writer, options, self.left_status, self.right_status,
+                   self.cellRect()[:2], layer.scene().layers.index(layer),
+                   layer.gridRect())
+
+    def getOutputCount(self, options):
+        layer = self.parentItem()
+        return cellsOutputCount(options, self.left_status, self.right_status,
+                                layer.scene().layers.index(layer))
 
     def onSurface(self):
         """Check if the item is on the surface."""
-        if self.collidesWithItem(self.parentItem(), QtCore.Qt.ContainsItemShape):
-            return True
-        else:
-            return False
+        return self.parentItem().containsRect(*self.surfaceRect())
+
+    def surfaceRect(self):
+        """Return the (left, top, right, bottom) scene rectangle that has
+        to be on the surface.
+        """
+        left = self.left() + min(0, self.width())
+        top = self.top() + min(0, self.height())
+        return left, top, left + abs(self.width()), top + abs(self.height())
 
     def collidesWithSelections(self):
         """Check if the contact collides with other contacts."""
@@ -192,29 +353,82 @@ class SelectionBox(QtGui.QGraphicsItem):
         return path
 
     def paint(self, painter, options, widget):
-        """Paint the box."""
+        """Paint the box and the selected hydrogen inside the exposed
+        area. Zoomed out the hydrogen are painted from a raster like the
+        hydrogen of the layer.
+        """
         pen = QtGui.QPen(QtGui.QColor(255, 255, 0))
         pen.setWidth(2)
         painter.setPen(pen)
-        if self.childItems():
+        if self.hasCells():
             painter.setBrush(QtGui.QColor(80, 80, 122))
         painter.drawRect(0, 0, self.width(), self.height())
+        if not self.hasCells():
+            return
+        rows, columns = self.left_status.shape
+        rect = options.exposedRect
+        left = max(int(rect.left() // AtomPair.XSIZE), 0)
+        top = max(int(rect.top() // AtomPair.YSIZE), 0)
+        right = min(int(-(-rect.right() // AtomPair.XSIZE)), columns)
+        bottom = min(int(-(-rect.bottom() // AtomPair.YSIZE)), rows)
+        if left >= right or top >= bottom:
+            return
+        detail = options.levelOfDetailFromTransform(painter.worldTransform())
+        if detail < self.parentItem().RASTER_DETAIL:
+            self.paintRaster(painter, left, top, right, bottom)
+            return
+        painter.setPen(AtomPair.PEN)
+        for row in range(top, bottom):
+            for column in range(left, right):
+                AtomPair.paintPair(painter, column * AtomPair.XSIZE, row * AtomPair.YSIZE,
+                                   self.left_status[row, column],
+                                   self.right_status[row, column])
+
+    def paintRaster(self, painter, left, top, right, bottom):
+        """Paint the selected hydrogen inside the given rectangle of the
+        selection from a raster. The raster is rebuilt when the status
+        arrays have been replaced.
+        """
+        if (self.raster is None or self.raster_status[0] is not self.left_status or
+                self.raster_status[1] is not self.right_status):
+            rows, columns = self.left_status.shape
+            grid = LayerGrid.fromArrays(0, 0, self.left_status, self.right_status)
+            self.raster = LayerRaster(grid, (0, 0, columns, rows))
+            self.raster_status = (self.left_status, self.right_status)
+        self.raster.paint(painter, left, top, right, bottom)
 
     def mousePressEvent(self, event):
-        """If left mouse button is pressed down start dragging
-        the item. Rotate the item if middle button is pressed.
+        """If left mouse button is pressed down with shift start dragging
+        the item. Without modifiers toggle the hydrogen under the mouse.
         """
         if (event.button() == QtCore.Qt.LeftButton and
            event.modifiers() == QtCore.Qt.ShiftModifier):
             self.dragged = True
+            self.drag_start = self.pos()
+        elif (event.button() == QtCore.Qt.LeftButton and
+              event.modifiers() == QtCore.Qt.NoModifier and self.hasCells()):
+            column, row = AtomPair.cellAt(event.scenePos())
+            left, top, right, bottom = self.cellRect()
+            if left <= column < right and top <= row < bottom:
+                self.parentItem().toggleAtom(GridCell(self, column, row),
+                                             event.pos().x() % AtomPair.XSIZE
+                                             < AtomPair.XSIZE/2)
+            else:
+                event.ignore()
         else:
             super(SelectionBox, self).mousePressEvent(event)
 
     def mouseReleaseEvent(self, event):
-        """End drag when mouse is released."""
+        """End drag and painting when mouse is released."""
         if event.button() == QtCore.Qt.LeftButton:
+            self.parentItem().endPainting()
             self.dragged = False
             self.updateIndexing()
+            if self.drag_start is not None:
+                edit = ItemMove(self, self.drag_start, self.rotation())
+                if not edit.isEmpty():
+                    self.scene().journal.record(edit)
+                self.drag_start = None
             self.scene().painting_status = None
             self.scene().views()[0].endScroll()
             self.ensureVisible()
@@ -222,9 +436,12 @@ class SelectionBox(QtGui.QGraphicsItem):
 
     def mouseMoveEvent(self, event):
         """If circuit is being dragged try to set the item position
-        to the mouse position.
+        to the mouse position. If the hydrogen are being painted paint
+        the line moved by the mouse.
         """
-        if self.dragged:
+        if self.parentItem().painting_status is not None:
+            self.parentItem().paintLine(event.lastScenePos(), event.scenePos())
+        elif self.dragged:
             old_pos = self.pos()
             new_pos = event.scenePos()
             new_pos.setX(new_pos.x() - new_pos.x() % AtomPair.XSIZE)
@@ -265,29 +482,91 @@ class SelectionBox(QtGui.QGraphicsItem):
         return self.pos().y() +  self.height()
 
 
+def writeCells(writer, options, left_status, right_status, corner, layer_n, bounds):
+    """Write the atoms of selected cells with the top left cell at the grid
+    position corner on a layer with the given grid bounds.
+    """
+    rows, columns = left_status.shape
+    elements, positions = output.layerAtoms(
+        left_status, right_status,
+        (np.arange(columns) + corner[0] - bounds[0]) * output.X_SCALE,
+        (np.arange(rows) + corner[1] - bounds[1]) * output.Y_SCALE, layer_n, options)
+    writer.writeAtoms(elements, positions)
+
+
+def cellsOutputCount(options, left_status, right_status, layer_n):
+    """Return the number of atoms writeCells writes."""
+    return output.layerAtomCount(left_status, right_status, layer_n, options)
+
+
 class SaveSelection(object):
 
     def __init__(self, selection):
         self.x = selection.pos().x()
         self.y = selection.pos().y()
-        self.size = selection.size
         self.width = selection.width()
         self.height = selection.height()
-        self.child_items = []
-        for child in selection.childItems():
-            self.child_items.append(child.getSaveState())
+        self.left_status = selection.left_status.copy()
+        self.right_status = selection.right_status.copy()
+
+    def __setstate__(self, state):
+        """Restore a pickled selection. Older saves store the hydrogen as
+        child items which are converted in to status arrays once here.
+        """
+        child_items = state.pop("child_items", None)
+        self.__dict__.update(state)
+        if child_items is not None:
+            shape = (int(round(self.height / AtomPair.YSIZE)),
+                     int(round(self.width / AtomPair.XSIZE)))
+            self.left_status = np.zeros(shape, dtype=LayerGrid.DTYPE)
+            self.right_status = np.zeros(shape, dtype=LayerGrid.DTYPE)
+            if child_items:
+                cells = np.array([(child.x, child.y) + child.getStatus()
+                                  for child in child_items], dtype=float)
+                columns = np.round(cells[:, 0] / AtomPair.XSIZE).astype(int)
+                rows = np.round(cells[:, 1] / AtomPair.YSIZE).astype(int)
+                self.left_status[rows, columns] = cells[:, 2]
+                self.right_status[rows, columns] = cells[:, 3]
+
+    def getStatus(self):
+        """Return the left and right status arrays of the saved selection."""
+        return self.left_status, self.right_status
+
+    def cellCorner(self):
+        """Return the grid position of the top left saved cell."""
+        return int(round(self.x / AtomPair.XSIZE)), int(round(self.y / AtomPair.YSIZE))
 
     def load(self, surface):
-        selection = SelectionBox(QtCore.QPointF(self.x, self.y), surface)
-        selection.size = QtCore.QSizeF(self.width, self.height)
-        for child in self.child_items:
-            child.load(surface, selection)
+        selection = self.insert(surface)
         selection.updateIndexing()
         return selection
 
+    def cellRect(self):
+        """Return the (left, top, right, bottom) grid rectangle of the
+        saved hydrogen.
+        """
+        left, top = self.cellCorner()
+        rows, columns = self.getStatus()[0].shape
+        return left, top, left + columns, top + rows
+
+    def writeOutput(self, writer, options, layer_n, bounds):
+        """Write the atoms of the saved selection on a layer with the given
+        grid bounds with the output writer.
+        """
+        left_status, right_status = self.getStatus()
+        writeCells(writer, options, left_status, right_status, self.cellCorner(),
+                   layer_n, bounds)
+
+    def getOutputCount(self, options, layer_n, bounds):
+        """Return the number of atoms writeOutput writes."""
+        left_status, right_status = self.getStatus()
+        return cellsOutputCount(options, left_status, right_status, layer_n)
+
     def insert(self, surface):
         selection = SelectionBox(QtCore.QPointF(self.x, self.y), surface)
         selection.size = QtCore.QSizeF(self.width, self.height)
-        for child in self.child_items:
-            child.load(surface, selection)
+        # The arrays are copied in whole so inserting doesn't depend on
+        # the number of cells in the block
+        selection.left_status = np.array(self.left_status, dtype=LayerGrid.DTYPE)
+        selection.right_status = np.array(self.right_status, dtype=LayerGrid.DTYPE)
         return selection
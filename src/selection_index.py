@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class SelectionIndex(object):
+    """Index of the selections on a layer by the integer (column, row) of
+    the cells they cover.
+
+    Every selection covers a rectangle of cells. The layer is split in to
+    buckets of BUCKET_SIZE x BUCKET_SIZE cells that know the selections
+    overlapping them, so a lookup only checks the few selections of a
+    single bucket and adding or removing a selection doesn't touch its
+    cells.
+    """
+
+    BUCKET_SIZE = 16
+
+    def __init__(self):
+        self.rects = {}
+        self.buckets = {}
+
+    def bucketsOf(self, rect):
+        """Return the keys of the buckets overlapping the grid rectangle."""
+        left, top, right, bottom = rect
+        size = self.BUCKET_SIZE
+        return [(x, y) for y in range(top // size, (bottom - 1) // size + 1)
+                for x in range(left // size, (right - 1) // size + 1)]
+
+    def add(self, selection, rect):
+        """Index the selection covering the (left, top, right, bottom)
+        grid rectangle.
+        """
+        self.remove(selection)
+        if rect[0] >= rect[2] or rect[1] >= rect[3]:
+            return
+        self.rects[selection] = rect
+        for key in self.bucketsOf(rect):
+            self.buckets.setdefault(key, set()).add(selection)
+
+    def remove(self, selection):
+        """Remove the selection from the index if it is indexed."""
+        rect = self.rects.pop(selection, None)
+        if rect is None:
+            return
+        for key in self.bucketsOf(rect):
+            bucket = self.buckets[key]
+            bucket.discard(selection)
+            if not bucket:
+                del self.buckets[key]
+
+    def find(self, column, row):
+        """Return the selection covering the cell at (column, row) or
+        None if the cell isn't selected.
+        """
+        key = (column // self.BUCKET_SIZE, row // self.BUCKET_SIZE)
+        for selection in self.buckets.get(key, ()):
+            left, top, right, bottom = self.rects[selection]
+            if left <= column < right and top <= row < bottom:
+                return selection
+        return None
+
+    def selectedRects(self):
+        """Return the (left, top, right, bottom) grid rectangles of the
+        selections as an array with a row per selection.
+        """
+        return np.array(self.rects.values(), dtype=int).reshape(-1, 4)
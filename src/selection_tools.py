@@ -0,0 +1,74 @@
+"""Bulk edits of the hydrogen in a selection.
+
+The tools take the left and right status arrays of the selected cells and
+return the new arrays, so every tool works on the whole selection at once
+instead of cell by cell. The hydrogen are treated as a grid with two
+columns per cell, the left hydrogen on the even and the right hydrogen on
+the odd columns.
+"""
+import numpy as np
+
+from atom_pair import AtomPair
+from layer_grid import LayerGrid
+
+PATTERNS = ("checkerboard", "rows", "columns")
+
+
+def hydrogenIndices(shape, corner=(0, 0)):
+    """Return the grid rows and the hydrogen columns of the left and right
+    hydrogen of the cells in arrays of the given shape, with the top left
+    cell at the grid position corner. The indices broadcast to shape.
+    """
+    rows, columns = np.ogrid[corner[1]:corner[1] + shape[0],
+                             corner[0]:corner[0] + shape[1]]
+    return rows, 2 * columns, 2 * columns + 1
+
+
+def fillWhere(left_mask, right_mask, status):
+    """Return status arrays with status where the masks are True and
+    vacancies elsewhere.
+    """
+    return (np.where(left_mask, status, AtomPair.VACANT).astype(LayerGrid.DTYPE),
+            np.where(right_mask, status, AtomPair.VACANT).astype(LayerGrid.DTYPE))
+
+
+def invertVacancies(left_status, right_status, status):
+    """Fill the vacancies with status and vacate the other hydrogen."""
+    return fillWhere(left_status == AtomPair.VACANT,
+                     right_status == AtomPair.VACANT, status)
+
+
+def replaceStatus(left_status, right_status, old, new):
+    """Set the hydrogen with the status old to new."""
+    return (np.where(left_status == old, new, left_status).astype(LayerGrid.DTYPE),
+            np.where(right_status == old, new, right_status).astype(LayerGrid.DTYPE))
+
+
+def patternFill(shape, corner, pattern, status):
+    """Fill every other hydrogen with status and vacate the rest. The
+    pattern is one of PATTERNS and is aligned to the grid, so selections
+    next to each other continue the same pattern.
+    """
+    rows, left_columns, right_columns = hydrogenIndices(shape, corner)
+    if pattern == "checkerboard":
+        left_mask = (rows + left_columns) % 2 == 0
+        right_mask = (rows + right_columns) % 2 == 0
+    elif pattern == "rows":
+        left_mask = right_mask = rows % 2 == 0
+    elif pattern == "columns":
+        left_mask = left_columns % 2 == 0
+        right_mask = right_columns % 2 == 0
+    else:
+        raise ValueError("Unknown pattern %r" % (pattern,))
+    # Spread the masks that only vary along rows or columns to the shape
+    cells = np.zeros(shape, dtype=bool)
+    return fillWhere(cells | left_mask, cells | right_mask, status)
+
+
+def randomFill(shape, status, density, seed=None):
+    """Fill each hydrogen with status with the probability density and
+    vacate the rest. The same seed always gives the same hydrogen.
+    """
+    random = np.random.RandomState(seed)
+    return fillWhere(random.random_sample(shape) < density,
+                     random.random_sample(shape) < density, status)
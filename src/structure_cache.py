@@ -0,0 +1,67 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+class StructureCache(object):
+    """Cache of parsed molecule structure files.
+
+    The structures are keyed by the path of the file and invalidated when
+    the modification time of the file changes. When the cache is full the
+    least recently used structure is evicted.
+    """
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.structures = OrderedDict()
+
+    def get(self, path):
+        """Return the element symbols and the Nx3 coordinate array of the
+        structure stored in the .xyz file at path.
+        """
+        path = os.path.abspath(path)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+        cached = self.structures.pop(path, None)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime,) + self.parse(path)
+        self.structures[path] = cached
+        while len(self.structures) > self.max_size:
+            self.structures.popitem(last=False)
+        return cached[1], cached[2]
+
+    def parse(self, path):
+        """Parse the .xyz file at path. Return the element symbols and
+        the coordinates of the atoms.
+        """
+        elements = []
+        coordinates = []
+        with open(path, "r") as f:
+            for i, line in enumerate(f):
+                split = line.split()
+                if i < 2 or not split:
+                    continue
+                elements.append(split[0])
+                coordinates.append([float(x) for x in split[1:4]])
+        elements = np.array(elements, dtype=object)
+        coordinates = np.array(coordinates, dtype=float).reshape(-1, 3)
+        elements.setflags(write=False)
+        coordinates.setflags(write=False)
+        return elements, coordinates
+
+    def clear(self):
+        """Remove all the structures from the cache."""
+        self.structures.clear()
+
+
+cache = StructureCache()
+
+
+def load(path):
+    """Return the element symbols and coordinates of the structure at path
+    from the process wide cache.
+    """
+    return cache.get(path)
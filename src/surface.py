@@ -1,8 +1,17 @@
+import math
+
 from PyQt4 import QtGui, QtCore
 import numpy as np
 
-from atom_pair import AtomPair
+from atom_pair import AtomPair, SaveAtom
+from layer_grid import LayerGrid, GridCell
+from layer_raster import LayerRaster
+from selection_index import SelectionIndex
+from tile_cache import TileCache
+from undo_journal import CellEdit, ItemPresence
 from molecule import Molecule
+from selection_box import SaveSelection
+from block_library import BlockError
 import output
 import molecular_scene
 import settings
@@ -18,15 +27,26 @@ TOPLB = 8
 
 
 class Surface(QtGui.QGraphicsItem):
+    """A single layer of the setup. The hydrogen of the layer are stored
+    in the layer grid and painted by the surface item itself.
+    """
+
+    # Below this level of detail the hydrogen are painted from a raster
+    RASTER_DETAIL = 0.3
 
     def __init__(self, scene):
         super(Surface, self).__init__(scene=scene)
+        self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOption)
         self.size = None
         self.corner = None
         self.atom_types = None
-        self.surface_atoms = {}
-        self.selection_atoms = {}
+        self.grid = LayerGrid()
+        self.raster = None
+        self.tiles = TileCache()
+        self.selection_index = SelectionIndex()
+        self.items_rect = None
         self.painting_status = None
+        self.stroke = None
         self.current_atom = 0
         self.currently_painting = False
 
@@ -37,20 +57,12 @@ class Surface(QtGui.QGraphicsItem):
                         settings.layer_size[0] - settings.layer_size[0] % AtomPair.XSIZE,
                         settings.layer_size[1] - settings.layer_size[1] % AtomPair.YSIZE)
         surface.corner = QtCore.QPointF(0, 0)
-        surface.populate()
         return surface
 
     def matchSize(self, other):
         """Match the size of other surface."""
         self.size = other.size
         self.corner = other.corner
-        self.populate()
-
-    def addAtom(self, x, y):
-        """Add a hydrogen pair on to the surface at (x,y)."""
-        if (x, y) not in self.surface_atoms:
-            atom = AtomPair(x, y, self)
-            self.surface_atoms[(x, y)] = atom
 
     def addDroppedItem(self, pos, dropped_item):
         """Add a item dropped in to the scene on to the surface."""
@@ -58,7 +70,11 @@ class Surface(QtGui.QGraphicsItem):
         data_type = dropped_item.data(0, QtCore.Qt.UserRole)
         data = dropped_item.data(0, QtCore.Qt.UserRole + 1)
         if data_type == "BLOCK":
-            new_item = data.insert(self)
+            try:
+                new_item = data.insert(self)
+            except BlockError:
+                status_bar.showMessage("The block couldn't be read.", 3000)
+                return
             new_item.setPos(pos.x() - pos.x()%AtomPair.XSIZE,
                             pos.y() - pos.y()%AtomPair.YSIZE)
         elif data_type == "MOLECULE":
@@ -70,41 +86,199 @@ class Surface(QtGui.QGraphicsItem):
         if not new_item.resolveCollisions():
             self.scene().removeItem(new_item)
             status_bar.showMessage("Item couldn't be added there.", 3000)
-        elif data_type == "BLOCK":
+            return
+        if data_type == "BLOCK":
             new_item.updateIndexing()
-
-    def indexAtoms(self):
-        """Add unindexed surface atoms to the index."""
-        for item in self.childItems():
-            if isinstance(item, AtomPair):
-                if not (item.x(), item.y()) in self.surface_atoms:
-                    self.surface_atoms[item.x(), item.y()] = item
+        self.scene().journal.record(ItemPresence(new_item, self))
 
     def findAtomAt(self, pos):
         """Return the hydrogen at the given position."""
-        key = (pos.x() - pos.x()%AtomPair.XSIZE, pos.y() - pos.y()%AtomPair.YSIZE)
-        if key in self.selection_atoms:
-            return self.selection_atoms[key]
-        elif key in self.surface_atoms:
-            return self.surface_atoms[key]
+        column, row = AtomPair.cellAt(pos)
+        selection = self.selection_index.find(column, row)
+        if selection is not None:
+            return GridCell(selection, column, row)
+        else:
+            return self.surfaceAtomAt(pos)
+
+    def surfaceAtomAt(self, pos):
+        """Return the surface hydrogen at the given position ignoring
+        selections.
+        """
+        return self.gridCell(*AtomPair.cellAt(pos))
+
+    def gridCell(self, column, row):
+        """Return the surface hydrogen of the cell at (column, row) or None
+        if the cell isn't on the surface.
+        """
+        if self.cellOnSurface(column, row):
+            return GridCell(self, column, row)
         else:
             return None
 
-    def removeFromIndex(self, rect):
-        """Remove items inside the given rectangle from the selection index."""
-        xmin = rect.left() + AtomPair.XSIZE - rect.left() % AtomPair.XSIZE
-        xmax = rect.right() - AtomPair.XSIZE
-        ymin = rect.top() + AtomPair.YSIZE - rect.top() % AtomPair.YSIZE
-        ymax = rect.bottom() - AtomPair.YSIZE
-        for x in range(int(xmin), int(xmax), AtomPair.XSIZE):
-            for y in range(int(ymin), int(ymax), AtomPair.YSIZE):
-                del self.selection_atoms[(x, y)]
+    def containsRect(self, left, top, right, bottom):
+        """Check if the scene rectangle is inside the surface. The shape of
+        the surface extends 2 units past its borders.
+        """
+        return (left >= self.left() - 2 and top >= self.top() - 2 and
+                right <= self.right() + 2 and bottom <= self.bottom() + 2)
+
+    def cellOnSurface(self, column, row):
+        """Check if the cell at (column, row) is on the surface."""
+        left, top, right, bottom = self.gridRect()
+        return left <= column < right and top <= row < bottom
+
+    def gridRect(self, rect=None):
+        """Return the (left, top, right, bottom) grid rectangle of the
+        surface. If rect is given return only the part intersecting it.
+        """
+        left = int(round(self.left() / AtomPair.XSIZE))
+        top = int(round(self.top() / AtomPair.YSIZE))
+        right = int(round(self.right() / AtomPair.XSIZE))
+        bottom = int(round(self.bottom() / AtomPair.YSIZE))
+        if rect is not None:
+            left = max(left, int(math.floor(rect.left() / AtomPair.XSIZE)))
+            top = max(top, int(math.floor(rect.top() / AtomPair.YSIZE)))
+            right = min(right, int(math.ceil(rect.right() / AtomPair.XSIZE)))
+            bottom = min(bottom, int(math.ceil(rect.bottom() / AtomPair.YSIZE)))
+        return left, top, max(left, right), max(top, bottom)
+
+    def getStatus(self, column, row):
+        """Return the left and right status of the cell at (column, row)."""
+        return self.grid.getStatus(column, row)
+
+    def setStatus(self, column, row, left=None, right=None):
+        """Set the status of the cell at (column, row). None leaves the
+        corresponding status untouched.
+        """
+        if self.grid.isEmpty() and not left and not right:
+            # The cell is allready in its default state
+            return
+        self.populate()
+        self.grid.setStatus(column, row, left, right)
+        self.scene().changes.cellChanged(self, column, row)
+        if self.raster is not None:
+            self.raster.setCell(column, row, *self.grid.getStatus(column, row))
+        self.tiles.invalidateCell(column, row)
+
+    def setRect(self, left, top, left_status, right_status):
+        """Copy the given status arrays in to the grid with their first
+        element at (left, top).
+        """
+        if self.grid.isEmpty() and not (left_status.any() or right_status.any()):
+            return
+        self.populate()
+        self.grid.setRect(left, top, left_status, right_status)
+        rows, columns = left_status.shape
+        self.scene().changes.blockChanged(self, left, top, left + columns, top + rows)
+        # Rebuild the raster from the grid when it is next needed
+        self.raster = None
+        self.tiles.invalidateRect(left, top, left + columns, top + rows)
+        self.update(left * AtomPair.XSIZE, top * AtomPair.YSIZE,
+                    columns * AtomPair.XSIZE, rows * AtomPair.YSIZE)
+
+    def setCells(self, columns, rows, left_status, right_status):
+        """Set the statuses of the cells at the given columns and rows."""
+        if len(columns) == 0:
+            return
+        self.populate()
+        self.grid.setCells(columns, rows, left_status, right_status)
+        self.scene().changes.cellsChanged(self, columns, rows)
+        if self.raster is not None and not self.raster.setCells(
+                columns, rows, *self.grid.getCells(columns, rows)):
+            self.raster = None
+        left, top = int(np.min(columns)), int(np.min(rows))
+        right, bottom = int(np.max(columns)) + 1, int(np.max(rows)) + 1
+        self.tiles.invalidateRect(left, top, right, bottom)
+        self.update(left * AtomPair.XSIZE, top * AtomPair.YSIZE,
+                    (right - left) * AtomPair.XSIZE, (bottom - top) * AtomPair.YSIZE)
+
+    def updateCell(self, column, row):
+        """Schedule a redraw of the cell at (column, row)."""
+        self.update(column * AtomPair.XSIZE, row * AtomPair.YSIZE,
+                    AtomPair.XSIZE, AtomPair.YSIZE)
+
+    def toggleAtom(self, atom, left):
+        """Toggle the state of the left or right hydrogen of the atom
+        and start painting with the new state.
+        """
+        self.recordCell(atom.owner, atom.column, atom.row)
+        if left:
+            if atom.left_status != self.current_atom:
+                atom.left_status = self.current_atom
+                self.painting_status = AtomPair.CURRENT_ATOM
+            else:
+                atom.left_status = AtomPair.VACANT
+                self.painting_status = AtomPair.VACANT
+        else:
+            if atom.right_status != self.current_atom:
+                atom.right_status = self.current_atom
+                self.painting_status = AtomPair.CURRENT_ATOM
+            else:
+                atom.right_status = AtomPair.VACANT
+                self.painting_status = AtomPair.VACANT
+        atom.update()
+
+    def paintHalfCell(self, column, row, left, status):
+        """Set the left or right hydrogen of the cell at (column, row) to
+        status. Return True if the hydrogen was on the layer.
+        """
+        selection = self.selection_index.find(column, row)
+        if selection is not None:
+            self.recordCell(selection, column, row)
+            if left:
+                selection.setStatus(column, row, left=status)
+            else:
+                selection.setStatus(column, row, right=status)
+            selection.updateCell(column, row)
+        elif self.cellOnSurface(column, row):
+            self.recordCell(self, column, row)
+            if left:
+                self.setStatus(column, row, left=status)
+            else:
+                self.setStatus(column, row, right=status)
+            self.updateCell(column, row)
+        else:
+            return False
+        return True
+
+    def paintLine(self, start, end):
+        """Set all the hydrogen crossed by the line from start to end to
+        the state given by painting_status.
+        """
+        if self.painting_status == AtomPair.CURRENT_ATOM:
+            status = self.current_atom
+        else:
+            status = AtomPair.VACANT
+        for half_column, row in halfCellsOnLine(start.x(), start.y(), end.x(), end.y()):
+            self.paintHalfCell(half_column // 2, row, half_column % 2 == 0, status)
+
+    def recordCell(self, owner, column, row):
+        """Record the status of the cell of owner at (column, row) in the
+        current stroke before it is changed.
+        """
+        if self.stroke is None:
+            self.stroke = CellEdit()
+        self.stroke.record(owner, column, row)
+
+    def endPainting(self):
+        """Stop painting and add the painted stroke to the undo journal."""
+        self.painting_status = None
+        if self.stroke is not None:
+            self.stroke.finish()
+            if not self.stroke.isEmpty():
+                self.scene().journal.record(self.stroke)
+            self.stroke = None
+
+    def removeFromIndex(self, selection):
+        """Remove selection from the selection index."""
+        self.selection_index.remove(selection)
 
     def addToIndex(self, selection):
-        """Add child items of selection to the index."""
-        for item in selection.childItems():
-            pos = item.scenePos()
-            self.selection_atoms[(pos.x(), pos.y())] = item
+        """Add the cells of selection to the index."""
+        if selection.hasCells():
+            self.selection_index.add(selection, selection.cellRect())
+        else:
+            self.selection_index.remove(selection)
 
     def boundingRect(self):
         """Return the bounding rectangle of the surface."""
@@ -112,30 +286,11 @@ class Surface(QtGui.QGraphicsItem):
                              self.size + QtCore.QSizeF(4, 4))
 
     def populate(self):
-        """Fill the surface with hydrogen."""
-        y = self.top()
-        while y < self.bottom():
-            x = self.left()
-            while x < self.right():
-                self.addAtom(x, y)
-                x += AtomPair.XSIZE
-            y += AtomPair.YSIZE
-
-    def populateVerticalLines(self, xmin, xmax):
-        """Fill the vertical lines between xmin and xmax with hydrogen."""
-        for x in range(int(xmin), int(xmax) + AtomPair.XSIZE, AtomPair.XSIZE):
-            y = self.top()
-            while y < self.bottom():
-                self.addAtom(x, y)
-                y += AtomPair.YSIZE
-
-    def populateHorizontalLines(self, ymin, ymax):
-        """Fill the horizontal lines between ymin and ymax with hydrogen."""
-        for y in range(int(ymin), int(ymax) + AtomPair.YSIZE, AtomPair.YSIZE):
-            x = self.left()
-            while x < self.right():
-                self.addAtom(x, y)
-                x += AtomPair.XSIZE
+        """Allocate the grid for the whole surface. Layers are left empty
+        until they are first edited since the cells missing from the grid
+        are in their default state.
+        """
+        self.grid.extend(*self.gridRect())
 
     def resize(self, pos, border):
         """Resize the surface by moving given border to the given position."""
@@ -145,7 +300,6 @@ class Surface(QtGui.QGraphicsItem):
             if pos.x() < self.right():
                 if pos.x() < self.left() - AtomPair.XSIZE:
                     self.setLeft(pos.x() - pos.x() % AtomPair.XSIZE + AtomPair.XSIZE)
-                    self.populateVerticalLines(self.left(), old_rect.left())
                 elif pos.x() > self.left() + AtomPair.XSIZE:
                     self.setLeft(pos.x() - pos.x() % AtomPair.XSIZE)
         if border == RIGHTB or border == BOTTOMRB or border == TOPRB:
@@ -154,12 +308,10 @@ class Surface(QtGui.QGraphicsItem):
                     self.setRight(pos.x() - pos.x() % AtomPair.XSIZE + AtomPair.XSIZE)
                 elif pos.x() > self.right() + AtomPair.XSIZE:
                     self.setRight(pos.x() - pos.x() % AtomPair.XSIZE)
-                    self.populateVerticalLines(old_rect.right(), self.right())
         if border == TOPB or border == TOPLB or border == TOPRB:
             if pos.y() < self.bottom():
                 if pos.y() < self.top() - AtomPair.YSIZE:
                     self.setTop(pos.y() - pos.y() % AtomPair.YSIZE + AtomPair.YSIZE)
-                    self.populateHorizontalLines(self.top(), old_rect.top())
                 elif pos.y() > self.top() + AtomPair.YSIZE:
                     self.setTop(pos.y() - pos.y() % AtomPair.YSIZE)
         if border == BOTTOMB or border == BOTTOMLB or border == BOTTOMRB:
@@ -168,36 +320,161 @@ class Surface(QtGui.QGraphicsItem):
                     self.setBottom(pos.y() - pos.y() % AtomPair.YSIZE + AtomPair.YSIZE)
                 elif pos.y() > self.bottom() + AtomPair.YSIZE:
                     self.setBottom(pos.y() - pos.y() % AtomPair.YSIZE)
-                    self.populateHorizontalLines(old_rect.bottom(), self.bottom())
         # Ignore the changes if contacts are outside of the new surface
+        if not self.containsRect(*self.itemsRect()):
+            self.size = old_rect.size()
+            self.corner = old_rect.topLeft()
+            return False
+
+    def itemsRect(self):
+        """Return the (left, top, right, bottom) scene rectangle covering
+        the child items. The rectangle is kept until endResize is called
+        since the items can't move while the surface is being resized.
+        """
+        if self.items_rect is None:
+            rects = [item.surfaceRect() for item in self.childItems()]
+            if rects:
+                left, top, right, bottom = zip(*rects)
+                self.items_rect = min(left), min(top), max(right), max(bottom)
+            else:
+                inf = float("inf")
+                self.items_rect = inf, inf, -inf, -inf
+        return self.items_rect
+
+    def endResize(self):
+        """Forget the rectangle of the child items used while resizing and
+        drop the hydrogen that were left outside of the surface. Until
+        then dragging a border back restores them. Return the columns,
+        rows, left statuses and right statuses of the dropped hydrogen.
+        """
+        self.items_rect = None
+        # Only the strips that are cropped are read
+        rect = self.gridRect()
+        dropped = self.grid.cellsOutside(*rect)
+        if self.grid.crop(*rect):
+            # The raster extends past the surface and may show dropped cells
+            self.raster = None
+        return dropped
+
+    def rect(self):
+        """Return the rectangle of the surface in scene coordinates."""
+        return QtCore.QRectF(self.corner, self.size)
+
+    def selectedRects(self):
+        """Return the grid rectangles of the selections on the layer."""
+        return self.selection_index.selectedRects()
+
+    def getOutputJob(self, options):
+        """Return the (grid, bounds, layer_n, options, selected) arguments
+        for writing the hydrogen of the layer.
+        """
+        layer_n = self.scene().layers.index(self)
+        return self.grid, self.gridRect(), layer_n, options, self.selectedRects()
+
+    def getOutputLayer(self, options):
+        """Return the (job, items_count, write_items) description of the
+        layer used by output.writeLayers.
+        """
+        return (self.getOutputJob(options), self.getItemsOutputCount(options),
+                lambda writer: self.writeItemsOutput(writer, options))
+
+    def writeOutput(self, writer, options):
+        """Write the atoms of the surface and its child items with the
+        output writer.
+        """
+        output.writeLayer(writer, *self.getOutputJob(options))
+        self.writeItemsOutput(writer, options)
+
+    def writeItemsOutput(self, writer, options):
+        """Write the atoms of the child items with the output writer."""
         for item in self.childItems():
-            if not isinstance(item, AtomPair):
-                if not item.onSurface():
-                    self.size = old_rect.size()
-                    self.corner = old_rect.topLeft()
-                    return False
-
-    def getOutput(self, result, options):
-        """Get the output information of the surface and its child items."""
-        for item in self.childItems():
-            item.getOutput(result, options)
-        return result
+            item.writeOutput(writer, options)
+
+    def getOutputCount(self, options):
+        """Return the number of atoms the surface and its child items
+        write to the output.
+        """
+        return (output.layerCount(*self.getOutputJob(options)) +
+                self.getItemsOutputCount(options))
+
+    def getItemsOutputCount(self, options):
+        """Return the number of atoms the child items write to the output."""
+        return sum(item.getOutputCount(options) for item in self.childItems())
+
+    def getSaveState(self, copy=True):
+        return SaveSurface(self, copy)
 
-    def getSaveState(self):
-        return SaveSurface(self)
+    def isUntouched(self):
+        """Check if the layer is in its default state without ever having
+        been written to.
+        """
+        return self.grid.isEmpty() and not self.childItems()
 
     def reset(self):
-        pass
+        """Reset all the hydrogen of the layer."""
+        self.grid = LayerGrid()
+        self.raster = None
+        self.tiles.clear()
+        self.scene().changes.snapshotNeeded()
+        self.update()
 
     def addContextActions(self, menu):
         """Add item specific context actions in to the menu."""
         pass
 
     def paint(self, painter, options, widget):
-        """Draw the surface."""
+        """Draw the surface and the hydrogen inside the exposed area."""
         painter.setPen(QtGui.QColor(0, 0, 0))
         painter.setBrush(QtGui.QColor(48, 48, 122))
         painter.drawRect(QtCore.QRectF(self.corner, self.size))
+        if self.scene().current_layer is not self:
+            return
+        left, top, right, bottom = self.gridRect(options.exposedRect)
+        if left == right or top == bottom:
+            return
+        detail = options.levelOfDetailFromTransform(painter.worldTransform())
+        if detail < self.RASTER_DETAIL:
+            self.paintRaster(painter, left, top, right, bottom)
+            return
+        self.tiles.paint(painter, self.grid, self.gridRect(), detail,
+                         left, top, right, bottom)
+
+    def paintRaster(self, painter, left, top, right, bottom):
+        """Paint the hydrogen inside the grid rectangle from the raster
+        of the layer. The raster is rebuilt if the surface grew past it.
+        """
+        bounds = self.gridRect()
+        if self.raster is None or not self.raster.covers(bounds):
+            # Leave room around the surface so that resizing it doesn't
+            # rebuild the raster on every step
+            margin_x = (bounds[2] - bounds[0]) // 4 + 1
+            margin_y = (bounds[3] - bounds[1]) // 4 + 1
+            self.raster = LayerRaster(self.grid, (bounds[0] - margin_x, bounds[1] - margin_y,
+                                                  bounds[2] + margin_x, bounds[3] + margin_y))
+        self.raster.paint(painter, left, top, right, bottom)
+
+    def mousePressEvent(self, event):
+        """Toggle the state of the hydrogen under the mouse."""
+        if (self.scene().current_layer is self and
+           event.button() == QtCore.Qt.LeftButton and
+           event.modifiers() == QtCore.Qt.NoModifier):
+            atom = self.surfaceAtomAt(event.scenePos())
+            if atom is not None:
+                pos = event.scenePos()
+                self.toggleAtom(atom, pos.x() % AtomPair.XSIZE < AtomPair.XSIZE/2)
+                return
+        super(Surface, self).mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        """Reset all the flags possibly set by other mouse events."""
+        self.endPainting()
+
+    def mouseMoveEvent(self, event):
+        """If were painting the hydrogen, set the state of the hydrogen
+        under the mouse to the one given by painting_status.
+        """
+        if self.painting_status is not None:
+            self.paintLine(event.lastScenePos(), event.scenePos())
 
     def width(self):
         """Return the width of the surface."""
@@ -246,25 +523,154 @@ class Surface(QtGui.QGraphicsItem):
         self.size.setHeight(self.height() + value - old_bottom)
 
 
+def halfCellsOnLine(x0, y0, x1, y1):
+    """Yield the (half column, row) indices of the half cells crossed by
+    the line from (x0, y0) to (x1, y1) in order. Half column 2*c is the
+    left half of column c. The cells are walked one border crossing at a
+    time so the cost is linear in the number of cells crossed.
+    """
+    half_width = AtomPair.XSIZE / 2.0
+    height = float(AtomPair.YSIZE)
+    x0, x1 = x0 / half_width, x1 / half_width
+    y0, y1 = y0 / height, y1 / height
+    i = int(math.floor(x0))
+    j = int(math.floor(y0))
+    steps = abs(int(math.floor(x1)) - i) + abs(int(math.floor(y1)) - j)
+    dx = x1 - x0
+    dy = y1 - y0
+    step_i = 1 if dx > 0 else -1
+    step_j = 1 if dy > 0 else -1
+    # Line parameter needed to cross one cell and to reach the next border
+    delta_x = abs(1 / dx) if dx else float("inf")
+    delta_y = abs(1 / dy) if dy else float("inf")
+    next_x = (i + 1 - x0 if dx > 0 else x0 - i) * delta_x if dx else float("inf")
+    next_y = (j + 1 - y0 if dy > 0 else y0 - j) * delta_y if dy else float("inf")
+    yield i, j
+    for k in range(steps):
+        if next_x < next_y:
+            i += step_i
+            next_x += delta_x
+        else:
+            j += step_j
+            next_y += delta_y
+        yield i, j
+
+
+def getDefaultOutputLayer(options, layer_n, bounds):
+    """Return the output.writeLayers description of a layer in its
+    default state that was never created.
+    """
+    return (LayerGrid(), bounds, layer_n, options, None), 0, lambda writer: None
+
+
 class SaveSurface(object):
+    """Save state of a layer. With copy False the save state refers to the
+    status arrays of the layer instead of copying them.
+    """
 
-    def __init__(self, surface):
+    def __init__(self, surface, copy=True):
         self.x = surface.corner.x()
         self.y = surface.corner.y()
         self.width = surface.width()
         self.height = surface.height()
         self.atom_types = surface.atom_types
+        if surface.grid.isSparse():
+            self.cells = surface.grid.nonDefaultCells()
+        else:
+            self.column = surface.grid.column
+            self.row = surface.grid.row
+            self.left_status = surface.grid.left_status
+            self.right_status = surface.grid.right_status
+            if copy:
+                self.left_status = self.left_status.copy()
+                self.right_status = self.right_status.copy()
         self.child_items = []
         for child in surface.childItems():
             self.child_items.append(child.getSaveState())
 
+    @classmethod
+    def matching(cls, other, atom_types):
+        """Return the save state of a layer in its default state with the
+        size of the saved layer other.
+        """
+        layer = cls.__new__(cls)
+        layer.x, layer.y = other.x, other.y
+        layer.width, layer.height = other.width, other.height
+        layer.atom_types = atom_types
+        layer.cells = LayerGrid().nonDefaultCells()
+        layer.child_items = []
+        return layer
+
+    def setGrid(self, grid):
+        """Store the layer grid in the save state in place of the saved
+        hydrogen.
+        """
+        for name in ("cells", "column", "row", "left_status", "right_status"):
+            self.__dict__.pop(name, None)
+        if grid.isSparse():
+            self.cells = grid.nonDefaultCells()
+        else:
+            self.column = grid.column
+            self.row = grid.row
+            self.left_status = grid.left_status
+            self.right_status = grid.right_status
+        self.child_items = self.getItems()
+
+    def gridRect(self):
+        """Return the (left, top, right, bottom) grid rectangle of the
+        saved surface.
+        """
+        return (int(round(self.x / AtomPair.XSIZE)), int(round(self.y / AtomPair.YSIZE)),
+                int(round((self.x + self.width) / AtomPair.XSIZE)),
+                int(round((self.y + self.height) / AtomPair.YSIZE)))
+
+    def getGrid(self):
+        """Return the layer grid stored in the save state."""
+        grid = LayerGrid()
+        if hasattr(self, "cells"):
+            grid.setCells(*self.cells)
+        elif isinstance(getattr(self, "left_status", None), np.memmap):
+            # Use the mapped arrays directly so that they are only read
+            # as needed. Writes to them are private to the process.
+            grid = LayerGrid.fromArrays(self.column, self.row,
+                                        self.left_status, self.right_status)
+        elif hasattr(self, "left_status"):
+            grid.setRect(self.column, self.row, self.left_status, self.right_status)
+        # Older saves store the hydrogen as child items
+        for child in self.child_items:
+            if isinstance(child, SaveAtom):
+                child.loadGrid(grid)
+        return grid
+
+    def getItems(self):
+        """Return the saved child items that aren't hydrogen."""
+        return [child for child in self.child_items if not isinstance(child, SaveAtom)]
+
+    def selectedRects(self):
+        """Return the grid rectangles of the saved selections."""
+        rects = [item.cellRect() for item in self.getItems()
+                 if isinstance(item, SaveSelection)]
+        return np.array(rects, dtype=int).reshape(-1, 4)
+
+    def getOutputLayer(self, options, layer_n, bounds):
+        """Return the (job, items_count, write_items) description of the
+        saved layer inside the grid bounds used by output.writeLayers.
+        """
+        job = (self.getGrid(), bounds, layer_n, options, self.selectedRects())
+        items_count = sum(item.getOutputCount(options, layer_n, bounds)
+                          for item in self.getItems())
+        def write_items(writer):
+            for item in self.getItems():
+                item.writeOutput(writer, options, layer_n, bounds)
+        return job, items_count, write_items
+
     def load(self, scene):
         surface = Surface(scene)
         surface.corner = QtCore.QPointF(self.x, self.y)
         surface.size = QtCore.QSizeF(self.width, self.height)
         surface.atom_types = self.atom_types
         scene.surface = surface
-        for child in self.child_items:
+        surface.grid = self.getGrid()
+        for child in self.getItems():
             child.load(surface)
-        surface.indexAtoms()
         return surface
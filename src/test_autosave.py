@@ -0,0 +1,236 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import save_file
+from autosave import Autosave, applyRecords
+from change_log import ChangeLog
+from layer_grid import LayerGrid
+from molecular_scene import SaveScene
+from surface import SaveSurface
+from undo_journal import ItemMove
+
+ATOM_TYPES = ["H", "CL", "BR", "I", "F"]
+SUBSTRATE_ATOM_TYPES = ["SI", "GE", "C", "SN", "PB"]
+
+
+def saveLayer(grid, child_items=()):
+    """Return the save state of a 40 x 20 cell layer with the given grid."""
+    layer = SaveSurface.__new__(SaveSurface)
+    layer.x, layer.y, layer.width, layer.height = 0.0, 0.0, 2000.0, 500.0
+    layer.atom_types = ATOM_TYPES
+    layer.child_items = list(child_items)
+    layer.setGrid(grid)
+    return layer
+
+
+def statusOf(save_layer):
+    """Return the statuses of the saved layer as nested lists."""
+    return [array.tolist() for array in save_layer.getGrid().getRect(*save_layer.gridRect())]
+
+
+class Item(object):
+    """Child item of a layer that saves as its position."""
+
+    def __init__(self, layer, x):
+        self.layer = layer
+        self.x = x
+
+    def parentItem(self):
+        return self.layer
+
+    def pos(self):
+        return self.x
+
+    def rotation(self):
+        return 0
+
+    def getSaveState(self):
+        return self.x
+
+
+class Layer(object):
+    """Layer with a grid and child items."""
+
+    def __init__(self):
+        self.grid = LayerGrid()
+        self.grid.extend(0, 0, 40, 20)
+        self.items = []
+
+    def childItems(self):
+        return self.items
+
+    def getSaveState(self):
+        return saveLayer(self.grid.copy(), [item.getSaveState() for item in self.items])
+
+
+class Scene(object):
+    """Scene with a surface and one substrate layer."""
+
+    def __init__(self):
+        self.layers = [Layer(), Layer()]
+        self.current_layer = self.layers[0]
+        self.changes = ChangeLog()
+
+    def getSaveState(self, copy=True):
+        save_scene = SaveScene.__new__(SaveScene)
+        save_scene.substrate_atom_types = SUBSTRATE_ATOM_TYPES
+        save_scene.layers = [layer.getSaveState() for layer in self.layers]
+        return save_scene
+
+
+class ApplyRecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        grid = LayerGrid()
+        grid.setStatus(15, 3, 1, 1)
+        self.save_scene = SaveScene.__new__(SaveScene)
+        self.save_scene.substrate_atom_types = SUBSTRATE_ATOM_TYPES
+        self.save_scene.layers = [saveLayer(grid), None]
+
+    def testCells(self):
+        applyRecords(self.save_scene, [("cells", 0, np.array([1, 2]), np.array([3, 3]),
+                                        np.array([1, 2]), np.array([0, -1]))])
+        grid = self.save_scene.layers[0].getGrid()
+        self.assertEqual([grid.getStatus(column, 3) for column in (1, 2, 15)],
+                         [(1, 0), (2, -1), (1, 1)])
+
+    def testBlockCreatesLayer(self):
+        ones = np.ones((2, 2), dtype=LayerGrid.DTYPE)
+        applyRecords(self.save_scene, [("block", 2, 4, 5, ones, -ones)])
+        layer = self.save_scene.layers[2]
+        self.assertIsNone(self.save_scene.layers[1])
+        self.assertEqual(layer.atom_types, SUBSTRATE_ATOM_TYPES)
+        self.assertEqual(layer.gridRect(), (0, 0, 40, 20))
+        self.assertEqual(layer.getGrid().getStatus(5, 6), (1, -1))
+
+    def testBounds(self):
+        applyRecords(self.save_scene, [("bounds", 0.0, 0.0, 500.0, 250.0),
+                                       ("bounds", 0.0, 0.0, 2000.0, 500.0)])
+        layer = self.save_scene.layers[0]
+        self.assertEqual(layer.gridRect(), (0, 0, 40, 20))
+        # The cell cropped by the smaller size stays cropped
+        self.assertEqual(layer.getGrid().getStatus(15, 3), (0, 0))
+
+    def testItems(self):
+        applyRecords(self.save_scene, [("items", 0, ["item"])])
+        self.assertEqual(self.save_scene.layers[0].child_items, ["item"])
+
+
+class ChangeLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scene = Scene()
+        self.saved = self.scene.getSaveState()
+        self.changes = self.scene.changes
+        self.changes.clear()
+
+    def assertRecordsReplayed(self):
+        self.assertFalse(self.changes.isEmpty())
+        applyRecords(self.saved, self.changes.takeRecords(self.scene))
+        self.assertTrue(self.changes.isEmpty())
+        for save_layer, layer in zip(self.saved.layers, self.scene.layers):
+            self.assertEqual(statusOf(save_layer), statusOf(layer.getSaveState()))
+            self.assertEqual(save_layer.child_items,
+                             [item.getSaveState() for item in layer.items])
+
+    def testCells(self):
+        surface, substrate = self.scene.layers
+        surface.grid.setStatus(3, 4, 1, 2)
+        self.changes.cellChanged(surface, 3, 4)
+        columns, rows = np.array([0, 39, 5]), np.array([0, 19, 5])
+        substrate.grid.setCells(columns, rows, [1, 2, 3], [3, 2, 1])
+        self.changes.cellsChanged(substrate, columns, rows)
+        self.assertRecordsReplayed()
+
+    def testBlock(self):
+        substrate = self.scene.layers[1]
+        substrate.grid.setRect(2, 2, np.full((3, 4), 2, dtype=LayerGrid.DTYPE),
+                               np.zeros((3, 4), dtype=LayerGrid.DTYPE))
+        self.changes.blockChanged(substrate, 2, 2, 6, 5)
+        self.assertRecordsReplayed()
+
+    def testEditedItem(self):
+        substrate = self.scene.layers[1]
+        item = Item(substrate, 100)
+        substrate.items.append(item)
+        item.x = 150
+        self.changes.edited(ItemMove(item, 100, 0))
+        # Only the layer owning the item is saved again
+        self.assertEqual(self.changes.items, set([substrate]))
+        self.assertRecordsReplayed()
+
+
+class AutosaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.autosave = Autosave(os.path.join(self.directory, "autosave"))
+        self.autosave.start()
+        self.scene = Scene()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def crash(self):
+        """Stop the writer and release the session without removing it."""
+        self.autosave.queue.put(None)
+        self.autosave.thread.join()
+        self.autosave.lock.close()
+
+    def recover(self):
+        autosave = Autosave(self.autosave.directory)
+        self.assertTrue(autosave.hasRecovery())
+        save_scene = autosave.recover()
+        for save_layer, layer in zip(save_scene.layers, self.scene.layers):
+            self.assertEqual(statusOf(save_layer), statusOf(layer.getSaveState()))
+        return autosave
+
+    def edit(self):
+        surface = self.scene.layers[0]
+        surface.grid.setStatus(7, 8, 2, 3)
+        self.scene.changes.cellChanged(surface, 7, 8)
+
+    def testRecover(self):
+        self.assertFalse(Autosave(self.autosave.directory).hasRecovery())
+        self.autosave.autosave(self.scene)
+        self.edit()
+        self.autosave.autosave(self.scene)
+        self.crash()
+        autosave = self.recover()
+        autosave.discardRecovery()
+        self.assertEqual(os.listdir(self.autosave.directory), [])
+
+    def testLoadedFileIsLinked(self):
+        path = os.path.join(self.directory, "scene.sav")
+        save_file.save(path, self.scene.getSaveState())
+        self.autosave.loaded(self.scene, path)
+        self.edit()
+        self.autosave.autosave(self.scene)
+        self.crash()
+        snapshot = self.autosave.path("snapshot", self.autosave.generation)
+        self.assertTrue(os.path.samefile(snapshot, path))
+        # Saving over the loaded file doesn't change the snapshot
+        save_file.save(path, Scene().getSaveState())
+        self.recover()
+
+    def testRecoveredSessionIsDiscardedAfterSnapshot(self):
+        self.autosave.autosave(self.scene)
+        self.crash()
+        autosave = self.recover()
+        autosave.start()
+        autosave.autosave(self.scene)
+        autosave.stop()
+        self.assertTrue(autosave.snapshot_written)
+        self.assertIsNotNone(autosave.recovered)
+        # The session is only removed by the autosave timer on the GUI thread
+        autosave.autosave(self.scene)
+        self.assertIsNone(autosave.recovered)
+        self.assertEqual(os.listdir(self.autosave.directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
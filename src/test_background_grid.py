@@ -0,0 +1,42 @@
+import unittest
+
+from background_grid import BackgroundGrid
+
+
+class CountingGrid(BackgroundGrid):
+    """Background grid that records the scales it renders patterns for
+    instead of painting them.
+    """
+
+    def __init__(self):
+        BackgroundGrid.__init__(self)
+        self.rendered = []
+
+    def createPattern(self, scale):
+        self.rendered.append(scale)
+        return object()
+
+
+class PatternCacheTest(unittest.TestCase):
+
+    def testPatternIsReused(self):
+        grid = CountingGrid()
+        brush = grid.pattern(0.5)
+        self.assertIs(grid.pattern(0.500001), brush)
+        self.assertEqual(grid.rendered, [0.5])
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        grid = CountingGrid()
+        scales = [1.0 / (i + 1) for i in range(BackgroundGrid.MAX_PATTERNS)]
+        for scale in scales:
+            grid.pattern(scale)
+        grid.pattern(scales[0])
+        grid.pattern(2.0)
+        self.assertEqual(len(grid.patterns), BackgroundGrid.MAX_PATTERNS)
+        grid.pattern(scales[0])
+        grid.pattern(scales[1])
+        self.assertEqual(grid.rendered, scales + [2.0, scales[1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
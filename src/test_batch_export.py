@@ -0,0 +1,76 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import StringIO
+
+import numpy as np
+
+import save_file
+from layer_grid import LayerGrid
+from molecular_scene import SaveScene
+from surface import SaveSurface
+
+
+def saveScene():
+    """Return a saved scene with an edited surface and no substrate layers
+    saved.
+    """
+    grid = LayerGrid()
+    grid.setRect(0, 0, np.full((4, 6), 1, dtype=LayerGrid.DTYPE),
+                 np.full((4, 6), -1, dtype=LayerGrid.DTYPE))
+    surface = SaveSurface.__new__(SaveSurface)
+    surface.x, surface.y, surface.width, surface.height = 0.0, 0.0, 300.0, 100.0
+    surface.atom_types = ["H", "CL", "BR", "I", "F"]
+    surface.child_items = []
+    surface.setGrid(grid)
+    scene = SaveScene.__new__(SaveScene)
+    scene.substrate_atom_types = ["SI", "GE", "C", "SN", "PB"]
+    scene.layers = [surface, None, None]
+    return scene
+
+
+class BatchExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.scene = saveScene()
+        self.save_paths = []
+        for name in ("first", "second"):
+            self.save_paths.append(os.path.join(self.directory, name))
+            save_file.save(self.save_paths[-1], self.scene)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def export(self, *arguments):
+        """Run the exporter in its own process like from the command line.
+        The exporter sets up the Qt API, which has to happen before Qt is
+        imported.
+        """
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch_export.py")
+        with open(os.devnull, "w") as devnull:
+            return subprocess.call([sys.executable, script, "-o", self.directory] +
+                                   list(arguments), stdout=devnull)
+
+    def testExport(self):
+        self.assertEqual(self.export("--layers", "3", "--jobs", "2", *self.save_paths), 0)
+        options = self.scene.getOptions()
+        options["layers_to_draw"] = 3
+        expected = StringIO.StringIO()
+        self.scene.writeOutput(expected, options)
+        for name in ("first.xyz", "second.xyz"):
+            with open(os.path.join(self.directory, name)) as f:
+                self.assertEqual(f.read(), expected.getvalue())
+
+    def testFailure(self):
+        missing = os.path.join(self.directory, "missing")
+        self.assertEqual(self.export("--jobs", "1", missing, self.save_paths[0]), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "missing.xyz")))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "first.xyz")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cPickle as pickle
+import numpy as np
+
+from atom_pair import SaveAtom
+import block_library
+from block_library import BlockLibrary, thumbnail
+from layer_grid import LayerGrid
+from selection_box import SaveSelection
+
+
+def writeBlock(path, rows, columns, status=1):
+    """Save a block of rows x columns cells with the given status."""
+    block = SaveSelection.__new__(SaveSelection)
+    block.x, block.y = 0.0, 0.0
+    block.width, block.height = 50.0 * columns, 25.0 * rows
+    block.left_status = np.full((rows, columns), status, dtype=LayerGrid.DTYPE)
+    block.right_status = np.zeros((rows, columns), dtype=LayerGrid.DTYPE)
+    with open(path, "wb") as f:
+        pickle.dump(block, f, pickle.HIGHEST_PROTOCOL)
+
+
+class BlockLibraryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.blocks = os.path.join(self.directory, "blocks")
+        os.mkdir(self.blocks)
+        self.index_path = os.path.join(self.directory, "index")
+        writeBlock(os.path.join(self.blocks, "a"), 2, 3)
+        writeBlock(os.path.join(self.blocks, "b"), 40, 10)
+        with open(os.path.join(self.blocks, "notes.txt"), "w") as f:
+            f.write("not a block")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def openLibrary(self):
+        library = BlockLibrary(self.blocks, self.index_path)
+        library.open()
+        return library
+
+    def testOpen(self):
+        library = self.openLibrary()
+        self.assertEqual(sorted(library.entries), ["a", "b"])
+        self.assertEqual(sorted(library.skipped), ["notes.txt"])
+        entry = library.entries["b"]
+        self.assertEqual((entry.rows, entry.columns), (40, 10))
+        self.assertEqual(entry.thumbnail.shape, (20, 10))
+        self.assertEqual(entry.load().left_status.shape, (40, 10))
+
+    def testIndexIsReused(self):
+        self.openLibrary()
+        read_block = block_library.readBlock
+        def failingReadBlock(path):
+            self.fail("%s was read again" % path)
+        block_library.readBlock = failingReadBlock
+        try:
+            library = self.openLibrary()
+        finally:
+            block_library.readBlock = read_block
+        self.assertEqual(sorted(library.entries), ["a", "b"])
+        self.assertEqual(library.entries["a"].path, os.path.join(self.blocks, "a"))
+
+    def testOutdatedIndexIsIgnored(self):
+        self.openLibrary()
+        with open(self.index_path, "wb") as f:
+            pickle.dump((block_library.INDEX_VERSION + 1, None, {}, {}), f)
+        self.assertEqual(sorted(self.openLibrary().entries), ["a", "b"])
+
+    def testRefreshWithoutChanges(self):
+        library = self.openLibrary()
+        self.assertEqual(library.refresh(), set())
+        self.assertEqual(library.refresh(rescan=True), set())
+
+    def testAddAndRemove(self):
+        library = self.openLibrary()
+        writeBlock(os.path.join(self.blocks, "c"), 1, 1)
+        os.remove(os.path.join(self.blocks, "a"))
+        self.assertEqual(library.refresh(), set(["a", "c"]))
+        self.assertEqual(sorted(library.entries), ["b", "c"])
+
+    def testChangedFile(self):
+        library = self.openLibrary()
+        path = os.path.join(self.blocks, "a")
+        writeBlock(path, 5, 5, 2)
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+        # Changing a file doesn't change the directory so it is only
+        # found by a rescan
+        self.assertEqual(library.refresh(), set())
+        self.assertEqual(library.refresh(rescan=True), set(["a"]))
+        self.assertEqual(library.entries["a"].rows, 5)
+
+    def testBlockReplacedByOtherFile(self):
+        library = self.openLibrary()
+        with open(os.path.join(self.blocks, "b"), "w") as f:
+            f.write("not a block anymore")
+        self.assertEqual(library.refresh(rescan=True), set(["b"]))
+        self.assertNotIn("b", library.entries)
+        self.assertIn("b", library.skipped)
+
+    def testIndexInDirectory(self):
+        self.index_path = os.path.join(self.blocks, "index")
+        library = self.openLibrary()
+        self.assertEqual(sorted(library.entries), ["a", "b"])
+        self.assertNotIn("index", library.skipped)
+        # Writing the index doesn't count as a change of the blocks
+        self.assertEqual(library.refresh(), set())
+
+    def testLegacyBlock(self):
+        atoms = []
+        for x, y, left_status in ((0.0, 0.0, 1), (50.0, 25.0, "VACANT")):
+            atom = SaveAtom.__new__(SaveAtom)
+            atom.x, atom.y = x, y
+            atom.left_status, atom.right_status = left_status, 2
+            atoms.append(atom)
+        block = SaveSelection.__new__(SaveSelection)
+        block.__dict__.update({"x": 0.0, "y": 0.0, "width": 100.0, "height": 50.0,
+                               "child_items": atoms})
+        path = os.path.join(self.blocks, "legacy")
+        with open(path, "wb") as f:
+            pickle.dump(block, f, 0)
+        block = block_library.readBlock(path)
+        # The hydrogen is converted in to status arrays once when read
+        self.assertFalse(hasattr(block, "child_items"))
+        self.assertEqual(block.getStatus()[0].tolist(), [[1, 0], [0, -1]])
+        self.assertEqual(block.getStatus()[1].tolist(), [[2, 0], [0, 2]])
+        self.assertIs(block.getStatus()[0], block.left_status)
+
+    def testThumbnail(self):
+        left_status = np.arange(12).reshape(3, 4)
+        right_status = -left_status
+        self.assertEqual(thumbnail(left_status, right_status, 8).tolist(),
+                         [[0, 0, 1, -1, 2, -2, 3, -3],
+                          [4, -4, 5, -5, 6, -6, 7, -7],
+                          [8, -8, 9, -9, 10, -10, 11, -11]])
+        self.assertEqual(thumbnail(left_status, right_status, 4).tolist(),
+                         [[0, 1, 2, 3], [8, 9, 10, 11]])
+
+
+if __name__ == "__main__":
+    unittest.main()
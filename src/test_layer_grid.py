@@ -0,0 +1,168 @@
+import unittest
+
+import numpy as np
+
+from layer_grid import LayerGrid
+
+
+def status(grid, left, top, right, bottom):
+    """Return the statuses of the given grid rectangle as nested lists."""
+    return [array.tolist() for array in grid.getRect(left, top, right, bottom)]
+
+
+class LayerGridTest(unittest.TestCase):
+
+    def testDefaultStatus(self):
+        grid = LayerGrid()
+        self.assertTrue(grid.isEmpty())
+        self.assertEqual(grid.getStatus(3, -2), (0, 0))
+
+    def testSetStatusExtends(self):
+        grid = LayerGrid()
+        grid.setStatus(2, 1, 3, -1)
+        grid.setStatus(-1, 4, right=2)
+        self.assertEqual(grid.bounds(), (-1, 1, 3, 5))
+        self.assertEqual(grid.getStatus(2, 1), (3, -1))
+        self.assertEqual(grid.getStatus(-1, 4), (0, 2))
+        grid.setStatus(2, 1, left=1)
+        self.assertEqual(grid.getStatus(2, 1), (1, -1))
+
+    def testRect(self):
+        grid = LayerGrid()
+        left_status = np.array([[1, 2, 3], [4, 0, 1]], dtype=LayerGrid.DTYPE)
+        right_status = np.array([[0, 0, 1], [2, 0, 3]], dtype=LayerGrid.DTYPE)
+        grid.setRect(5, 6, left_status, right_status)
+        self.assertEqual(grid.bounds(), (5, 6, 8, 8))
+        self.assertEqual(grid.getStatus(7, 7), (1, 3))
+        # Cells outside of the grid are read as 0
+        self.assertEqual(status(grid, 4, 7, 6, 9), [[[0, 4], [0, 0]], [[0, 2], [0, 0]]])
+
+    def testCopy(self):
+        grid = LayerGrid()
+        grid.setStatus(0, 0, 1, 1)
+        copy = grid.copy()
+        grid.setStatus(0, 0, 2, 2)
+        self.assertEqual(copy.getStatus(0, 0), (1, 1))
+
+
+class StorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = LayerGrid()
+        self.grid.extend(0, 0, 64, 16)
+        # The number of edited cells at which the grid switches storage
+        self.dense_count = 64 * 16 // LayerGrid.DENSE_RATIO + 1
+        self.sparse_count = 64 * 16 // LayerGrid.SPARSE_RATIO
+
+    def testSwitchesToDenseAndBack(self):
+        for column in range(self.dense_count - 1):
+            self.grid.setStatus(column, 3, 1, 0)
+        self.assertTrue(self.grid.isSparse())
+        self.grid.setStatus(self.dense_count - 1, 3, 1, 0)
+        self.assertFalse(self.grid.isSparse())
+        self.assertEqual(self.grid.count, self.dense_count)
+        for column in range(self.dense_count - self.sparse_count):
+            self.grid.setStatus(column, 3, 0, 0)
+        self.assertTrue(self.grid.isSparse())
+        self.assertEqual(self.grid.getStatus(self.dense_count - 1, 3), (1, 0))
+        self.assertEqual(self.grid.getStatus(0, 3), (0, 0))
+
+    def testSetCells(self):
+        random = np.random.RandomState(0)
+        reference = LayerGrid()
+        reference.extend(0, 0, 64, 16)
+        for n in (5, 200, 40):
+            columns = random.randint(-2, 66, n)
+            rows = random.randint(-1, 17, n)
+            left_status = random.randint(-1, 2, n)
+            right_status = random.randint(-1, 2, n)
+            self.grid.setCells(columns, rows, left_status, right_status)
+            for cell in zip(columns, rows, left_status, right_status):
+                reference.setStatus(*cell)
+            self.assertEqual(self.grid.bounds(), reference.bounds())
+            self.assertEqual(self.grid.count, reference.count)
+            self.assertEqual(status(self.grid, *self.grid.bounds()),
+                             status(reference, *reference.bounds()))
+
+    def testGetCells(self):
+        self.grid.setStatus(2, 3, 1, -1)
+        columns, rows = [2, 2, -5, 70], [3, 4, 0, 3]
+        for dense in (False, True):
+            if dense:
+                self.grid.makeDense()
+            self.assertEqual([array.tolist() for array in self.grid.getCells(columns, rows)],
+                             [[1, 0, 0, 0], [-1, 0, 0, 0]])
+
+    def testNonDefaultCells(self):
+        self.grid.setStatus(5, 2, 0, 3)
+        self.grid.setStatus(1, 7, 2, 0)
+        for dense in (False, True):
+            if dense:
+                self.grid.makeDense()
+            cells = sorted(zip(*[array.tolist() for array in self.grid.nonDefaultCells()]))
+            self.assertEqual(cells, [(1, 7, 2, 0), (5, 2, 0, 3)])
+
+
+
+class ResizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sparse = LayerGrid()
+        self.sparse.extend(0, 0, 40, 30)
+        self.sparse.setStatus(2, 3, 1, 2)
+        self.sparse.setStatus(35, 25, 3, 0)
+        self.dense = self.sparse.copy()
+        self.dense.makeDense()
+
+    def testExtendKeepsCells(self):
+        for grid in (self.sparse, self.dense):
+            grid.extend(-5, -2, 41, 30)
+            self.assertEqual(grid.bounds(), (-5, -2, 41, 30))
+            self.assertEqual(grid.getStatus(2, 3), (1, 2))
+            self.assertEqual(grid.getStatus(35, 25), (3, 0))
+            self.assertEqual(grid.getStatus(-5, -2), (0, 0))
+
+    def testCropToSameBounds(self):
+        for grid in (self.sparse, self.dense):
+            self.assertFalse(grid.crop(-10, -10, 50, 50))
+            self.assertEqual(grid.bounds(), (0, 0, 40, 30))
+
+    def testCropDropsCells(self):
+        for grid in (self.sparse, self.dense):
+            self.assertTrue(grid.crop(1, 1, 30, 20))
+            self.assertEqual(grid.bounds(), (1, 1, 30, 20))
+            self.assertEqual(grid.count, 1)
+            self.assertEqual(grid.getStatus(2, 3), (1, 2))
+            # Growing again doesn't bring the dropped cells back
+            grid.extend(0, 0, 40, 30)
+            self.assertEqual(grid.getStatus(35, 25), (0, 0))
+
+    def testCropEverything(self):
+        for grid in (self.sparse, self.dense):
+            self.assertTrue(grid.crop(50, 50, 60, 60))
+            self.assertTrue(grid.isEmpty())
+            self.assertEqual(grid.count, 0)
+
+    def testCropMappedGrid(self):
+        left_status = np.zeros((30, 40), dtype=LayerGrid.DTYPE)
+        left_status[3, 2] = 1
+        grid = LayerGrid.fromArrays(0, 0, left_status, np.zeros_like(left_status))
+        grid.crop(1, 1, 30, 20)
+        self.assertIsNone(grid.count)
+        # The arrays are views of the mapped ones instead of copies
+        self.assertIs(grid.left_status.base, left_status)
+        self.assertEqual(grid.getStatus(2, 3), (1, 0))
+
+    def testCellsOutside(self):
+        for grid in (self.sparse, self.dense):
+            grid.setStatus(39, 0, 0, 1)
+            cells = grid.cellsOutside(0, 1, 30, 26)
+            self.assertEqual(sorted(zip(*[array.tolist() for array in cells])),
+                             [(35, 25, 3, 0), (39, 0, 0, 1)])
+            self.assertEqual(len(grid.cellsOutside(-1, -1, 50, 50)[0]), 0)
+            # An empty rectangle leaves every cell outside
+            self.assertEqual(len(grid.cellsOutside(10, 10, 5, 5)[0]), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
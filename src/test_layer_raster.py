@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+
+from layer_grid import LayerGrid
+from layer_raster import LayerRaster
+
+
+class LayerRasterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = LayerGrid()
+        self.grid.setRect(2, 1, np.array([[0, 1, -1], [3, 4, 2]], dtype=LayerGrid.DTYPE),
+                          np.array([[-1, 0, 1], [2, 2, 0]], dtype=LayerGrid.DTYPE))
+        self.raster = LayerRaster(self.grid, (1, 1, 6, 3))
+
+    def pixels(self):
+        """Return the color indices of the raster as (left, right) pairs
+        for every cell.
+        """
+        image = self.raster.image
+        return [[(image.pixelIndex(x, y), image.pixelIndex(x + 1, y))
+                 for x in range(0, image.width(), 2)] for y in range(image.height())]
+
+    def expected(self):
+        left_status, right_status = self.grid.getRect(*self.raster.bounds)
+        return [zip(LayerRaster.colorIndex(left).tolist(), LayerRaster.colorIndex(right).tolist())
+                for left, right in zip(left_status, right_status)]
+
+    def testBuild(self):
+        self.assertEqual((self.raster.image.width(), self.raster.image.height()), (10, 2))
+        self.assertEqual(self.pixels(), self.expected())
+
+    def testSetCell(self):
+        self.grid.setStatus(4, 2, 3, -1)
+        self.raster.setCell(4, 2, 3, -1)
+        # Cells outside of the raster are ignored
+        self.raster.setCell(9, 2, 1, 1)
+        self.assertEqual(self.pixels(), self.expected())
+
+    def testSetCells(self):
+        columns, rows = [1, 4, 9], [1, 2, 2]
+        self.grid.setCells(columns, rows, [2, -1, 3], [1, 1, 1])
+        self.assertTrue(self.raster.setCells(columns, rows, *self.grid.getCells(columns, rows)))
+        self.assertEqual(self.pixels(), self.expected())
+
+    def testTooManyCells(self):
+        cells = LayerRaster.MAX_CELL_UPDATES + 1
+        ones = np.ones(cells, dtype=int)
+        self.assertFalse(self.raster.setCells(ones, ones, ones, ones))
+
+    def testCovers(self):
+        self.assertTrue(self.raster.covers((2, 1, 6, 2)))
+        self.assertFalse(self.raster.covers((0, 1, 6, 2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
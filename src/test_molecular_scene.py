@@ -0,0 +1,42 @@
+import unittest
+import StringIO
+
+import numpy as np
+
+from layer_grid import LayerGrid
+from molecular_scene import SaveScene
+from surface import SaveSurface
+
+
+class SaveSceneOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        grid = LayerGrid()
+        grid.setRect(1, 1, np.full((3, 4), 2, dtype=LayerGrid.DTYPE),
+                     np.zeros((3, 4), dtype=LayerGrid.DTYPE))
+        self.surface = SaveSurface.__new__(SaveSurface)
+        self.surface.x, self.surface.y = 0.0, 0.0
+        self.surface.width, self.surface.height = 300.0, 125.0
+        self.surface.atom_types = ["H", "CL", "BR", "I", "F"]
+        self.surface.child_items = []
+        self.surface.setGrid(grid)
+
+    def write(self, layers):
+        scene = SaveScene.__new__(SaveScene)
+        scene.substrate_atom_types = ["SI", "GE", "C", "SN", "PB"]
+        scene.layers = layers
+        options = scene.getOptions()
+        options["layers_to_draw"] = 4
+        f = StringIO.StringIO()
+        scene.writeOutput(f, options)
+        return f.getvalue()
+
+    def testLayersNotCreatedAreWrittenInDefaultState(self):
+        substrate = [SaveSurface.matching(self.surface, ["SI", "GE", "C", "SN", "PB"])
+                     for i in range(4)]
+        self.assertEqual(self.write([self.surface, None, None]),
+                         self.write([self.surface] + substrate))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+from molecule import getMoleculeRect
+from molecule_info import MoleculeInfo
+
+
+class MoleculeRectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.info = MoleculeInfo("test", (100, 50), "test.xyz", scene_translation=(10, -5),
+                                 rotation_axis=(50, 25))
+
+    def assertRect(self, rect, expected):
+        for value, expected_value in zip(rect, expected):
+            self.assertAlmostEqual(value, expected_value)
+
+    def testUnrotated(self):
+        self.assertRect(getMoleculeRect(self.info, 200, 100, 0), (210, 95, 310, 145))
+
+    def testRotated(self):
+        # Rotating about the center swaps the width and the height
+        self.assertRect(getMoleculeRect(self.info, 200, 100, 90), (235, 70, 285, 170))
+        self.assertRect(getMoleculeRect(self.info, 200, 100, -180), (210, 95, 310, 145))
+
+
+if __name__ == "__main__":
+    unittest.main()
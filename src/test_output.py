@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+import numpy as np
+
+import output
+from layer_grid import LayerGrid
+
+OPTIONS = {"layers_to_draw": 4,
+           "surface_atom_types": ["H", "CL", "BR", "I", "F"],
+           "substrate_atom_types": ["SI", "GE", "C", "SN", "PB"]}
+
+
+def cellLines(result, options, layer_n, column, row, left_status, right_status):
+    """Add the output lines of a single cell to result, the way the layers
+    were written one hydrogen pair at a time before the output was
+    vectorized.
+    """
+    if layer_n == 0:
+        atom_types = options["surface_atom_types"]
+        z_offset = np.array([0, 0, 0])
+        left_offset = output.LEFT_H_POS * output.TOTAL_SCALE
+        right_offset = output.RIGHT_H_POS * output.TOTAL_SCALE
+    else:
+        atom_types = options["substrate_atom_types"]
+        if layer_n == 1:
+            z_offset = output.SURFACE_Z
+            left_offset = output.SURFACE_LEFT
+            right_offset = output.SURFACE_RIGHT
+        elif layer_n == 2:
+            z_offset = output.INITIAL_Z
+            left_offset = output.LAYER_LEFT[(layer_n+2) % 4]
+            right_offset = output.LAYER_RIGHT[(layer_n+2) % 4]
+        else:
+            z_offset = (max((layer_n+2)/4 - 1, 0) * output.Z_OFFSET + output.INITIAL_Z
+                        + output.LAYER_Z[(layer_n+2) % 4])
+            left_offset = output.LAYER_LEFT[(layer_n+2) % 4]
+            right_offset = output.LAYER_RIGHT[(layer_n+2) % 4]
+    out_pos = np.array((column * output.X_SCALE, row * output.Y_SCALE, 0))
+    for status, offset in ((left_status, left_offset), (right_status, right_offset)):
+        if status == output.VACANT:
+            continue
+        pos = out_pos + z_offset + offset
+        result.append(output.ATOM_FORMAT % ((atom_types[status],) + tuple(pos) +
+                                            (len(result) + 1,)))
+        if layer_n != 0 and layer_n == options["layers_to_draw"]:
+            for bottom_h in (output.LEFT_BOTTOM_H, output.RIGHT_BOTTOM_H):
+                result.append(output.ATOM_FORMAT % (("H",) + tuple(pos + bottom_h[layer_n%2]) +
+                                                    (len(result) + 1,)))
+
+
+class WriteLayersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.band_size = output.BAND_SIZE
+        self.min_parallel_cells = output.MIN_PARALLEL_CELLS
+        # Split the layers in to several bands, even though they are small
+        output.BAND_SIZE = 300
+        output.MIN_PARALLEL_CELLS = 0
+        random = np.random.RandomState(0)
+        self.layers = []
+        self.bounds = (-3, -2, 37, 28)
+        left, top, right, bottom = self.bounds
+        shape = (bottom - top, right - left)
+        for layer_n in range(OPTIONS["layers_to_draw"] + 1):
+            grid = LayerGrid()
+            grid.setRect(left, top, random.randint(-1, 5, shape).astype(LayerGrid.DTYPE),
+                         random.randint(-1, 5, shape).astype(LayerGrid.DTYPE))
+            # Overlapping selections, one of them partly outside of the bounds
+            selected = np.array([(0, 0, 3, 2), (2, 1, 6, 8), (right - 1, bottom - 1,
+                                                              right + 4, bottom + 4)])
+            self.layers.append((grid, layer_n, selected))
+
+    def tearDown(self):
+        output.BAND_SIZE = self.band_size
+        output.MIN_PARALLEL_CELLS = self.min_parallel_cells
+
+    def expected(self):
+        """Return the output written cell by cell."""
+        left, top, right, bottom = self.bounds
+        result = []
+        for grid, layer_n, selected in self.layers:
+            skipped = set((column, row) for x0, y0, x1, y1 in selected
+                          for row in range(y0, y1) for column in range(x0, x1))
+            for row in range(top, bottom):
+                for column in range(left, right):
+                    if (column, row) not in skipped:
+                        cellLines(result, OPTIONS, layer_n, column - left, row - top,
+                                  *grid.getStatus(column, row))
+        return "%d\n\n%s\n" % (len(result), "\n".join(result))
+
+    def write(self, processes=1, pool=None):
+        layers = [((grid, self.bounds, layer_n, OPTIONS, selected), 0, lambda writer: None)
+                  for grid, layer_n, selected in self.layers]
+        f = StringIO.StringIO()
+        output.writeLayers(f, layers, processes, pool)
+        return f.getvalue()
+
+    def testSameAsCellByCell(self):
+        self.assertEqual(self.write(), self.expected())
+
+    def testParallelSameAsSerial(self):
+        self.assertEqual(self.write(3), self.write())
+
+    def testSharedPool(self):
+        pool = multiprocessing.Pool(2)
+        try:
+            self.assertEqual(self.write(2, pool), self.write())
+            # The pool is left running for the next output
+            self.assertEqual(self.write(2, pool), self.write())
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def testCount(self):
+        count = sum(output.layerCount(grid, self.bounds, layer_n, OPTIONS, selected)
+                    for grid, layer_n, selected in self.layers)
+        self.assertEqual(int(self.write().split("\n", 1)[0]), count)
+
+
+class WriteFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "output.xyz")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testWrite(self):
+        output.writeFile(self.path, lambda f: f.write("new"))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "new")
+        self.assertEqual(os.listdir(self.directory), ["output.xyz"])
+
+    def testFailureKeepsOldFile(self):
+        with open(self.path, "w") as f:
+            f.write("old")
+        def write(f):
+            f.write("partial")
+            raise ValueError("failed")
+        self.assertRaises(ValueError, output.writeFile, self.path, write)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "old")
+        self.assertEqual(os.listdir(self.directory), ["output.xyz"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import save_file
+from molecular_scene import SaveScene
+from layer_grid import LayerGrid
+from molecule import SaveMolecule
+from molecule_info import MoleculeInfo
+from selection_box import SaveSelection
+from surface import SaveSurface
+
+
+def saveLayer(grid, child_items):
+    """Return the save state of a 40 x 30 cell layer with the given grid
+    and child items.
+    """
+    layer = SaveSurface.__new__(SaveSurface)
+    layer.x, layer.y = -100.0, -50.0
+    layer.width, layer.height = 2000.0, 750.0
+    layer.atom_types = ["H", "CL", "BR", "I", "F"]
+    layer.child_items = child_items
+    layer.setGrid(grid)
+    return layer
+
+
+def saveMolecule(x, variables):
+    molecule = SaveMolecule.__new__(SaveMolecule)
+    molecule.x, molecule.y, molecule.rotation = float(x), 25.0, 90.0
+    molecule.variables = variables
+    return molecule
+
+
+def saveSelection(x, status):
+    selection = SaveSelection.__new__(SaveSelection)
+    selection.x, selection.y = float(x), 0.0
+    selection.width, selection.height = 100.0, 50.0
+    selection.left_status = np.array([[status, -1], [0, status]], dtype=LayerGrid.DTYPE)
+    selection.right_status = selection.left_status[::-1].copy()
+    return selection
+
+
+class SaveFileTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        dense = LayerGrid()
+        dense.setRect(-2, -2, random.randint(-1, 5, (30, 40)).astype(LayerGrid.DTYPE),
+                      random.randint(-1, 5, (30, 40)).astype(LayerGrid.DTYPE))
+        sparse = LayerGrid()
+        sparse.setStatus(3, 4, 2, -1)
+        sparse.setStatus(10, 20, 0, 4)
+        self.assertFalse(dense.isSparse())
+        self.assertTrue(sparse.isSparse())
+        small = MoleculeInfo("small", (1, 1), "small.xyz")
+        large = MoleculeInfo("large", (2, 3), "large.xyz", rotating=True)
+        # Molecules and selections mixed so that their order is kept
+        children = [saveSelection(0, 1), saveMolecule(50, small), saveSelection(300, 2),
+                    saveMolecule(150, large), saveMolecule(200, small)]
+        self.scene = SaveScene.__new__(SaveScene)
+        self.scene.substrate_atom_types = ["SI", "GE", "C", "SN", "PB"]
+        self.scene.layers = [saveLayer(dense, children), None, saveLayer(sparse, [])]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameScene(self, loaded):
+        self.assertEqual(list(loaded.substrate_atom_types), self.scene.substrate_atom_types)
+        self.assertEqual(len(loaded.layers), len(self.scene.layers))
+        for layer, saved in zip(loaded.layers, self.scene.layers):
+            if saved is None:
+                self.assertIsNone(layer)
+                continue
+            self.assertEqual(list(layer.atom_types), saved.atom_types)
+            self.assertEqual(layer.gridRect(), saved.gridRect())
+            bounds = saved.gridRect()
+            for got, expected in zip(layer.getGrid().getRect(*bounds),
+                                     saved.getGrid().getRect(*bounds)):
+                self.assertEqual(got.tolist(), expected.tolist())
+            self.assertEqual([type(item) for item in layer.getItems()],
+                             [type(item) for item in saved.getItems()])
+            for item, saved_item in zip(layer.getItems(), saved.getItems()):
+                self.assertEqual((item.x, item.y), (saved_item.x, saved_item.y))
+                if isinstance(item, SaveMolecule):
+                    self.assertEqual(item.rotation, saved_item.rotation)
+                    self.assertEqual(item.variables.__dict__, saved_item.variables.__dict__)
+                else:
+                    self.assertEqual(item.left_status.tolist(), saved_item.left_status.tolist())
+                    self.assertEqual(item.right_status.tolist(),
+                                     saved_item.right_status.tolist())
+
+    def testRoundTrip(self):
+        f = io.BytesIO()
+        save_file.write(f, self.scene)
+        f.seek(0)
+        self.assertTrue(save_file.isSaveFile(f))
+        self.assertSameScene(save_file.read(f))
+
+    def testMappedRoundTrip(self):
+        path = os.path.join(self.directory, "scene.sav")
+        save_file.save(path, self.scene)
+        self.assertEqual(os.listdir(self.directory), ["scene.sav"])
+        with open(path, "rb") as f:
+            loaded = save_file.read(f, mapped=True)
+        self.assertIsInstance(loaded.layers[0].left_status, np.memmap)
+        self.assertSameScene(loaded)
+        # The mapped arrays can be saved over the file they are mapped from
+        save_file.save(path, loaded)
+        with open(path, "rb") as f:
+            self.assertSameScene(save_file.read(f))
+
+    def testTruncated(self):
+        f = io.BytesIO()
+        save_file.write(f, self.scene)
+        f = io.BytesIO(f.getvalue()[:-100])
+        self.assertRaises(save_file.SaveFileError, save_file.read, f)
+
+    def testAtomTableSelections(self):
+        # Before version 3 the cells of all selections were stored in one
+        # table of hydrogen pairs
+        writer = save_file.ArrayWriter()
+        selections = [saveSelection(0, 1), saveSelection(300, 2)]
+        atoms = [(i, column * 50.0, row * 25.0, s.left_status[row, column],
+                  s.right_status[row, column])
+                 for i, s in enumerate(selections) for row in range(2) for column in range(2)]
+        atoms = np.array(atoms)
+        layer = {"x": 0.0, "y": 0.0, "width": 500.0, "height": 250.0,
+                 "atom_types": ["H", "CL", "BR", "I", "F"],
+                 "grid": {"cells": writer.add(np.zeros((0, 2)), save_file.INDEX_DTYPE),
+                          "status": writer.add(np.zeros((0, 2)), save_file.STATUS_DTYPE)},
+                 "molecules": {
+                     "positions": writer.add(np.zeros((0, 3)), save_file.FLOAT_DTYPE),
+                     "types": writer.add([], save_file.INDEX_DTYPE),
+                     "order": writer.add([], save_file.INDEX_DTYPE)},
+                 "selections": {
+                     "rects": writer.add([(s.x, s.y, s.width, s.height) for s in selections],
+                                         save_file.FLOAT_DTYPE),
+                     "order": writer.add([1, 0], save_file.INDEX_DTYPE),
+                     "atom_selections": writer.add(atoms[:, 0], save_file.INDEX_DTYPE),
+                     "atom_positions": writer.add(atoms[:, 1:3], save_file.FLOAT_DTYPE),
+                     "atom_status": writer.add(atoms[:, 3:], save_file.STATUS_DTYPE)}}
+        header = json.dumps({"substrate_atom_types": ["SI", "GE", "C", "SN", "PB"],
+                             "molecule_types": [], "layers": [layer],
+                             "arrays": writer.specs})
+        f = io.BytesIO()
+        f.write(save_file.MAGIC + save_file.HEADER.pack(2, len(header)) + header)
+        f.write(save_file.padding(f.tell()))
+        for array in writer.arrays:
+            f.write(array.tobytes() + save_file.padding(array.nbytes))
+        f.seek(0)
+        loaded = save_file.read(f).layers[0].getItems()
+        self.assertEqual([item.x for item in loaded], [300.0, 0.0])
+        for item, saved in zip(loaded, selections[::-1]):
+            self.assertEqual(item.left_status.tolist(), saved.left_status.tolist())
+            self.assertEqual(item.right_status.tolist(), saved.right_status.tolist())
+
+    def testNewerVersion(self):
+        f = io.BytesIO()
+        save_file.write(f, self.scene)
+        data = f.getvalue()
+        start = len(save_file.MAGIC)
+        f = io.BytesIO(data[:start] + save_file.HEADER.pack(save_file.VERSION + 1, 0) +
+                       data[start + save_file.HEADER.size:])
+        self.assertRaises(save_file.SaveFileError, save_file.read, f)
+
+
+if __name__ == "__main__":
+    unittest.main()
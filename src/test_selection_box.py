@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+
+from layer_grid import LayerGrid
+from selection_box import SaveSelection
+
+
+class SavedAtom(object):
+    """Hydrogen pair child item of a selection in older saves."""
+
+    def __init__(self, x, y, left_status, right_status):
+        self.x = x
+        self.y = y
+        self.status = (left_status, right_status)
+
+    def getStatus(self):
+        return self.status
+
+
+class SaveSelectionTest(unittest.TestCase):
+
+    def testLegacyChildItems(self):
+        selection = SaveSelection.__new__(SaveSelection)
+        selection.__setstate__({"x": 100.0, "y": 50.0, "width": 150.0, "height": 50.0,
+                                "child_items": [SavedAtom(50.0, 25.0, 2, -1),
+                                                SavedAtom(0.0, 0.0, 1, 3)]})
+        left_status, right_status = selection.getStatus()
+        self.assertEqual(left_status.tolist(), [[1, 0, 0], [0, 2, 0]])
+        self.assertEqual(right_status.tolist(), [[3, 0, 0], [0, -1, 0]])
+        self.assertEqual(selection.cellRect(), (2, 2, 5, 4))
+
+    def testStatusArrays(self):
+        selection = SaveSelection.__new__(SaveSelection)
+        status = np.ones((2, 3), dtype=LayerGrid.DTYPE)
+        selection.__setstate__({"x": -50.0, "y": 0.0, "width": 150.0, "height": 50.0,
+                                "left_status": status, "right_status": status})
+        self.assertIs(selection.getStatus()[0], status)
+        self.assertEqual(selection.cellCorner(), (-1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
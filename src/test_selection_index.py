@@ -0,0 +1,41 @@
+import unittest
+
+from selection_index import SelectionIndex
+
+
+class SelectionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SelectionIndex()
+        # Spans several buckets, also at negative cells
+        self.index.add("a", (-20, -3, 20, 5))
+        self.index.add("b", (30, 0, 31, 1))
+
+    def testFind(self):
+        self.assertEqual(self.index.find(-20, -3), "a")
+        self.assertEqual(self.index.find(19, 4), "a")
+        self.assertIsNone(self.index.find(20, 4))
+        self.assertIsNone(self.index.find(0, 5))
+        self.assertEqual(self.index.find(30, 0), "b")
+
+    def testMove(self):
+        self.index.add("a", (100, 100, 102, 101))
+        self.assertIsNone(self.index.find(0, 0))
+        self.assertEqual(self.index.find(101, 100), "a")
+
+    def testRemove(self):
+        self.index.remove("a")
+        self.index.remove("a")
+        self.assertIsNone(self.index.find(0, 0))
+        self.assertEqual(self.index.selectedRects().tolist(), [[30, 0, 31, 1]])
+        self.index.remove("b")
+        self.assertEqual(self.index.buckets, {})
+        self.assertEqual(self.index.selectedRects().shape, (0, 4))
+
+    def testEmptySelectionIsNotIndexed(self):
+        self.index.add("c", (5, 5, 5, 8))
+        self.assertNotIn("c", self.index.rects)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+import selection_tools
+from atom_pair import AtomPair
+from layer_grid import LayerGrid
+
+V = AtomPair.VACANT
+
+
+class SelectionToolsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.left_status = np.array([[0, V, 2], [V, V, 1]], dtype=LayerGrid.DTYPE)
+        self.right_status = np.array([[V, 1, V], [3, 0, V]], dtype=LayerGrid.DTYPE)
+
+    def assertStatus(self, status, left_status, right_status):
+        self.assertEqual(status[0].dtype, LayerGrid.DTYPE)
+        self.assertEqual([array.tolist() for array in status], [left_status, right_status])
+
+    def testInvertVacancies(self):
+        self.assertStatus(selection_tools.invertVacancies(self.left_status, self.right_status, 4),
+                          [[V, 4, V], [4, 4, V]], [[4, V, 4], [V, V, 4]])
+
+    def testReplaceStatus(self):
+        self.assertStatus(selection_tools.replaceStatus(self.left_status, self.right_status,
+                                                        V, 2),
+                          [[0, 2, 2], [2, 2, 1]], [[2, 1, 2], [3, 0, 2]])
+
+    def testPatterns(self):
+        self.assertStatus(selection_tools.patternFill((2, 2), (0, 0), "checkerboard", 1),
+                          [[1, 1], [V, V]], [[V, V], [1, 1]])
+        self.assertStatus(selection_tools.patternFill((2, 2), (0, 0), "rows", 1),
+                          [[1, 1], [V, V]], [[1, 1], [V, V]])
+        self.assertStatus(selection_tools.patternFill((2, 2), (0, 0), "columns", 1),
+                          [[1, 1], [1, 1]], [[V, V], [V, V]])
+        self.assertRaises(ValueError, selection_tools.patternFill, (2, 2), (0, 0), "dots", 1)
+
+    def testPatternContinuesAcrossSelections(self):
+        whole = selection_tools.patternFill((3, 4), (5, 7), "checkerboard", 2)
+        left = selection_tools.patternFill((3, 1), (5, 7), "checkerboard", 2)
+        right = selection_tools.patternFill((3, 3), (6, 7), "checkerboard", 2)
+        for i in range(2):
+            self.assertEqual(np.hstack((left[i], right[i])).tolist(), whole[i].tolist())
+
+    def testRandomFill(self):
+        first = selection_tools.randomFill((20, 30), 3, 0.25, seed=5)
+        second = selection_tools.randomFill((20, 30), 3, 0.25, seed=5)
+        for a, b in zip(first, second):
+            self.assertEqual(a.tolist(), b.tolist())
+        filled = np.count_nonzero(first[0] == 3) + np.count_nonzero(first[1] == 3)
+        self.assertEqual(filled + np.count_nonzero(first[0] == V) +
+                         np.count_nonzero(first[1] == V), 2 * 20 * 30)
+        self.assertTrue(0.15 < filled / 1200.0 < 0.35)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from structure_cache import StructureCache
+
+
+class StructureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = StructureCache(max_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeStructure(self, name, atoms, mtime=1000):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write("%d\n%s\n" % (len(atoms), name))
+            for element, x, y, z in atoms:
+                f.write("%s %f %f %f\n" % (element, x, y, z))
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def testParse(self):
+        path = self.writeStructure("a.xyz", [("C", 1, 2, 3), ("H", -1, 0, 0.5)])
+        elements, coordinates = self.cache.get(path)
+        self.assertEqual(list(elements), ["C", "H"])
+        self.assertEqual(coordinates.tolist(), [[1, 2, 3], [-1, 0, 0.5]])
+        self.assertFalse(coordinates.flags.writeable)
+
+    def testCached(self):
+        path = self.writeStructure("a.xyz", [("C", 0, 0, 0)])
+        elements, coordinates = self.cache.get(path)
+        self.assertIs(self.cache.get(path)[1], coordinates)
+
+    def testModifiedFileIsParsedAgain(self):
+        path = self.writeStructure("a.xyz", [("C", 0, 0, 0)])
+        self.cache.get(path)
+        self.writeStructure("a.xyz", [("N", 0, 0, 0), ("O", 1, 1, 1)], mtime=2000)
+        elements, coordinates = self.cache.get(path)
+        self.assertEqual(list(elements), ["N", "O"])
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        paths = [self.writeStructure(name, [("C", 0, 0, 0)]) for name in ("a", "b", "c")]
+        a = self.cache.get(paths[0])[1]
+        b = self.cache.get(paths[1])[1]
+        self.cache.get(paths[0])
+        self.cache.get(paths[2])
+        self.assertIs(self.cache.get(paths[0])[1], a)
+        self.assertIsNot(self.cache.get(paths[1])[1], b)
+
+    def testMissingFile(self):
+        self.assertRaises(IOError, self.cache.get, os.path.join(self.directory, "missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
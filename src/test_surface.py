@@ -0,0 +1,77 @@
+import math
+import unittest
+
+import numpy as np
+
+from atom_pair import AtomPair
+from surface import Surface, halfCellsOnLine
+
+
+def halfCellOf(x, y):
+    return (int(math.floor(x / (AtomPair.XSIZE / 2.0))),
+            int(math.floor(y / float(AtomPair.YSIZE))))
+
+
+class HalfCellsOnLineTest(unittest.TestCase):
+
+    def testPoint(self):
+        self.assertEqual(list(halfCellsOnLine(30, 30, 30, 30)), [(1, 1)])
+
+    def testHorizontal(self):
+        self.assertEqual(list(halfCellsOnLine(60, 10, -10, 10)),
+                         [(2, 0), (1, 0), (0, 0), (-1, 0)])
+
+    def testCrossesEverySampledCell(self):
+        random = np.random.RandomState(0)
+        for x0, y0, x1, y1 in random.uniform(-300, 300, (50, 4)):
+            cells = list(halfCellsOnLine(x0, y0, x1, y1))
+            self.assertEqual(cells[0], halfCellOf(x0, y0))
+            self.assertEqual(cells[-1], halfCellOf(x1, y1))
+            # Every step moves to a neighbouring half cell
+            for (i0, j0), (i1, j1) in zip(cells, cells[1:]):
+                self.assertEqual(abs(i1 - i0) + abs(j1 - j0), 1)
+            sampled = set(halfCellOf(x0 + t * (x1 - x0), y0 + t * (y1 - y0))
+                          for t in np.linspace(0, 1, 2000))
+            self.assertTrue(sampled.issubset(cells))
+
+
+class Borders(Surface):
+    """Surface with fixed borders that isn't added to a scene."""
+
+    def __init__(self, left, top, right, bottom):
+        self.borders = (left, top, right, bottom)
+
+    def left(self):
+        return self.borders[0]
+
+    def top(self):
+        return self.borders[1]
+
+    def right(self):
+        return self.borders[2]
+
+    def bottom(self):
+        return self.borders[3]
+
+
+class OnSurfaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.surface = Borders(-100, 50, 400, 300)
+
+    def testContainsRect(self):
+        self.assertTrue(self.surface.containsRect(-100, 50, 400, 300))
+        # The shape of the surface extends 2 units past the borders
+        self.assertTrue(self.surface.containsRect(-102, 48, 402, 302))
+        self.assertFalse(self.surface.containsRect(-103, 100, 0, 200))
+        self.assertFalse(self.surface.containsRect(0, 100, 100, 303))
+
+    def testCellOnSurface(self):
+        self.assertTrue(self.surface.cellOnSurface(-2, 2))
+        self.assertTrue(self.surface.cellOnSurface(7, 11))
+        self.assertFalse(self.surface.cellOnSurface(8, 11))
+        self.assertFalse(self.surface.cellOnSurface(0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from tile_cache import TileCache, clipRect
+
+
+class Tile(object):
+    """Stands in for the pixmap of a rendered tile."""
+
+    def width(self):
+        return 10
+
+    def height(self):
+        return 20
+
+
+class TileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TileCache()
+        self.cache.bounds = (0, 0, 4 * TileCache.TILE_COLUMNS, 3 * TileCache.TILE_ROWS)
+        for tile_y in range(3):
+            for tile_x in range(4):
+                self.cache.tiles[tile_x, tile_y] = Tile()
+        self.cache.pixels = 12 * 200
+
+    def assertTiles(self, keys):
+        self.assertEqual(sorted(self.cache.tiles), sorted(keys))
+        self.assertEqual(self.cache.pixels, 200 * len(keys))
+
+    def allTilesBut(self, keys):
+        return [(x, y) for y in range(3) for x in range(4) if (x, y) not in keys]
+
+    def testInvalidateCell(self):
+        self.cache.invalidateCell(TileCache.TILE_COLUMNS, 2 * TileCache.TILE_ROWS - 1)
+        self.assertTiles(self.allTilesBut([(1, 1)]))
+
+    def testInvalidateRect(self):
+        # From the last cell of tile (0, 0) to the first cell of tile (2, 1)
+        self.cache.invalidateRect(TileCache.TILE_COLUMNS - 1, TileCache.TILE_ROWS - 1,
+                                  2 * TileCache.TILE_COLUMNS + 1, TileCache.TILE_ROWS + 1)
+        self.assertTiles(self.allTilesBut([(0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1)]))
+        self.cache.invalidateRect(0, 0, 0, 10)
+        self.assertEqual(len(self.cache.tiles), 6)
+
+    def testSetBounds(self):
+        # Moving the right border in to the last column of tiles only drops
+        # that column
+        left, top, right, bottom = self.cache.bounds
+        self.cache.setBounds((left, top, right - 1, bottom))
+        self.assertTiles(self.allTilesBut([(3, 0), (3, 1), (3, 2)]))
+
+    def testClipRect(self):
+        self.assertEqual(clipRect((0, 0, 10, 10), (5, -5, 20, 8)), (5, 0, 10, 8))
+        self.assertIsNone(clipRect((0, 0, 10, 10), (10, 0, 20, 10)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+
+import numpy as np
+
+from layer_grid import LayerGrid
+from undo_journal import UndoJournal, SelectionLift, SelectionFill, ItemMove
+
+
+class Layer(object):
+    """Layer holding only the grid the selections are lifted from."""
+
+    def __init__(self, left_status, right_status):
+        self.grid = LayerGrid()
+        self.grid.setRect(0, 0, left_status, right_status)
+
+    def setRect(self, left, top, left_status, right_status):
+        self.grid.setRect(left, top, left_status, right_status)
+
+    def status(self):
+        rows, columns = self.grid.rows(), self.grid.columns()
+        return [array.tolist() for array in self.grid.getRect(0, 0, columns, rows)]
+
+
+class Selection(object):
+    """Selection of the cells from column to column + columns on the first
+    row, lifted and dropped the same way as SelectionBox.
+    """
+
+    def __init__(self, layer, column, columns):
+        self.layer = layer
+        self.column = column
+        self.columns = columns
+        self.left_status = np.zeros((0, 0), dtype=LayerGrid.DTYPE)
+        self.right_status = np.zeros((0, 0), dtype=LayerGrid.DTYPE)
+        self.present = True
+
+    def cellRect(self):
+        return (self.column, 0, self.column + self.columns, 1)
+
+    def hasCells(self):
+        return self.left_status.size > 0
+
+    def populate(self):
+        left, top, right, bottom = self.cellRect()
+        self.left_status, self.right_status = self.layer.grid.getRect(left, top, right, bottom)
+        self.layer.setRect(left, top, np.zeros_like(self.left_status),
+                           np.zeros_like(self.right_status))
+
+    def drop(self):
+        if self.hasCells():
+            left, top = self.cellRect()[:2]
+            self.layer.setRect(left, top, self.left_status, self.right_status)
+
+    def reset(self):
+        self.present = False
+
+    def restore(self, layer):
+        self.present = True
+
+    def statusChanged(self):
+        pass
+
+    def pos(self):
+        return self.column
+
+    def setPos(self, column):
+        self.column = column
+
+    def rotation(self):
+        return 0
+
+    def setRotation(self, rotation):
+        pass
+
+
+class SelectionEditTest(unittest.TestCase):
+
+    LEFT = [[0, 1, 2, 3, 4, 0, 1, 2, 3, 4]]
+    RIGHT = [[4, 3, 2, 1, 0, 4, 3, 2, 1, 0]]
+
+    def setUp(self):
+        self.layer = Layer(np.array(self.LEFT, dtype=LayerGrid.DTYPE),
+                           np.array(self.RIGHT, dtype=LayerGrid.DTYPE))
+        self.journal = UndoJournal()
+        self.selection = Selection(self.layer, 1, 2)
+
+    def select(self):
+        self.selection.populate()
+        self.journal.record(SelectionLift(self.selection, self.layer))
+
+    def move(self, column):
+        old_column = self.selection.column
+        self.selection.column = column
+        self.journal.record(ItemMove(self.selection, old_column, 0))
+
+    def deselect(self):
+        self.journal.record(SelectionLift(self.selection, self.layer, False))
+        self.selection.drop()
+        self.selection.reset()
+
+    def undoAll(self):
+        while self.journal.undo():
+            pass
+
+    def redoAll(self):
+        while self.journal.redo():
+            pass
+
+    def testSelect(self):
+        self.select()
+        self.assertEqual(self.layer.status()[0], [[0, 0, 0, 3, 4, 0, 1, 2, 3, 4]])
+        self.undoAll()
+        self.assertEqual(self.layer.status(), [self.LEFT, self.RIGHT])
+        self.assertFalse(self.selection.present)
+        self.redoAll()
+        self.assertEqual(self.layer.status()[0], [[0, 0, 0, 3, 4, 0, 1, 2, 3, 4]])
+        self.assertEqual(self.selection.left_status.tolist(), [[1, 2]])
+
+    def testMoveAndDeselect(self):
+        self.select()
+        self.move(4)
+        self.deselect()
+        moved = [[[0, 0, 0, 3, 1, 2, 1, 2, 3, 4]], [[4, 0, 0, 1, 3, 2, 3, 2, 1, 0]]]
+        self.assertEqual(self.layer.status(), moved)
+        self.undoAll()
+        self.assertEqual(self.layer.status(), [self.LEFT, self.RIGHT])
+        self.redoAll()
+        self.assertEqual(self.layer.status(), moved)
+        self.assertFalse(self.selection.present)
+
+    def testUndoDeselectRestoresCoveredCells(self):
+        self.select()
+        self.move(4)
+        self.deselect()
+        self.journal.undo()
+        # The cells the selection was dropped on are back on the layer and
+        # the selection holds its own hydrogen again
+        self.assertEqual(self.layer.status(), [[[0, 0, 0, 3, 4, 0, 1, 2, 3, 4]],
+                                               [[4, 0, 0, 1, 0, 4, 3, 2, 1, 0]]])
+        self.assertEqual(self.selection.left_status.tolist(), [[1, 2]])
+        self.assertTrue(self.selection.present)
+
+    def testFill(self):
+        self.select()
+        edit = SelectionFill(self.selection, 4, 3)
+        edit.redo()
+        self.journal.record(edit)
+        self.assertEqual(self.selection.left_status.tolist(), [[4, 4]])
+        self.journal.undo()
+        self.assertEqual(self.selection.left_status.tolist(), [[1, 2]])
+        self.assertEqual(self.selection.right_status.tolist(), [[3, 2]])
+        self.journal.redo()
+        self.assertEqual(self.selection.right_status.tolist(), [[3, 3]])
+
+
+if __name__ == "__main__":
+    unittest.main()
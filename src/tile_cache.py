@@ -0,0 +1,137 @@
+from collections import OrderedDict
+import math
+
+from PyQt4 import QtGui, QtCore
+
+from atom_pair import AtomPair
+
+
+class TileCache(object):
+    """Cache of the painted hydrogen of a layer split in to tiles.
+
+    Each tile covers TILE_COLUMNS x TILE_ROWS cells and is rendered in to a
+    pixmap at the scale of the view. The tiles are invalidated when a cell
+    inside them changes and all of them are dropped when the scale changes.
+    Resizing the layer only drops the tiles along the moved borders. When
+    the cache grows past MAX_PIXELS the least recently used tiles are
+    evicted.
+    """
+
+    TILE_COLUMNS = 8
+    TILE_ROWS = 16
+    MAX_PIXELS = 1 << 25
+
+    def __init__(self):
+        self.tiles = OrderedDict()
+        self.pixels = 0
+        self.scale = None
+        self.bounds = None
+
+    def clear(self):
+        """Drop all the tiles."""
+        self.tiles.clear()
+        self.pixels = 0
+
+    def tileOf(self, column, row):
+        """Return the key of the tile containing the cell at (column, row)."""
+        return column // self.TILE_COLUMNS, row // self.TILE_ROWS
+
+    def invalidateCell(self, column, row):
+        """Drop the tile containing the cell at (column, row)."""
+        tile = self.tiles.pop(self.tileOf(column, row), None)
+        if tile is not None:
+            self.pixels -= tile.width() * tile.height()
+
+    def invalidateRect(self, left, top, right, bottom):
+        """Drop the tiles overlapping the grid rectangle."""
+        if left >= right or top >= bottom:
+            return
+        tile_left, tile_top = self.tileOf(left, top)
+        tile_right, tile_bottom = self.tileOf(right - 1, bottom - 1)
+        for key in self.tiles.keys():
+            if tile_left <= key[0] <= tile_right and tile_top <= key[1] <= tile_bottom:
+                self.pixels -= self.tiles[key].width() * self.tiles[key].height()
+                del self.tiles[key]
+
+    def setBounds(self, bounds):
+        """Set the grid bounds of the painted cells. Only the tiles that
+        paint different cells inside the new bounds are dropped.
+        """
+        old_bounds = self.bounds
+        self.bounds = bounds
+        if old_bounds is None:
+            return
+        for key in self.tiles.keys():
+            left = key[0] * self.TILE_COLUMNS
+            top = key[1] * self.TILE_ROWS
+            tile = (left, top, left + self.TILE_COLUMNS, top + self.TILE_ROWS)
+            if clipRect(tile, old_bounds) != clipRect(tile, bounds):
+                self.pixels -= self.tiles[key].width() * self.tiles[key].height()
+                del self.tiles[key]
+
+    def paint(self, painter, grid, bounds, scale, left, top, right, bottom):
+        """Paint the cells of the grid inside the grid rectangle. Only the
+        cells inside bounds are painted.
+        """
+        if scale != self.scale:
+            self.clear()
+            self.scale = scale
+        if bounds != self.bounds:
+            self.setBounds(bounds)
+        tile_left, tile_top = self.tileOf(left, top)
+        tile_right, tile_bottom = self.tileOf(right - 1, bottom - 1)
+        width = self.TILE_COLUMNS * AtomPair.XSIZE
+        height = self.TILE_ROWS * AtomPair.YSIZE
+        for tile_y in range(tile_top, tile_bottom + 1):
+            for tile_x in range(tile_left, tile_right + 1):
+                key = (tile_x, tile_y)
+                tile = self.tiles.pop(key, None)
+                if tile is None:
+                    tile = self.render(grid, tile_x, tile_y)
+                    self.pixels += tile.width() * tile.height()
+                self.tiles[key] = tile
+                painter.drawPixmap(QtCore.QRectF(tile_x * width, tile_y * height,
+                                                 width, height),
+                                   tile, QtCore.QRectF(tile.rect()))
+        while self.pixels > self.MAX_PIXELS and len(self.tiles) > 1:
+            key, tile = self.tiles.popitem(last=False)
+            self.pixels -= tile.width() * tile.height()
+
+    def render(self, grid, tile_x, tile_y):
+        """Render the tile at (tile_x, tile_y) in to a new pixmap."""
+        width = self.TILE_COLUMNS * AtomPair.XSIZE
+        height = self.TILE_ROWS * AtomPair.YSIZE
+        tile = QtGui.QPixmap(int(math.ceil(width * self.scale)),
+                             int(math.ceil(height * self.scale)))
+        tile.fill(QtCore.Qt.transparent)
+        left = max(tile_x * self.TILE_COLUMNS, self.bounds[0])
+        top = max(tile_y * self.TILE_ROWS, self.bounds[1])
+        right = min((tile_x + 1) * self.TILE_COLUMNS, self.bounds[2])
+        bottom = min((tile_y + 1) * self.TILE_ROWS, self.bounds[3])
+        left_status, right_status = grid.getRect(left, top, right, bottom)
+        painter = QtGui.QPainter(tile)
+        # Scale exactly to the size of the pixmap so that the tiles line up
+        painter.scale(float(tile.width()) / width, float(tile.height()) / height)
+        painter.translate(-tile_x * width, -tile_y * height)
+        painter.setPen(AtomPair.PEN)
+        for row in range(top, bottom):
+            y = row * AtomPair.YSIZE
+            for column in range(left, right):
+                AtomPair.paintPair(painter, column * AtomPair.XSIZE, y,
+                                   left_status[row - top, column - left],
+                                   right_status[row - top, column - left])
+        painter.end()
+        return tile
+
+
+def clipRect(rect, bounds):
+    """Return the part of the grid rectangle rect inside bounds or None if
+    they don't overlap.
+    """
+    left = max(rect[0], bounds[0])
+    top = max(rect[1], bounds[1])
+    right = min(rect[2], bounds[2])
+    bottom = min(rect[3], bounds[3])
+    if left >= right or top >= bottom:
+        return None
+    return left, top, right, bottom
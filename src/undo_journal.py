@@ -0,0 +1,246 @@
+import numpy as np
+
+
+class UndoJournal(object):
+    """Undo and redo stacks of the edits done to a scene.
+
+    Every edit only stores what it changed, such as the old and new
+    statuses of the painted cells or the old and new position of a moved
+    item, so the memory used grows with the edits and not with the size
+    of the scene. At most MAX_EDITS edits are kept. If listener is given
+    it is called with every edit that is done, undone or redone.
+    """
+
+    MAX_EDITS = 1000
+
+    def __init__(self, listener=None):
+        self.undo_edits = []
+        self.redo_edits = []
+        self.listener = listener
+
+    def notify(self, edit):
+        if self.listener is not None:
+            self.listener(edit)
+
+    def record(self, edit):
+        """Add an edit that was just done. The edits that were undone
+        can't be redone after that.
+        """
+        self.undo_edits.append(edit)
+        del self.undo_edits[:-self.MAX_EDITS]
+        self.redo_edits = []
+        self.notify(edit)
+
+    def undo(self):
+        """Undo the latest edit. Return False if there was nothing to undo."""
+        if not self.undo_edits:
+            return False
+        edit = self.undo_edits.pop()
+        edit.undo()
+        self.redo_edits.append(edit)
+        self.notify(edit)
+        return True
+
+    def redo(self):
+        """Redo the latest undone edit. Return False if there was nothing
+        to redo.
+        """
+        if not self.redo_edits:
+            return False
+        edit = self.redo_edits.pop()
+        edit.redo()
+        self.undo_edits.append(edit)
+        self.notify(edit)
+        return True
+
+    def clear(self):
+        """Forget all the edits."""
+        self.undo_edits = []
+        self.redo_edits = []
+
+
+class CellEdit(object):
+    """Changes to the statuses of single cells, such as a paint stroke.
+
+    The owners of the cells are layers or selections. They provide
+    getStatus, setStatus and updateCell for cells in grid coordinates.
+    Call record before a cell is changed and finish once the edit is done.
+    """
+
+    def __init__(self):
+        self.old_status = {}
+        self.cells = {}
+
+    def record(self, owner, column, row):
+        """Remember the status of the cell before it is changed."""
+        old_status = self.old_status.setdefault(owner, {})
+        if (column, row) not in old_status:
+            old_status[(column, row)] = owner.getStatus(column, row)
+
+    def finish(self):
+        """Store the old and new statuses of the changed cells as arrays of
+        columns, rows, old statuses and new statuses for every owner.
+        """
+        for owner, old_status in self.old_status.iteritems():
+            cells = [(column, row) + old + owner.getStatus(column, row)
+                     for (column, row), old in old_status.iteritems()]
+            cells = np.array([cell for cell in cells if cell[2:4] != cell[4:6]],
+                             dtype=int).reshape(-1, 6)
+            if len(cells):
+                self.cells[owner] = cells
+        self.old_status = None
+
+    def isEmpty(self):
+        """Check if the edit didn't change any cells."""
+        return not self.cells
+
+    def undo(self):
+        self.setStatus(2)
+
+    def redo(self):
+        self.setStatus(4)
+
+    def setStatus(self, i):
+        """Set the cells to the statuses in the columns i and i + 1."""
+        for owner, cells in self.cells.iteritems():
+            for cell in cells:
+                owner.setStatus(cell[0], cell[1], cell[i], cell[i + 1])
+                owner.updateCell(cell[0], cell[1])
+
+
+class SelectionFill(object):
+    """Setting the hydrogen of a selection to new left and right statuses.
+    The statuses are arrays covering the selection or single statuses
+    for all of its hydrogen.
+    """
+
+    def __init__(self, selection, left_status, right_status):
+        self.selection = selection
+        self.new_left_status = left_status
+        self.new_right_status = right_status
+        self.left_status = selection.left_status.copy()
+        self.right_status = selection.right_status.copy()
+
+    def undo(self):
+        self.selection.left_status[:] = self.left_status
+        self.selection.right_status[:] = self.right_status
+        self.selection.statusChanged()
+
+    def redo(self):
+        self.selection.left_status[:] = self.new_left_status
+        self.selection.right_status[:] = self.new_right_status
+        self.selection.statusChanged()
+
+
+class SelectionLift(object):
+    """Lifting the hydrogen of a layer in to a new selection, or with
+    lifted False, deselecting a selection. Deselecting overwrites the
+    cells of the layer under the selection, so they are stored to be
+    written back when the deselect is undone.
+    """
+
+    def __init__(self, selection, layer, lifted=True):
+        self.selection = selection
+        self.layer = layer
+        self.lifted = lifted
+        if not lifted:
+            left, top, right, bottom = selection.cellRect()
+            self.corner = (left, top)
+            self.covered = layer.grid.getRect(left, top, right, bottom)
+            self.left_status = selection.left_status.copy()
+            self.right_status = selection.right_status.copy()
+
+    def undo(self):
+        if self.lifted:
+            self.selection.drop()
+            self.selection.reset()
+        else:
+            self.selection.left_status = self.left_status.copy()
+            self.selection.right_status = self.right_status.copy()
+            self.selection.restore(self.layer)
+            left, top = self.corner
+            self.layer.setRect(left, top, *self.covered)
+
+    def redo(self):
+        if self.lifted:
+            self.selection.restore(self.layer)
+            self.selection.populate()
+        else:
+            self.selection.drop()
+            self.selection.reset()
+
+
+class ItemPresence(object):
+    """Adding an item to a layer, or with added False, removing it. The
+    item provides reset to remove it and restore to add it back.
+    """
+
+    def __init__(self, item, layer, added=True):
+        self.item = item
+        self.layer = layer
+        self.added = added
+
+    def undo(self):
+        self.setPresent(not self.added)
+
+    def redo(self):
+        self.setPresent(self.added)
+
+    def setPresent(self, present):
+        if present:
+            self.item.restore(self.layer)
+        else:
+            self.item.reset()
+
+
+class ItemMove(object):
+    """Moving or rotating an item."""
+
+    def __init__(self, item, old_pos, old_rotation):
+        self.item = item
+        self.old_pos = old_pos
+        self.old_rotation = old_rotation
+        self.new_pos = item.pos()
+        self.new_rotation = item.rotation()
+
+    def isEmpty(self):
+        """Check if the item stayed in place."""
+        return self.old_pos == self.new_pos and self.old_rotation == self.new_rotation
+
+    def undo(self):
+        self.move(self.old_pos, self.old_rotation)
+
+    def redo(self):
+        self.move(self.new_pos, self.new_rotation)
+
+    def move(self, pos, rotation):
+        self.item.setPos(pos)
+        self.item.setRotation(rotation)
+        # Selections index their cells by their position
+        update_indexing = getattr(self.item, "updateIndexing", None)
+        if update_indexing is not None:
+            update_indexing()
+
+
+class SurfaceResize(object):
+    """Resizing the layers of a scene. The hydrogen dropped from each
+    layer are stored as the arrays returned by Surface.endResize.
+    """
+
+    def __init__(self, scene, old_rect, dropped):
+        self.scene = scene
+        self.old_rect = old_rect
+        self.new_rect = scene.current_layer.rect()
+        self.dropped = dropped
+
+    def isEmpty(self):
+        """Check if the size of the layers stayed the same."""
+        return self.old_rect == self.new_rect
+
+    def undo(self):
+        self.scene.setLayerRect(self.old_rect)
+        for layer, cells in self.dropped:
+            layer.setCells(*cells)
+
+    def redo(self):
+        self.scene.setLayerRect(self.new_rect)